@@ -76,10 +76,14 @@ class App(ThemedTk):
 		# check if we were passed a command line argument
 		parser = argparse.ArgumentParser(prog='UltraTrace')
 		parser.add_argument('path', help='path (unique to a participant) where subdirectories contain raw data', default=None, nargs='?')
+		parser.add_argument('--frame-cache', help='megabytes of decoded ultrasound frames to keep in memory', type=int, default=256)
+		parser.add_argument('--journal', help='record trace edits in an append-only journal instead of rewriting metadata.json', action='store_true')
+		parser.add_argument('--no-rescan', help="don't check an existing metadata.json for added, removed or changed files", dest='rescan', action='store_false')
 		args = parser.parse_args()
+		self.frameCacheBudget = args.frame_cache * 1024 * 1024
 
 		# initialize data module
-		self.Data = modules.Metadata( self, args.path )
+		self.Data = modules.Metadata( self, args.path, journal=args.journal, rescan=args.rescan )
 
 		# initialize the main app widgets
 		self.setWidgetDefaults()
@@ -107,8 +111,18 @@ class App(ThemedTk):
 
 		self.oldwidth = self.winfo_width()
 
+		# make sure deferred metadata writes make it to disk
+		self.protocol('WM_DELETE_WINDOW', self.onClose)
+
 		self.after(300,self.afterstartup)
 
+	def onClose(self):
+		'''
+		Handle closing the main window
+		'''
+		self.Data.flush()
+		self.destroy()
+
 	def setWidgetDefaults(self):
 		'''
 		Need to set up some defaults here before building Tk widgets (this is specifically
@@ -371,18 +385,8 @@ class App(ThemedTk):
 				self.selectBoxY = False
 
 				trace = self.Trace.getCurrentTraceName()
-				coords = []
-				x1True = None
-
-				if trace in self.Trace.crosshairs:
-					for ch in self.Trace.crosshairs[ trace ]:
-						if x1True == None:
-							x1True, y1True = ch.transformCoordsToTrue(x1,y1)
-							x2True, y2True = ch.transformCoordsToTrue(x2,y2)
-						if ch.isVisible:
-							x,y = ch.getTrueCoords()
-							if min(x1True,x2True) < x < max(x1True,x2True) and min(y1True,y2True) < y < max(y1True,y2True):
-								self.Trace.select(ch)
+				for ch in self.Trace.getInBox( trace, x1, y1, x2, y2 ):
+					self.Trace.select(ch)
 
 			self.isDragging = False
 			self.isClicked = False
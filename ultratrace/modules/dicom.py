@@ -1,7 +1,8 @@
 from .base import Module
 from .. import util
 from ..util.logging import *
-from ..util.framereader import ULTScanLineReader, DicomReader, DicomPNGReader, LABEL_TO_READER, READERS
+from ..util.framecache import FrameCache
+from ..util.framereader import ULTScanLineReader, DicomReader, DicomMemmapReader, DicomPNGReader, LABEL_TO_READER, READERS
 from ..widgets import Header
 
 import os
@@ -36,6 +37,7 @@ class Dicom(Module):
             self.method = StringVar(self.app)
             self.mode = None
             self.reader = None
+            self.cache = None
 
             # zoom buttons
             self.zbframe = Frame(self.app.LEFT)
@@ -82,7 +84,7 @@ class Dicom(Module):
         change the image on the zoom frame
         '''
         if self.reader and self.reader.loaded:
-            self.zframe.setImage(self.reader.getFrame(_frame or self.app.frame))
+            self.zframe.setImage(self.cache.getFrame(_frame or self.app.frame))
 
     def load(self, event=None):
         '''
@@ -98,11 +100,14 @@ class Dicom(Module):
     def chooseMethod(self, event=None):
         if self.mode:
             cls = LABEL_TO_READER[self.mode][self.method.get()]
+            self.closeReader()
             if self.mode == 'dicom':
                 dcm = self.app.Data.checkFileLevel('.dicom')
                 if dcm:
                   if cls == DicomPNGReader and self.app.Data.getFileLevel('processed'):
                     self.reader = cls(dcm, self.app.Data.path)
+                  elif cls == DicomMemmapReader:
+                    self.reader = cls(dcm, self.app.Data.getCacheDir('frames'))
                   else:
                     self.reader = cls(dcm)
                 else:
@@ -114,6 +119,8 @@ class Dicom(Module):
                     self.reader = cls(ult, meta)
                 else:
                     self.reader = None
+            if self.reader:
+                self.openCache()
             self.zframe.resetImageDimensions()
             if not self.reader:
                 self.loadBtn['state'] = 'disabled'
@@ -123,11 +130,31 @@ class Dicom(Module):
             else:
                 self.loadBtn['state'] = 'normal'
 
+    def openCache(self):
+        '''
+        put a cache of decoded frames (which prefetches frames around the current
+        one in the background) in front of the reader
+        '''
+        self.cache = FrameCache(self.reader, self.app.frameCacheBudget)
+        try:
+            self.cache.framecount = len(self.reader.getFrameTimes())
+        except Exception as e:
+            debug('Dicom: unable to count frames (%s)' % e)
+
+    def closeReader(self):
+        if self.cache:
+            debug('Dicom: frame cache stats %s' % self.cache.getStats())
+            self.cache.close()
+        if self.reader:
+            self.reader.close()
+        self.cache = None
+        self.reader = None
+
     def isLoaded(self):
         return self.reader and self.reader.loaded
 
     def getFrames(self, framenums):
-        return [self.reader.getFrame(int(x)) for x in framenums]
+        return [self.cache.getFrame(int(x)) for x in framenums]
 
     def getFrameTimes(self):
         if self.reader:
@@ -155,7 +182,7 @@ class Dicom(Module):
         self.frame.destroy()
         self.frame = Frame(self.frame_holder)
         self.frame.pack(expand=True)
-        self.reader = None
+        self.closeReader()
 
         if self.app.Data.getFileLevel('.dicom'):
             self.mode = 'dicom'
@@ -1,21 +1,43 @@
 from .base import Module
 from ..util.logging import *
 from .. import util
-from tqdm import tqdm
+from ..util.scanner import DirectoryScanner
+from ..util import headercache
 
+import atexit
 import json
 import os
 import math
+import numpy as np
 
 from tkinter import filedialog
-from magic import Magic # python-magic
 
 class Metadata(Module):
-    def __init__(self, app, path):
+    # we want each object to have entries for everything here
+    FILE_KEYS = { '_prev', '_next', 'processed', 'offset' }
+    MIMEs = {
+        'audio/x-wav'       :   ['.wav'],
+        'audio/x-flac'      :   ['.flac'],
+        'audio/wav'     :   ['.wav'],
+        'audio/flac'        :   ['.flac'],
+        'application/dicom' :   ['.dicom'],
+        'text/plain'        :   ['.TextGrid', 'US.txt', '.txt', '.dat', '.param'],
+        'application/octet-stream' : ['.ult'],
+        'application/x-dosexec'    : ['.ult'],
+        'application/zlib'         : ['.ult']
+    }
+
+    def __init__(self, app, path, journal=False, rescan=True):
         '''
         opens a metadata file (or creates one if it doesn't exist), recursively searches a directory
             for acceptable files, writes metadata back into memory, and returns the metadata object
 
+        if `journal` is set, edits to traces are appended to a journal file (see appendJournal())
+            instead of causing metadata.json to be rewritten
+
+        if `rescan` is set, an existing metadata file is brought up to date with any files
+            added, removed or changed since it was written (see rescan())
+
         acceptable files: the metadata file requires matching files w/in subdirectories based on filenames
             for example, it will try to locate files that have the same base filename and
             each of a set of required extensions
@@ -37,13 +59,31 @@ class Metadata(Module):
         self.app = app
         self.path = path
 
+        # so that switching files doesn't mean re-reading DICOM headers
+        headercache.setCacheDir( self.getCacheDir( 'headers' ) )
+
         self.mdfile = os.path.join( self.path, 'metadata.json' )
+        self.journalfile = os.path.join( self.path, 'metadata.journal' )
+
+        # writes are deferred and coalesced (see write() and flush())
+        self.dirty = False
+        self.writeJob = None
+        atexit.register( self.flush )
+
+        # trace edits since metadata.json was last written, when journaling
+        self.journal = journal
+        self.journalHandle = None
+        self.journalRecords = 0
 
         # either load up existing metadata
         if os.path.exists( self.mdfile ):
             info( "   - found metadata file: `%s`" % self.mdfile )
             with open( self.mdfile, 'r' ) as f:
                 self.data = json.load( f )
+            # bring in any edits that hadn't been folded into the snapshot yet
+            self.replayJournal()
+            if rescan:
+                self.rescan()
 
         # or create new stuff
         else:
@@ -63,118 +103,22 @@ class Metadata(Module):
                 'offset':0,
                 'files': {} }
 
-            # we want each object to have entries for everything here
-            fileKeys = { '_prev', '_next', 'processed', 'offset' } # and `processed`
-            MIMEs = {
-                'audio/x-wav'       :   ['.wav'],
-                'audio/x-flac'      :   ['.flac'],
-                'audio/wav'     :   ['.wav'],
-                'audio/flac'        :   ['.flac'],
-                'application/dicom' :   ['.dicom'],
-                'text/plain'        :   ['.TextGrid', 'US.txt', '.txt', '.dat', '.param'],
-                'application/octet-stream' : ['.ult'],
-                'application/x-dosexec'    : ['.ult'],
-                'application/zlib'         : ['.ult']
-            }
-            files = {}
-
-            splines = None
-
-            audio_relpath = None
-
-            # now get the objects in subdirectories
-            for path, dirs, fs in os.walk( self.path ):
-                if ".git" not in path:
-                    for f in tqdm(fs):
-                        if ".DS_Store" not in f:
-                            # exclude some filetypes explicitly here by MIME type
-                            filepath = os.path.join( path, f )
-                            filename, extension = os.path.splitext( f )
-                            fulDirFile = os.path.relpath(path, self.path)
-                            if fulDirFile[-1] != ".":
-                                new_filename = os.path.join(fulDirFile[-1], filename)
-                            else:
-                                new_filename = filename
-    
-                            # allow us to follow symlinks
-                            real_filepath = os.path.realpath(filepath)
-
-                            #make file path relative to metadata file
-                            filepath = os.path.relpath(filepath,start=self.path)
-
-                            mime_type = Magic(mime=True).from_file(real_filepath)
-
-                            # name mangling for ULT directories
-                            if mime_type == 'text/plain' and ((extension == '.txt' and filename.endswith('US')) or (extension == '.param')):
-                                filename = os.path.splitext(f)[0]
-                                if filename.endswith('US'):
-                                    new_filename = os.path.splitext(filepath)[0][:-2]
-                                else:
-                                    new_filename = os.path.splitext(filepath)[0]
-                                extension = 'US.txt'
-
-                            if extension == '.wav' and filename.endswith('_Track0'):
-                                audio_relpath = os.path.split(filepath)[0]
-                                filename = filename[:-7]
-                                new_filename = os.path.splitext(filepath)[0][:-7]
-                            elif extension == '.wav' and (filename.endswith('_Track1') or filename.endswith('_Track2')):
-                                audio_relpath = os.path.split(filepath)[0]
-                                continue
-                            elif extension == '.flac':
-                                audio_relpath = os.path.split(filepath)[0]
-                            elif extension == '.dat' and filename == 'SPLINES':
-                                splines = filepath
-                                continue
-
-                            if (mime_type == 'text/plain' or mime_type == 'application/json') and extension == '.measurement':
-                                debug('Found old measurement file {}'.format(filename))
-                                self.importOldMeasurement(real_filepath, filename)
-                            elif mime_type in MIMEs:
-                                # add `good` files
-                                #print(new_filename, mime_type)
-                                if extension in MIMEs[ mime_type ]:
-                                    if new_filename not in files:
-                                        files[new_filename] = { key:None for key in fileKeys }
-                                    files[new_filename][extension] = filepath
-                                if audio_relpath:    
-                                    files[new_filename]['audio_relpath'] = audio_relpath
-                                    audio_relpath = None
-                            elif mime_type == 'image/png' and '_dicom_to_png' in path:
-                                # check for preprocessed dicom files
-                                name, frame = filename.split( '_frame_' )
-                                #debug(files)
-                                # if len(files) > 0:
-                                # might be able to combine the following; check
-                                if name not in files:
-                                    files[name] = {'processed': None}
-                                if files[name]['processed'] == None:
-                                    files[name]['processed'] = {}
-                                files[name]['processed'][str(int(frame))] = filepath
+            files, splines = self.scanFiles()
 
             # check that we find at least one file
             if len(files) == 0:
-                severe( '   - ERROR: `%s` contains no supported files' % path )
+                severe( '   - ERROR: `%s` contains no supported files' % self.path )
                 exit()
 
-            # sort the files so that we can guess about left/right ... extrema get None/null
-            # also add in the "traces" bit here
-            _prev = None
-            #debug(files)
-            for key in sorted( files.keys() ):
-                if _prev != None:
-                    files[_prev]['_next'] = key
-                files[key]['_prev'] = _prev
-                _prev = key
-                files[key]['name'] = key
-
             # sort files, set the geometry, and write
-            self.data[ 'files' ] = [ files[key] for key in sorted(files.keys()) ]
+            self.data[ 'files' ] = self.linkFiles( files )
             self.data[ 'geometry' ] = '1150x800+1400+480'
 
             if splines != None:
                 self.importULTMeasurement(splines)
 
             self.write()
+            self.flush()
 
         self.app.geometry( self.getTopLevel('geometry') )
         self.files = self.getFilenames()
@@ -183,6 +127,141 @@ class Metadata(Module):
         self.filelabels = self.getFilelabels()
         #debug(self.filelabels)
 
+    def scanFiles(self, importMeasurements=True):
+        '''
+        Finds the files under our path, returning a dict of file entries (by name,
+        without `_prev`/`_next` links) and the path of the ULT splines file (if any)
+        '''
+        files = {}
+
+        splines = None
+
+        audio_relpath = None
+
+        # now get the objects in subdirectories (MIME types are sniffed in
+        # parallel, and cached so that rescanning is cheap)
+        scanner = DirectoryScanner(os.path.join(self.getCacheDir(), 'scan-cache.json'))
+        skip = lambda path: ".git" in path or ".ultratrace" in path
+        for entry in scanner.scan(self.path, skip):
+            path, f = entry.dirpath, entry.name
+            if ".DS_Store" not in f:
+                # exclude some filetypes explicitly here by MIME type
+                filepath = entry.path
+                filename, extension = os.path.splitext( f )
+                fulDirFile = os.path.relpath(path, self.path)
+                if fulDirFile[-1] != ".":
+                    new_filename = os.path.join(fulDirFile[-1], filename)
+                else:
+                    new_filename = filename
+    
+                # allow us to follow symlinks
+                real_filepath = entry.realpath
+
+                #make file path relative to metadata file
+                filepath = os.path.relpath(filepath,start=self.path)
+
+                mime_type = entry.mimeType
+
+                # name mangling for ULT directories
+                if mime_type == 'text/plain' and ((extension == '.txt' and filename.endswith('US')) or (extension == '.param')):
+                    filename = os.path.splitext(f)[0]
+                    if filename.endswith('US'):
+                        new_filename = os.path.splitext(filepath)[0][:-2]
+                    else:
+                        new_filename = os.path.splitext(filepath)[0]
+                    extension = 'US.txt'
+
+                if extension == '.wav' and filename.endswith('_Track0'):
+                    audio_relpath = os.path.split(filepath)[0]
+                    filename = filename[:-7]
+                    new_filename = os.path.splitext(filepath)[0][:-7]
+                elif extension == '.wav' and (filename.endswith('_Track1') or filename.endswith('_Track2')):
+                    audio_relpath = os.path.split(filepath)[0]
+                    continue
+                elif extension == '.flac':
+                    audio_relpath = os.path.split(filepath)[0]
+                elif extension == '.dat' and filename == 'SPLINES':
+                    splines = filepath
+                    continue
+
+                if (mime_type == 'text/plain' or mime_type == 'application/json') and extension == '.measurement':
+                    if importMeasurements:
+                        debug('Found old measurement file {}'.format(filename))
+                        self.importOldMeasurement(real_filepath, filename)
+                elif mime_type in self.MIMEs:
+                    # add `good` files
+                    #print(new_filename, mime_type)
+                    if extension in self.MIMEs[ mime_type ]:
+                        if new_filename not in files:
+                            files[new_filename] = { key:None for key in self.FILE_KEYS }
+                        files[new_filename][extension] = filepath
+                    if audio_relpath:    
+                        files[new_filename]['audio_relpath'] = audio_relpath
+                        audio_relpath = None
+                elif mime_type == 'image/png' and '_dicom_to_png' in path:
+                    # check for preprocessed dicom files
+                    name, frame = filename.split( '_frame_' )
+                    #debug(files)
+                    # if len(files) > 0:
+                    # might be able to combine the following; check
+                    if name not in files:
+                        files[name] = {'processed': None}
+                    if files[name]['processed'] == None:
+                        files[name]['processed'] = {}
+                    files[name]['processed'][str(int(frame))] = filepath
+
+        return files, splines
+
+    def linkFiles(self, files):
+        '''
+        Returns the file entries sorted by name and linked to their neighbours
+        '''
+        # sort the files so that we can guess about left/right ... extrema get None/null
+        _prev = None
+        for key in sorted( files.keys() ):
+            if _prev != None:
+                files[_prev]['_next'] = key
+            files[key]['_prev'] = _prev
+            _prev = key
+            files[key]['name'] = key
+        return [ files[key] for key in sorted(files.keys()) ]
+
+    def rescan(self):
+        '''
+        Brings the file entries up to date with what is on disk: entries are added
+        for new files, dropped when all their files are gone, and updated when
+        their files have changed.  Traces are kept as they are (including those of
+        removed files).  Returns the (added, removed, changed) file names
+        '''
+        info( '   - rescanning `%s`' % self.path )
+        scanned, _ = self.scanFiles(importMeasurements=False)
+        existing = { entry['name']: entry for entry in self.data['files'] }
+        added = sorted( name for name in scanned if name not in existing )
+        removed = sorted( name for name in existing if name not in scanned )
+        changed = []
+        files = {}
+        for name, new in scanned.items():
+            entry = existing.get(name)
+            if entry == None:
+                files[name] = new
+                continue
+            old = dict(entry)
+            # paths of media files that have gone
+            for key in list(entry.keys()):
+                if (key.startswith('.') or key == 'US.txt') and key not in new:
+                    del entry[key]
+            for key, value in new.items():
+                if key not in self.FILE_KEYS or key == 'processed':
+                    entry[key] = value
+            if entry != old:
+                changed.append(name)
+            files[name] = entry
+        if added or removed or changed:
+            info( '   - %d added, %d removed, %d changed' % (len(added), len(removed), len(changed)) )
+            self.data['files'] = self.linkFiles( files )
+            self.write()
+        return added, removed, sorted(changed)
+
     def importOldMeasurement(self, filepath, filename):
         '''
         Writes information from .measurement file into metadata file
@@ -210,12 +289,19 @@ class Metadata(Module):
         list_of_files[filenum][framenum] = new_array
 
     def importULTMeasurement(self, filepath):
+        '''
+        imports the splines of an AAA export (SPLINES.dat) as traces
+
+        every line of the export has a timestamp, the date string of its recording
+        and 42 (x, y) points (plus, optionally, their confidences) per trace; lines
+        are matched to recordings by the date in their prompt (.txt) file and to
+        frames by the timestamp
+        '''
         from ..util.framereader import ULTScanLineReader
         f = open(self.unrelativize(filepath), 'rb')
         contents = util.decode_bytes(f.read())
         f.close()
         data = [x.split('\t') for x in contents.splitlines()]
-        lines = []
         coords_loc = {}
         confidence_loc = {}
         offset = 3
@@ -232,71 +318,163 @@ class Metadata(Module):
                 offset += 42
         if defaultTrace:
             self.data['defaultTraceName'] = defaultTrace
-        for linenum, line in enumerate(data[1:], start=2):
+
+        # the column blocks of every line at once, as a (lines, columns) array of
+        # strings (with short lines padded with empty cells)
+        rows = data[1:]
+        width = max([offset] + [len(row) for row in rows])
+        table = np.array([row + [''] * (width - len(row)) for row in rows], dtype=str).reshape(len(rows), width)
+        table = np.char.replace(table, ',', '.')
+        points = {}
+        for k in coords_loc:
+            block = table[:, coords_loc[k]:coords_loc[k]+84].reshape(len(rows), 42, 2)
+            valid = (block != '').all(axis=2)
+            if k in confidence_loc:
+                conf = table[:, confidence_loc[k]:confidence_loc[k]+42]
+                valid &= (conf == '') | (np.where(conf == '', '0', conf).astype(float) > 50)
+            points[k] = (np.where(block == '', 'nan', block).astype(float), valid)
+
+        lines = []
+        for i, row in enumerate(rows):
             dt = {}
-            for k in coords_loc:
-                conf = [100]*42
-                if k in confidence_loc:
-                    offset = confidence_loc[k]
-                    for i in range(42):
-                        if line[i+offset]: conf[i] = int(line[i+offset])
-                pts = []
-                offset = coords_loc[k]
-                for i in range(42):
-                    xs = line[(2*i)+offset]
-                    ys = line[(2*i)+offset+1]
-                    if xs and ys and conf[i] > 50:
-                        pts.append((float(xs.replace(',', '.')), float(ys.replace(',', '.'))))
-                if pts:
-                    dt[k] = pts
+            for k, (coords, valid) in points.items():
+                if valid[i].any():
+                    dt[k] = coords[i][valid[i]]
             if dt:
-                lines.append((linenum, float(line[1].replace(',', '.')), line[2], dt))
+                lines.append((i + 2, float(row[1].replace(',', '.')), row[2], dt))
         self.data['traces'] = {k: {'color': 'red', 'files': {}} for k in coords_loc}
         # TODO: all traces are imported as the same color
+
+        # read every prompt once, and each recording's geometry and frame times
+        # only when a line is matched to it
+        recordings = []
+        for fblob in self.data['files']:
+            if '.txt' not in fblob or '.ult' not in fblob or 'US.txt' not in fblob:
+                continue
+            f = open(self.unrelativize(fblob['.txt']), 'rb')
+            recordings.append((fblob, util.decode_bytes(f.read())))
+            f.close()
+        matches = {}
+        readers = {}
+
         for linenum, timestamp, date, data in lines:
-            for fblob in self.data['files']:
-                if '.txt' not in fblob or '.ult' not in fblob or 'US.txt' not in fblob:
-                    continue
-                f = open(self.unrelativize(fblob['.txt']), 'rb')
-                byt = f.read()
-                f.close()
-                s = ''
-                for enc in ['utf-8', 'Windows-1251', 'Windows-1252', 'ISO-8859-1']:
-                    try:
-                        s = byt.decode(enc)
-                        break
-                    except:
-                        pass
-                if date in s:
-                    reader = ULTScanLineReader(self.unrelativize(fblob['.ult']), self.unrelativize(fblob['US.txt']))
-                    ts = reader.getFrameTimes()
-                    framenum = 0
-                    for i in range(len(ts)):
-                        if ts[i] >= timestamp:
-                            framenum = i-1
-                            break
-                    height = (reader.PixPerVector + reader.ZeroOffset) / reader.PixelsPerMm
-                    width = 2*math.cos((math.pi/2) - (reader.Angle * reader.NumVectors/2))*height
-                    for k in data:
-                        if fblob['name'] not in self.data['traces'][k]['files']:
-                            self.data['traces'][k]['files'][fblob['name']] = {}
-                        conv = []
-                        for pt in data[k]:
-                            conv.append({'x': pt[0] / width, 'y': 1 - (pt[1] / height)})
-                        self.data['traces'][k]['files'][fblob['name']][str(framenum)] = conv
-                    info('Line %s of %s imported as %s frame %s' % (linenum, filepath, fblob['name'], framenum))
-                    break
-            else:
+            if date not in matches:
+                # NB: only the first recording whose prompt has the date, as ever
+                matches[date] = next((fblob for fblob, s in recordings if date in s), None)
+            fblob = matches[date]
+            if fblob is None:
                 warn('Unable to import line %s of %s (could not match date %s)' % (linenum, filepath, date))
+                continue
+            name = fblob['name']
+            if name not in readers:
+                reader = ULTScanLineReader(self.unrelativize(fblob['.ult']), self.unrelativize(fblob['US.txt']))
+                height = (reader.PixPerVector + reader.ZeroOffset) / reader.PixelsPerMm
+                width = 2*math.cos((math.pi/2) - (reader.Angle * reader.NumVectors/2))*height
+                readers[name] = (reader.getFrameTimesArray(), width, height)
+            ts, width, height = readers[name]
+            # the frame before the first one at (or after) the timestamp
+            i = np.searchsorted(ts, timestamp)
+            framenum = int(i) - 1 if i < len(ts) else 0
+            for k in data:
+                if name not in self.data['traces'][k]['files']:
+                    self.data['traces'][k]['files'][name] = {}
+                xs = (data[k][:, 0] / width).tolist()
+                ys = (1 - (data[k][:, 1] / height)).tolist()
+                self.data['traces'][k]['files'][name][str(framenum)] = [{'x': x, 'y': y} for x, y in zip(xs, ys)]
+            info('Line %s of %s imported as %s frame %s' % (linenum, filepath, name, framenum))
+
+    # how long to wait after a change before writing metadata out to file, so that
+    # bursts of edits (e.g. dragging crosshairs) only cost a single write
+    WRITE_DELAY = 1000 # ms
 
     def write(self, _mdfile=None):
         '''
-        Write metadata out to file
+        Mark the metadata as changed; it gets written out to file WRITE_DELAY ms
+        after the first unsaved change (or on flush()).  If a filename is given,
+        write a copy there immediately instead.
+        '''
+        if _mdfile != None:
+            self.writeFile( _mdfile )
+            return
+        self.dirty = True
+        if self.writeJob == None:
+            self.writeJob = self.app.after( self.WRITE_DELAY, self.flush )
+
+    def flush(self):
+        '''
+        Write any unsaved changes out to file now (called on a timer and on exit),
+        which also compacts the journal
+        '''
+        if self.writeJob != None:
+            try:
+                self.app.after_cancel( self.writeJob )
+            except Exception: # the app may already be gone
+                pass
+            self.writeJob = None
+        if self.dirty or self.journalRecords:
+            self.writeFile( self.mdfile )
+            self.dirty = False
+            self.clearJournal()
+
+    # number of journal records after which we fold the journal into metadata.json
+    JOURNAL_COMPACT_SIZE = 1000
+
+    def appendJournal(self, trace, filename, frame, crosshairs):
+        '''
+        Record a trace edit as a single line at the end of the journal, which is
+        replayed over metadata.json on startup (so an edit costs O(edit) rather
+        than O(project), and a crash loses at most the record being written)
+        '''
+        if self.journalHandle == None:
+            self.journalHandle = open( self.journalfile, 'a' )
+        record = { 'trace':trace, 'file':filename, 'frame':frame, 'points':crosshairs }
+        self.journalHandle.write( json.dumps(record, separators=(',', ':')) + '\n' )
+        self.journalHandle.flush()
+        self.journalRecords += 1
+        if self.journalRecords >= self.JOURNAL_COMPACT_SIZE:
+            self.flush()
+
+    def replayJournal(self):
+        '''
+        Apply the records in the journal (if there is one) to self.data
+        '''
+        if not os.path.exists( self.journalfile ):
+            return
+        with open( self.journalfile, 'r' ) as f:
+            for linenum, line in enumerate(f, start=1):
+                try:
+                    record = json.loads( line )
+                except ValueError:
+                    # most likely the record we were writing when we crashed
+                    warn( 'Ignoring unreadable line %d of %s' % (linenum, self.journalfile) )
+                    continue
+                self.setTraceFrame( record['trace'], record['file'], record['frame'], record['points'] )
+                self.journalRecords += 1
+        info( '   - replayed %d edit(s) from `%s`' % (self.journalRecords, self.journalfile) )
+        # and fold them into metadata.json soon
+        self.write()
+
+    def clearJournal(self):
+        '''
+        Empty the journal once its records are in metadata.json
+        '''
+        if self.journalHandle != None:
+            self.journalHandle.close()
+            self.journalHandle = None
+        if os.path.exists( self.journalfile ):
+            os.remove( self.journalfile )
+        self.journalRecords = 0
+
+    def writeFile(self, mdfile):
+        '''
+        Write metadata out to file, atomically (so a crash mid-write can't leave
+        a truncated file behind)
         '''
         # debug(self.data, 'write')
-        mdfile = self.mdfile if _mdfile==None else _mdfile
-        with open( mdfile, 'w' ) as f:
-            json.dump( self.data, f, indent=3 )
+        tmpfile = mdfile + '.tmp'
+        with open( tmpfile, 'w' ) as f:
+            json.dump( self.data, f, separators=(',', ':') )
+        os.replace( tmpfile, mdfile )
 
     def getFilenames( self ):
         '''
@@ -331,6 +509,15 @@ class Metadata(Module):
             error(e)
             return None
 
+    def getCacheDir( self, *parts ):
+        '''
+        Returns (and creates, if needed) a directory inside the project's
+        `.ultratrace/` directory for storing derived data
+        '''
+        path = os.path.join( self.path, '.ultratrace', *parts )
+        os.makedirs( path, exist_ok=True )
+        return path
+
     def getTopLevel( self, key ):
         '''
         Get directory-level metadata
@@ -455,12 +642,21 @@ class Metadata(Module):
         trace = self.app.Trace.getCurrentTraceName()
         filename = self.getCurrentFilename()
         frame = self.app.frame
+        self.setTraceFrame( trace, filename, frame, crosshairs )
+        if self.journal:
+            self.appendJournal( trace, filename, frame, crosshairs )
+        else:
+            self.write()
+
+    def setTraceFrame( self, trace, filename, frame, crosshairs ):
+        '''
+        Sets the array of crosshairs for a given trace, file and frame
+        '''
         if trace not in self.data[ 'traces' ]:
             self.data[ 'traces' ][ trace ] = { 'files':{}, 'color':None }
         if filename not in self.data[ 'traces' ][ trace ][ 'files' ]:
             self.data[ 'traces' ][ trace ][ 'files' ][ filename ] = {}
         self.data[ 'traces' ][ trace ][ 'files' ][ filename ][ str(frame) ] = crosshairs
-        self.write()
 
     def tracesExist( self, trace ):
         '''
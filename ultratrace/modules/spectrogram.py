@@ -1,11 +1,12 @@
 from .base import Module
 from ..util.logging import *
 
-import math
 import PIL
 
-from tkinter.ttk import Button, Frame
-from tkinter import Canvas, DoubleVar
+from concurrent.futures import ThreadPoolExecutor
+
+from tkinter.ttk import Button, Frame, OptionMenu
+from tkinter import Canvas, DoubleVar, StringVar
 try:
     # ttk.Spinbox was added in Python 3.7
     from tkinter.ttk import Spinbox
@@ -15,14 +16,19 @@ except ImportError:
 LIBS_INSTALLED = False
 
 try:
-    import numpy as np
-    import parselmouth
     from PIL import ImageTk
+    from ..util import colormaps, spectrograms
     LIBS_INSTALLED = True
 except ImportError as e:
     warn(e)
 
 class Spectrogram(Module):
+
+    # how often (ms) to check for spectrograms computed in the background, and
+    # how many levels coarser than needed previews are
+    POLL_DELAY = 20
+    PREVIEW_LEVELS = 3
+
     def __init__(self,app):
         info( ' - initializing module: Spectrogram' )
 
@@ -35,10 +41,24 @@ class Spectrogram(Module):
         self.canvas_width = self.app.TextGrid.canvas_width
         self.canvas_height = 106
         self.canvas = Canvas(self.frame, width=self.canvas_width, height=self.canvas_height, background='gray', highlightthickness=0)
-        self.spectrogram = None
+        self.service = None
+        if LIBS_INSTALLED:
+            spectrograms.setCacheDir(self.app.Data.getCacheDir('spectrograms'))
+            self.service = spectrograms.SpectrogramService()
+            self.renderer = spectrograms.SpectrogramRenderer()
+        # spectrograms are computed by a single worker (Praat isn't thread-safe);
+        # `generation` counts redraws, so the worker can drop superseded views
+        self.worker = ThreadPoolExecutor(max_workers=1)
+        self.generation = 0
+        self.pending = []
+        self.pollJob = None
+        # seconds per pixel of the spectrogram (the shortest selection that
+        # counts as a drag; see App.onReleaseSpec)
+        self.ts = 0
         self.spec_freq_max = DoubleVar()
         self.wl = DoubleVar()
         self.dyn_range = DoubleVar()
+        self.colormap = StringVar()
         self.clicktime = -1
         self.specClick = False
         self.oldSelected = None
@@ -56,6 +76,9 @@ class Spectrogram(Module):
         dyn_range_box = Spinbox(self.spinwin, textvariable=self.dyn_range, command=self.drawSpectrogram, width=7, increment=10, from_=0, to_=10000)
         dyn_range_box.bind('<Return>',self.drawSpectrogram)
         dyn_range_box.bind('<Escape>',lambda ev: self.spinwin.focus())
+        # colouring only needs a redraw from the cached tiles
+        colormap_menu = OptionMenu(self.spinwin, self.colormap, self.colormap.get(),
+            *(colormaps.getNames() if LIBS_INSTALLED else []), command=self.drawSpectrogram)
         #buttons
         default_btn = Button(self.spinwin, text='Standards', command=self.restoreDefaults, takefocus=0)
         apply_btn = Button(self.spinwin, text='Apply', command=self.drawSpectrogram, takefocus=0, width=6)
@@ -65,8 +88,9 @@ class Spectrogram(Module):
         axis_ceil_box.grid(row=0, columnspan=2, sticky='ne')
         wl_box.grid(row=1, columnspan=2, sticky='ne')
         dyn_range_box.grid(row=2, columnspan=2, sticky='ne')
-        default_btn.grid(row=3)
-        apply_btn.grid(row=3, column=1)
+        colormap_menu.grid(row=3, columnspan=2, sticky='ne')
+        default_btn.grid(row=4)
+        apply_btn.grid(row=4, column=1)
 
         self.grid()
 
@@ -77,6 +101,8 @@ class Spectrogram(Module):
         self.spec_freq_max.set(5000.0)
         self.wl.set(0.005)
         self.dyn_range.set(90)
+        if LIBS_INSTALLED:
+            self.colormap.set(colormaps.DEFAULT)
 
     def restoreDefaults(self):
         self.doDefaults()
@@ -95,22 +121,27 @@ class Spectrogram(Module):
 
     def drawSpectrogram(self, event=None):
         '''
-        Extracts spectrogram data from sound, and draws it to canvas
+        Draws the spectrogram of the current view to canvas: straight away if we
+        have the tiles it needs, and otherwise from a coarser level we have (if
+        any) while the worker computes the rest
         '''
         if not LIBS_INSTALLED:
             return
 
+        # anything still being computed is for an older view
+        self.generation += 1
+        self.pending = []
+
         if self.app.Audio.current:
-            sound = parselmouth.Sound(self.app.Audio.current)
             self.canvas.delete('all')
 
-            ts_fac = 10000.0
             wl = self.wl.get()
             screen_start = self.app.TextGrid.start
             screen_end = self.app.TextGrid.end
             screen_duration = screen_end - screen_start
+            pyramid = self.service.getPyramid(self.app.Audio.current, wl, self.spec_freq_max.get())
             audio_start = 0
-            audio_end = sound.get_total_duration()
+            audio_end = pyramid.duration
             real_start = max(screen_start, audio_start)
             real_end = min(screen_end, audio_end)
             duration = real_end - real_start
@@ -118,58 +149,79 @@ class Spectrogram(Module):
             if duration <= 0:
                 return
 
-            self.ts = duration / ts_fac
-            # the amount taken off in spectrogram creation seems to be
-            # ( 2 * ts * floor( wl / ts ) ) + ( duration % ts )
-            # but we've defined ts as duration / 10000, so duration % ts = 0
-            # so the amount to increase the length by is ts * floor( wl / ts )
-            # at either end - D.S.
-            extra = self.ts * math.floor( wl / self.ts )
-            start_time = max(0, real_start - extra)
-            end_time = min(real_end + extra, sound.get_total_duration())
-            sound_clip = sound.extract_part(from_time=start_time, to_time=end_time)
-
-            spec = sound_clip.to_spectrogram(window_length=wl, time_step=self.ts, maximum_frequency=self.spec_freq_max.get())
-            self.spectrogram = 10 * np.log10(np.flip(spec.values, 0))
-
-            # self.spectrogram += self.spectrogram.min()
-            # self.spectrogram *= (60.0 / self.spectrogram.max())
-
-            mx = self.spectrogram.max()
-            dyn = self.dyn_range.get()
-            # debug(self.spectrogram.min(), self.spectrogram.max())
-            self.spectrogram = self.spectrogram.clip(mx-dyn, mx) - mx
-            # debug(self.spectrogram.min(), self.spectrogram.max())
-            self.spectrogram *= (-255.0 / dyn)
-            # self.spectrogram += 60
-            # debug(self.spectrogram.min(), self.spectrogram.max())
-
-            img = PIL.Image.fromarray(self.spectrogram)
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
-            # contrast = ImageEnhance.Contrast(img)
-            # img = contrast.enhance(5)
-            # self.canvas_height = img.height
-            img = img.resize((int(self.canvas_width*(duration / screen_duration)), self.canvas_height))
-
-            photo_img = ImageTk.PhotoImage(img)
-            self.canvas.config(height=self.canvas_height)
-
-            # self.canvas.create_image(0,0, anchor='nw', image=photo_img)
-            # self.canvas.create_image(self.canvas_width/2,self.canvas_height/2, image=photo_img)
-            if self.app.TextGrid.selectedItem:
-                tags = self.app.TextGrid.selectedItem[0].gettags(self.app.TextGrid.selectedItem[1])
-            coord = self.canvas_width
-            coord *= 1 - ((screen_end - real_end) / screen_duration)
-            img = self.canvas.create_image(coord, self.canvas_height, anchor='se', image=photo_img)
-            self.img = photo_img
-            #pass on selected-ness
-            if self.app.TextGrid.selectedItem:
-                if self.app.TextGrid.selectedItem[0] == self.canvas:
-                    self.app.TextGrid.selectedItem = (self.canvas, img)
-                    #pass on tags
-                    for tag in tags:
-                        self.canvas.addtag_all(tag)
+            width = int(self.canvas_width*(duration / screen_duration))
+            self.ts = duration / max(1, width)
+            view = (self.generation, real_start, real_end, screen_end, screen_duration, width, self.dyn_range.get())
+            level = pyramid.getLevel(real_start, real_end, width)
+            cached = pyramid.getCachedLevel(real_start, real_end, width)
+            if cached is not None:
+                self.showSpectrogram(view, pyramid.getView(real_start, real_end, width, level=cached))
+                if cached == level:
+                    return
+            elif level < pyramid.levels - 1:
+                # something to look at while the full resolution is computed
+                self.submit(view, pyramid, min(level + self.PREVIEW_LEVELS, pyramid.levels - 1))
+            self.submit(view, pyramid, level)
+
+    def submit(self, view, pyramid, level):
+        '''
+        Queues the computation of a view (at `level`) with the worker, and makes
+        sure we're checking for it to finish
+        '''
+        generation, real_start, real_end = view[:3]
+        isCancelled = lambda: generation != self.generation
+        self.pending.append((view, self.worker.submit(pyramid.getView, real_start, real_end, 0, level, isCancelled)))
+        if self.pollJob is None:
+            self.pollJob = self.app.after(self.POLL_DELAY, self.checkPending)
+
+    def checkPending(self):
+        '''
+        Draws whatever the worker has finished (on the Tk thread), and checks
+        again later if it's still busy
+        '''
+        self.pollJob = None
+        while self.pending and self.pending[0][1].done():
+            view, future = self.pending.pop(0)
+            try:
+                db = future.result()
+            except Exception as e:
+                error('Unable to compute spectrogram', e)
+                continue
+            if db is not None and view[0] == self.generation:
+                self.showSpectrogram(view, db)
+        if self.pending:
+            self.pollJob = self.app.after(self.POLL_DELAY, self.checkPending)
+
+    def showSpectrogram(self, view, db):
+        '''
+        Puts a view's dB matrix on canvas in the chosen colour map (under the
+        interval and frame lines), replacing any earlier (e.g. preview) image
+        '''
+        generation, real_start, real_end, screen_end, screen_duration, width, dyn = view
+        if db.shape[1] == 0:
+            return
+
+        rgb = self.renderer.render(db, dyn, width, self.canvas_height, colormaps.getLUT(self.colormap.get()))
+        photo_img = ImageTk.PhotoImage(PIL.Image.fromarray(rgb))
+        self.canvas.config(height=self.canvas_height)
+        self.canvas.delete('spectrogram')
+
+        # self.canvas.create_image(0,0, anchor='nw', image=photo_img)
+        # self.canvas.create_image(self.canvas_width/2,self.canvas_height/2, image=photo_img)
+        if self.app.TextGrid.selectedItem:
+            tags = self.app.TextGrid.selectedItem[0].gettags(self.app.TextGrid.selectedItem[1])
+        coord = self.canvas_width
+        coord *= 1 - ((screen_end - real_end) / screen_duration)
+        img = self.canvas.create_image(coord, self.canvas_height, anchor='se', image=photo_img, tags='spectrogram')
+        self.canvas.tag_lower(img)
+        self.img = photo_img
+        #pass on selected-ness
+        if self.app.TextGrid.selectedItem:
+            if self.app.TextGrid.selectedItem[0] == self.canvas:
+                self.app.TextGrid.selectedItem = (self.canvas, img)
+                #pass on tags
+                for tag in tags:
+                    self.canvas.addtag_all(tag)
 
     def drawInterval(self):
         '''
@@ -11,14 +11,13 @@ try:
     from tkinter.ttk import Spinbox
 except ImportError:
     from tkinter import Spinbox
-import tempfile
 import os
 
 LIBS_INSTALLED = False
 
 try:
     from textgrid import TextGrid as TextGridFile, IntervalTier, PointTier, Point # textgrid
-    from textgrid.exceptions import TextGridError
+    from ..util.textgridcache import readTextGrid, writeTextGrid
     LIBS_INSTALLED = True
 except ImportError as e:
     warn(e)
@@ -148,24 +147,12 @@ class TextGrid(Module):
             self.setup()
 
     def fromFile(self, filename):
+        '''
+        Returns the parsed TextGrid at `filename` (from the project-wide cache, if
+        it hasn't changed since we last parsed it)
+        '''
         if LIBS_INSTALLED:
-            try:
-                return TextGridFile.fromFile(filename)
-            except (TextGridError, UnicodeDecodeError) as e:
-                f = open(filename, 'rb')
-                contents = util.decode_bytes(f.read())
-                f.close()
-                if contents:
-                    tmp = tempfile.NamedTemporaryFile()
-                    tmp.write(contents.encode('utf-8'))
-                    tmp.seek(0)
-                    try:
-                        return TextGridFile.fromFile(tmp.name)
-                    except TextGridError as e:
-                        error(e)
-                        return None
-                else:
-                    error("can't load from file: unable to decode non-Unicode textgrid", filename)
+            return readTextGrid(filename)
         else:
             error("can't load from file: textgrid lib not installed")
             return None
@@ -237,8 +224,8 @@ class TextGrid(Module):
                 
 
         path = self.app.Data.unrelativize(self.app.Data.getFileLevel( '.TextGrid' ))
-        self.TextGrid.write(path)
-        self.TextGrid = TextGridFile.fromFile(path)
+        writeTextGrid(self.TextGrid, path)
+        self.TextGrid = readTextGrid(path)
         # reload to account for length changes due to frames tier being different length than audio
 
     @staticmethod
@@ -287,7 +274,7 @@ class TextGrid(Module):
             self.app.Data.write()
             # newTier.write(self.TextGrid.getFirst(self.frameTierName))
             self.fillCanvases()
-            self.TextGrid.write(self.app.Data.unrelativize(self.app.Data.getFileLevel( '.TextGrid' )))
+            writeTextGrid(self.TextGrid, self.app.Data.unrelativize(self.app.Data.getFileLevel( '.TextGrid' )))
 
 
         #except ValueError:
@@ -1,8 +1,10 @@
 from .base import Module
 from .. import util
 from ..util.logging import *
+from ..util.spatialindex import SpatialIndex
 from ..widgets import Crosshairs, Header
 
+import math
 import PIL
 import random
 
@@ -29,6 +31,14 @@ class Trace(Module):
 
         # dictionary to hold trace -> [crosshairs] data
         self.crosshairs = {}
+        # and trace -> SpatialIndex of those crosshairs' true coordinates, for
+        # hit-testing clicks and selection boxes
+        self.index = {}
+
+        # (filename, frame) the crosshairs were read for, and the zoom/pan they
+        # were drawn at (see getView())
+        self.shownFrame = None
+        self.view = None
 
         # set of currently selected crosshairs
         self.selected = set()
@@ -93,24 +103,53 @@ class Trace(Module):
         self.grid()
 
     def update(self):
-        ''' on change frames '''
-        # self.grid()
-        #NOTE this is called during zoom and pan
-            #this means the crosshairs are redrawn for every <Motion> call, which is a lot
-            #we could probably just move them instead
-        self.reset() # clear our crosshairs
-        self.read()  # read from file
-        #self.frame.update()
-        #debug("TraceModule", self.frame.winfo_width())
+        '''
+        on change frames, and on every zoom and pan (via ZoomFrame.showImage):
+        move the crosshairs we already have into place, then only add/remove the
+        ones that differ from what is stored for the current frame
+        '''
+        self.transform()
+        self.read()
     def reset(self):
         ''' on change files '''
-        # undraw all the crosshairs
+        # remove all the crosshairs from the canvas
         for trace in self.crosshairs:
             for ch in self.crosshairs[ trace ]:
-                ch.undraw()
+                ch.delete()
         # and empty out our trackers
         self.crosshairs = {}
+        self.index = {}
         self.selected = set()
+        self.shownFrame = None
+        self.view = None
+
+    def getView(self):
+        ''' the size and position of the (scaled) image our crosshairs are drawn on '''
+        zframe = self.app.Dicom.zframe
+        return ( zframe.width * zframe.imgscale, zframe.height * zframe.imgscale, zframe.panX, zframe.panY )
+    def transform(self):
+        '''
+        apply the change in zoom/pan since we last drew to all of our crosshairs,
+        as one scale + move of the canvas items (or, if the image was stretched
+        more one way than the other, which would stretch their arms too, by
+        redrawing each of them)
+        '''
+        view = self.getView()
+        old = self.view
+        self.view = view
+        if old == None or old == view:
+            return
+        if not( old[0] and old[1] ) or not math.isclose( view[0]/old[0], view[1]/old[1] ):
+            for trace in self.crosshairs:
+                for ch in self.crosshairs[ trace ]:
+                    ch.redraw()
+            return
+        canvas = self.app.Dicom.zframe.canvas
+        canvas.scale( 'crosshairs', old[2], old[3], view[0]/old[0], view[1]/old[1] )
+        canvas.move( 'crosshairs', view[2]-old[2], view[3]-old[3] )
+        for trace in self.crosshairs:
+            for ch in self.crosshairs[ trace ]:
+                ch.resetCoords()
 
     def add(self, x, y, _trace=None, transform=True):
         '''
@@ -119,10 +158,15 @@ class Trace(Module):
 
         trace = self.getCurrentTraceName() if _trace==None else _trace
         color  = self.available[ trace ]['color']
+        if self.view == None:
+            self.view = self.getView()
         ch = Crosshairs( self.app.Dicom.zframe, x, y, color, transform )
         if trace not in self.crosshairs:
             self.crosshairs[ trace ] = []
+            self.index[ trace ] = SpatialIndex()
         self.crosshairs[ trace ].append( ch )
+        ch.index = self.index[ trace ]
+        ch.index.add( ch, *ch.getTrueCoords() )
         return ch
     def remove(self, ch, write=True):
         '''
@@ -146,21 +190,48 @@ class Trace(Module):
 
     def read(self):
         '''
-        read a list of crosshair coordinates from the metadata file
+        sync our crosshairs with the coordinates stored in the metadata file for
+        the current frame, keeping the ones that are already on the canvas
         '''
-        frame = self.app.frame
+        frame = ( self.app.Data.getCurrentFilename(), self.app.frame )
+        if frame != self.shownFrame:
+            # crosshairs we've hidden can only be brought back by undo, which
+            # doesn't survive changing frames
+            self.unselectAll()
+            for trace in self.crosshairs:
+                for ch in self.crosshairs[ trace ]:
+                    if not ch.isVisible:
+                        ch.delete()
+                self.crosshairs[ trace ] = [ ch for ch in self.crosshairs[ trace ] if ch.isVisible ]
+            self.shownFrame = frame
+        # e.g. after renaming a trace
+        for trace in [ t for t in self.crosshairs if t not in self.available ]:
+            for ch in self.crosshairs.pop( trace ):
+                self.selected.discard( ch )
+                ch.delete()
+            del self.index[ trace ]
+
         for trace in self.available:
-            try:
-                newCrosshairs = []
-                for item in self.app.Data.getTraceCurrentFrame(trace):
-                    ch = self.add( item['x'], item['y'], _trace=trace, transform=False )
-                    if trace not in self.crosshairs:
-                        self.crosshairs[ trace ] = []
-                    self.crosshairs[ trace ].append( ch )
-                    newCrosshairs.append( ch )
+            shown = {}
+            for ch in self.crosshairs.get( trace, [] ):
+                if ch.isVisible:
+                    shown.setdefault( ch.getTrueCoords(), [] ).append( ch )
+            newCrosshairs = []
+            for item in self.app.Data.getTraceCurrentFrame(trace):
+                xy = ( item['x'], item['y'] )
+                if shown.get( xy ):
+                    shown[ xy ].pop()
+                else:
+                    newCrosshairs.append( self.add( item['x'], item['y'], _trace=trace, transform=False ) )
+            # anything left over isn't in the file (anymore)
+            stale = set( ch for chs in shown.values() for ch in chs )
+            if stale:
+                for ch in stale:
+                    self.selected.discard( ch )
+                    ch.delete()
+                self.crosshairs[ trace ] = [ ch for ch in self.crosshairs[ trace ] if ch not in stale ]
+            if newCrosshairs:
                 self.app.Control.push({ 'type':'add', 'chs':newCrosshairs })
-            except KeyError:
-                pass
     def write(self):
         '''
         write out the coordinates of all of our crosshairs to the metadata file:
@@ -256,24 +327,54 @@ class Trace(Module):
 
         # see if we clicked near any existing crosshairs
         possibleSelections = {}
-        if trace in self.crosshairs:
-            for ch in self.crosshairs[ trace ]:
-                d = ch.getDistance(click)
-                if d < util.CROSSHAIR_SELECT_RADIUS:
-                    if d in possibleSelections:
-                        possibleSelections[d].append( ch )
-                    else:
-                        possibleSelections[d] = [ ch ]
+        canvas = self.app.Dicom.zframe.canvas
+        x, y = canvas.canvasx(click[0]), canvas.canvasy(click[1])
+        box = self.getTrueBox( x, y, x, y, util.CROSSHAIR_SELECT_RADIUS )
+        for ch in self.getCandidates( trace, box ):
+            d = ch.getDistance(click)
+            if d < util.CROSSHAIR_SELECT_RADIUS:
+                if d in possibleSelections:
+                    possibleSelections[d].append( ch )
+                else:
+                    possibleSelections[d] = [ ch ]
 
         # if we did ...
         if possibleSelections != {}:
             # ... get the closest one ...
-            dMin = sorted(possibleSelections.keys())[0]
+            dMin = min(possibleSelections.keys())
             # ... in case of a tie, select a random one
             ch = random.choice( possibleSelections[dMin] )
             return ch
 
         return None
+    def getTrueBox(self, x1, y1, x2, y2, margin=0):
+        '''
+        converts a box in canvas coordinates (optionally grown by `margin` pixels
+        on each side) to true coordinates, as (left, top, right, bottom)
+        '''
+        zframe = self.app.Dicom.zframe
+        width, height = zframe.width * zframe.imgscale, zframe.height * zframe.imgscale
+        return ( (min(x1,x2) - margin - zframe.panX) / width, (min(y1,y2) - margin - zframe.panY) / height,
+                 (max(x1,x2) + margin - zframe.panX) / width, (max(y1,y2) + margin - zframe.panY) / height )
+    def getCandidates(self, trace, box):
+        '''
+        returns the visible crosshairs of a trace from every index cell that
+        overlaps a box in true coordinates (i.e. a superset of those inside it)
+        '''
+        if trace not in self.index:
+            return []
+        return [ ch for ch in self.index[ trace ].query( *box ) if ch.isVisible ]
+    def getInBox(self, trace, x1, y1, x2, y2):
+        '''
+        returns the visible crosshairs of a trace inside a box in canvas coordinates
+        '''
+        box = self.getTrueBox( x1, y1, x2, y2 )
+        chs = []
+        for ch in self.getCandidates( trace, box ):
+            x, y = ch.getTrueCoords()
+            if box[0] < x < box[2] and box[1] < y < box[3]:
+                chs.append( ch )
+        return chs
 
     def copy(self, event=None):
         ''' copies relative positions of selected crosshairs for pasting'''
@@ -0,0 +1,62 @@
+'''
+Colour maps for the Spectrogram module, as 256-entry RGB lookup tables (from the
+bottom of the dynamic range at 0 to the loudest at 255), so that colouring a
+spectrogram costs the same whichever map is chosen.  'Praat' (black on white)
+and 'Grey' are always available, and so are matplotlib's perceptually uniform
+maps when it's installed.
+'''
+
+from .logging import *
+
+import importlib.util
+import numpy as np
+import threading
+
+DEFAULT = 'Praat'
+
+MATPLOTLIB_MAPS = [ 'viridis', 'magma', 'inferno', 'plasma', 'cividis' ]
+
+_luts = {}
+_lock = threading.Lock()
+
+def grey(reverse=False):
+    levels = np.arange(256, dtype=np.uint8)
+    if reverse:
+        levels = levels[::-1]
+    return np.repeat(levels[:, np.newaxis], 3, axis=1)
+
+BUILTIN_MAPS = {
+    'Praat': lambda: grey(reverse=True),
+    'Grey': grey,
+}
+
+def fromMatplotlib(name):
+    import matplotlib
+    cmap = matplotlib.colormaps[name] if hasattr(matplotlib, 'colormaps') else matplotlib.cm.get_cmap(name)
+    return np.rint(cmap(np.linspace(0, 1, 256))[:, :3] * 255).astype(np.uint8)
+
+def getNames():
+    '''
+    the names of the colour maps we can make
+    '''
+    # NB: without importing matplotlib, which takes a while
+    if importlib.util.find_spec('matplotlib') is None:
+        return list(BUILTIN_MAPS)
+    return list(BUILTIN_MAPS) + MATPLOTLIB_MAPS
+
+def getLUT(name):
+    '''
+    the (256, 3) uint8 lookup table of a colour map (falling back to DEFAULT
+    for ones we can't make)
+    '''
+    with _lock:
+        lut = _luts.get(name)
+        if lut is None:
+            try:
+                lut = BUILTIN_MAPS[name]() if name in BUILTIN_MAPS else fromMatplotlib(name)
+            except (ImportError, KeyError, ValueError) as e:
+                warn('Unknown colour map %s (%s), using %s' % (name, e, DEFAULT))
+                lut = BUILTIN_MAPS[DEFAULT]()
+            lut.setflags(write=False)
+            _luts[name] = lut
+        return lut
@@ -0,0 +1,154 @@
+'''
+A reader-agnostic cache of decoded frames, sitting between the Dicom module and
+whichever FrameReader it is using.  Frames are kept as (fully loaded) PIL Images
+in an LRU bounded by a byte budget, and a background thread decodes the frames
+around the current one, in the direction the user is moving through them.
+'''
+
+from .logging import *
+
+from collections import OrderedDict
+import threading
+
+# 256MB is ~1300 frames of a typical 368x712 greyscale recording
+DEFAULT_BUDGET = 256 * 1024 * 1024
+
+def getImageSize(img):
+    '''
+    Estimates the number of bytes held by a decoded PIL Image
+    '''
+    if img.mode in ('I', 'F', 'RGBA', 'RGBX', 'CMYK'):
+        depth = 4
+    elif img.mode.startswith('I;16'):
+        depth = 2
+    else:
+        depth = len(img.getbands())
+    return img.width * img.height * depth
+
+class FrameCache:
+    def __init__(self, reader, budget=DEFAULT_BUDGET, ahead=16, behind=4):
+        '''
+        @param
+            reader : the FrameReader to cache frames from
+            budget : maximum number of bytes of decoded frames to hold
+            ahead :  number of frames to prefetch in the direction of travel
+            behind : number of frames to prefetch in the other direction
+        '''
+        self.reader = reader
+        self.budget = budget
+        self.ahead = ahead
+        self.behind = behind
+        # last valid frame number (frames beyond it are never prefetched)
+        self.framecount = None
+
+        self.frames = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+        # `lock` guards the cache and the prefetch queue; readers are not
+        # thread-safe, so every call into the reader holds `readerLock`
+        self.lock = threading.Lock()
+        self.readerLock = threading.Lock()
+        self.pending = threading.Condition(self.lock)
+        self.queue = []
+        self.current = None
+        self.direction = 1
+        self.closed = False
+        self.thread = None
+
+    def getFrame(self, framenum):
+        '''
+        Returns the decoded frame (from the cache if we have it), and queues the
+        frames around it for prefetching
+        '''
+        with self.lock:
+            img = self.frames.get(framenum)
+            if img is not None:
+                self.frames.move_to_end(framenum)
+                self.hits += 1
+            else:
+                self.misses += 1
+        if img is None:
+            img = self.decode(framenum)
+            self.store(framenum, img)
+        self.prefetch(framenum)
+        return img
+
+    def decode(self, framenum):
+        with self.readerLock:
+            img = self.reader.getFrame(framenum)
+            if img is not None:
+                # some readers return lazily-decoded images (e.g. from Image.open)
+                img.load()
+        return img
+
+    def store(self, framenum, img):
+        if img is None:
+            return
+        size = getImageSize(img)
+        with self.lock:
+            if framenum in self.frames:
+                return
+            self.frames[framenum] = img
+            self.size += size
+            while self.size > self.budget and len(self.frames) > 1:
+                _, old = self.frames.popitem(last=False)
+                self.size -= getImageSize(old)
+
+    def prefetch(self, framenum):
+        '''
+        Replaces the prefetch queue with the frames ahead of and behind `framenum`
+        '''
+        with self.lock:
+            if self.current is not None and framenum != self.current:
+                self.direction = 1 if framenum > self.current else -1
+            self.current = framenum
+            wanted = [ framenum + self.direction * i for i in range(1, self.ahead + 1) ]
+            wanted += [ framenum - self.direction * i for i in range(1, self.behind + 1) ]
+            self.queue = [ f for f in wanted if self.isValid(f) and f not in self.frames ]
+            if self.queue and self.thread is None and not self.closed:
+                self.thread = threading.Thread(target=self.work, daemon=True)
+                self.thread.start()
+            self.pending.notify()
+
+    def isValid(self, framenum):
+        return framenum >= 1 and (self.framecount is None or framenum <= self.framecount)
+
+    def work(self):
+        while True:
+            with self.lock:
+                while not self.queue and not self.closed:
+                    self.pending.wait()
+                if self.closed:
+                    return
+                framenum = self.queue.pop(0)
+                if framenum in self.frames:
+                    continue
+            try:
+                self.store(framenum, self.decode(framenum))
+            except Exception as e:
+                debug('FrameCache: unable to prefetch frame %d (%s)' % (framenum, e))
+
+    def getStats(self):
+        with self.lock:
+            return { 'hits': self.hits, 'misses': self.misses, 'frames': len(self.frames), 'bytes': self.size }
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.queue = []
+            self.size = 0
+
+    def close(self):
+        '''
+        Stops the prefetch thread and drops every cached frame (the reader itself
+        is left open)
+        '''
+        with self.lock:
+            self.closed = True
+            self.pending.notify()
+        # wait for any frame the worker is decoding, so the reader can be closed
+        with self.readerLock:
+            pass
+        self.clear()
@@ -1,5 +1,7 @@
 from .logging import *
 from . import printProgressBar
+from .scanconversion import getScanConverter
+from .headercache import getDicomHeader
 
 from abc import ABC, abstractmethod
 
@@ -7,13 +9,13 @@ import numpy as np
 import pydicom as dicom
 from PIL import Image, ImageTk, ImageEnhance
 import tempfile
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_agg import FigureCanvasAgg
 import zlib
-import math
 import os
+import hashlib
+import struct
+import io
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 class FrameReader(ABC):
 	def __init__(self, filename):
@@ -33,18 +35,24 @@ class FrameReader(ABC):
 	def getFrameTimes(self):
 		pass
 
+	def close(self):
+		'''
+		release any resources held by the reader (called when it is replaced)
+		'''
+		pass
+
 class DicomReader(FrameReader):
+	def getHeader(self):
+		'''
+		frame times, dimensions etc., from the header cache (see headercache.py)
+		'''
+		return getDicomHeader(self.filename)
+
 	def getFrameTimes(self):
-		dcm = dicom.dcmread(self.filename, stop_before_pixels=True)
-		try:
-			blob = dcm[0x200d,0x3cf4][0][0x200d,0x3cf1][0]
-			headers = blob[0x200d,0x3cfb].value
-			offset = float(int.from_bytes(headers[:4], byteorder='little')) / 1000000
-			return [float(int.from_bytes(headers[i:i+4], byteorder='little')) / 1000000 - offset for i in range(0, len(headers), 32)]
-		except:
-			frametime = dcm.get('FrameTime')
-			numframes = dcm.get('NumberOfFrames')
-			return [float(i * frametime) / 1000 for i in range(numframes)]
+		return self.getFrameTimesArray().tolist()
+
+	def getFrameTimesArray(self):
+		return self.getHeader().getFrameTimes()
 
 	def load(self):
 		pass
@@ -87,39 +95,266 @@ class DicomImgReader(DicomReader):
 		data = np.ndarray(shape=self.shape[1:], buffer=buf, dtype='uint8')
 		return Image.fromarray(data)
 
+class DicomMemmapReader(DicomImgReader):
+
+	label = 'Read pixel data (cached)'
+
+	def __init__(self, filename, cache_dir=None):
+		DicomReader.__init__(self, filename)
+		# frames live in a memory-mapped .npy file instead of the anonymous temp file
+		self.data.close()
+		self.data = None
+		if cache_dir:
+			self.cache_dir = os.path.abspath(cache_dir)
+		else:
+			self.cache_dir = os.path.join(os.path.dirname(os.path.abspath(filename)), '.ultratrace', 'frames')
+		# cache files are keyed by path+mtime, so editing the DICOM invalidates them
+		self.cache_prefix = hashlib.sha1(os.path.abspath(filename).encode('utf-8')).hexdigest()
+		mtime = os.stat(filename).st_mtime_ns
+		self.cache_name = os.path.join(self.cache_dir, '%s-%d.npy' % (self.cache_prefix, mtime))
+		if os.path.exists(self.cache_name):
+			try:
+				self.openCache()
+			except (OSError, ValueError) as e:
+				warn('DicomMemmapReader: ignoring unreadable cache %s (%s)' % (self.cache_name, e))
+
+	def openCache(self):
+		self.data = np.load(self.cache_name, mmap_mode='r')
+		self.shape = self.data.shape
+		self.RGB = (len(self.shape) == 4)
+		self.loaded = True
+
+	@staticmethod
+	def normalize(pixels):
+		if len(pixels.shape) == 2:
+			# single-frame DICOM
+			pixels = pixels[np.newaxis]
+		elif len(pixels.shape) == 4 and pixels.shape[0] == 3:
+			# RGB-first -> RGB-last
+			pixels = np.moveaxis(pixels, 0, -1)
+		return pixels
+
+	def removeStaleCaches(self):
+		for fname in os.listdir(self.cache_dir):
+			path = os.path.join(self.cache_dir, fname)
+			if fname.startswith(self.cache_prefix + '-') and path != self.cache_name:
+				debug('DicomMemmapReader: removing stale cache %s' % path)
+				os.remove(path)
+
+	def load(self):
+		debug('DicomMemmapReader: reading dicom')
+		pixels = self.normalize(dicom.dcmread(self.filename).pixel_array)
+		os.makedirs(self.cache_dir, exist_ok=True)
+		self.removeStaleCaches()
+		debug('DicomMemmapReader: dumping pixels to %s' % self.cache_name)
+		# write under a temporary name so an interrupted dump is never mistaken for a cache
+		tmp_name = self.cache_name + '.part'
+		with open(tmp_name, 'wb') as f:
+			np.save(f, np.ascontiguousarray(pixels))
+		del pixels
+		os.replace(tmp_name, self.cache_name)
+		self.openCache()
+
+	def getFrame(self, framenum):
+		return Image.fromarray(self.data[framenum-1])
+
+class DicomLazyReader(DicomReader):
+
+	label = 'Read frames on demand'
+
+	# encapsulated transfer syntaxes whose frames PIL can decode (JPEG & JPEG 2000)
+	# (not 1.2.840.10008.1.2.4.51, whose 12-bit extended JPEG PIL generally can't decode)
+	PIL_SYNTAXES = ['1.2.840.10008.1.2.4.50', '1.2.840.10008.1.2.4.90', '1.2.840.10008.1.2.4.91']
+
+	def __init__(self, filename):
+		DicomReader.__init__(self, filename)
+		self.data.close()
+		self.data = None       # memmap of native pixel data, or
+		self.fragments = None  # list of [(offset, length), ...] per encapsulated frame
+		self.planar = False
+
+	def load(self):
+		'''
+		parses the header and the layout of the pixel data, but decodes nothing
+		'''
+		debug('DicomLazyReader: indexing pixel data')
+		with open(self.filename, 'rb') as f:
+			dcm = dicom.dcmread(f, stop_before_pixels=True)
+			syntax = dcm.file_meta.TransferSyntaxUID
+			frames = int(dcm.get('NumberOfFrames', 1) or 1)
+			samples = dcm.get('SamplesPerPixel', 1)
+			self.shape = (frames, dcm.Rows, dcm.Columns) + ((samples,) if samples > 1 else ())
+			self.RGB = samples > 1
+			if syntax.is_deflated:
+				# the file past the meta header is a deflate stream, so there is nothing to index
+				self.loadAll(syntax)
+				return
+			# pydicom leaves us at the start of the pixel data element
+			endian = '<' if syntax.is_little_endian else '>'
+			header = f.read(8)
+			if len(header) < 8 or struct.unpack(endian + 'HH', header[:4]) != (0x7FE0, 0x0010):
+				# e.g. trailing elements we don't know how to skip
+				self.loadAll(syntax)
+				return
+			if syntax.is_implicit_VR:
+				length = struct.unpack(endian + 'I', header[4:])[0]
+			else:
+				# OB/OW: a 2-byte VR and 2 reserved bytes come before the length
+				length = struct.unpack(endian + 'I', f.read(4))[0]
+			if length != 0xFFFFFFFF:
+				kind = 'i' if dcm.get('PixelRepresentation', 0) == 1 else 'u'
+				dtype = np.dtype('%s%s%d' % (endian, kind, dcm.BitsAllocated // 8))
+				shape = self.shape
+				self.planar = self.RGB and dcm.get('PlanarConfiguration', 0) == 1
+				if self.planar:
+					shape = (frames, samples, dcm.Rows, dcm.Columns)
+				self.data = np.memmap(self.filename, dtype=dtype, mode='r', offset=f.tell(), shape=shape)
+			elif syntax in self.PIL_SYNTAXES:
+				try:
+					self.fragments = self.readFragments(f, frames)
+				except ValueError as e:
+					warn('DicomLazyReader: %s' % e)
+					self.loadAll(syntax)
+					return
+			else:
+				self.loadAll(syntax)
+				return
+		self.loaded = True
+
+	def loadAll(self, syntax):
+		'''
+		fallback for pixel data we can't index: decode all of it with pydicom
+		'''
+		warn('DicomLazyReader: cannot decode %s frame by frame, reading all pixel data' % syntax)
+		self.data = DicomMemmapReader.normalize(dicom.dcmread(self.filename).pixel_array)
+		self.planar = False
+		self.fragments = None
+		self.loaded = True
+
+	def readFragments(self, f, frames):
+		'''
+		skips through the encapsulated items, grouping fragments into frames using the
+		basic offset table (or one fragment per frame / JPEG start markers without one)
+		'''
+		def item():
+			header = f.read(8)
+			if len(header) < 8: # truncated file
+				return None, 0
+			return struct.unpack('<II', header)
+		tag, length = item()
+		if tag != 0xE000FFFE: # item tag, read as (group, element) little endian
+			raise ValueError('missing basic offset table in %s' % self.filename)
+		bot = list(struct.unpack('<%dI' % (length // 4), f.read(length)))
+		first = f.tell()
+		fragments = []
+		tag, length = item()
+		while tag == 0xE000FFFE:
+			fragments.append((f.tell(), length))
+			f.seek(length, os.SEEK_CUR)
+			tag, length = item()
+		if frames == 1:
+			return [fragments]
+		if bot:
+			# offsets are relative to the first fragment's item tag
+			grouped = [ [] for _ in bot ]
+			for fr in fragments:
+				grouped[max(bisect_right(bot, fr[0] - 8 - first) - 1, 0)].append(fr)
+			return grouped
+		if len(fragments) == frames:
+			return [[fr] for fr in fragments]
+		grouped = []
+		for fr in fragments:
+			f.seek(fr[0])
+			if f.read(2) in (b'\xff\xd8', b'\xff\x4f') or not grouped:
+				grouped.append([])
+			grouped[-1].append(fr)
+		return grouped
+
+	def getFrame(self, framenum):
+		i = framenum - 1
+		if self.fragments is not None:
+			with open(self.filename, 'rb') as f:
+				chunks = []
+				for offset, length in self.fragments[i]:
+					f.seek(offset)
+					chunks.append(f.read(length))
+			return Image.open(io.BytesIO(b''.join(chunks)))
+		arr = self.data[i]
+		if self.planar:
+			arr = np.moveaxis(arr, 0, -1)
+		return Image.fromarray(np.ascontiguousarray(arr, dtype=arr.dtype.newbyteorder('=')))
+
 class DicomScanLineReader(DicomReader):
 
 	label = 'Read unannotated'
 
+	# Philips scanline frames are a 32-byte header followed by zlib-compressed samples
+	FRAME_HEADER_SIZE = 32
+
 	def __init__(self, filename):
 		DicomReader.__init__(self, filename)
-		dcm = dicom.dcmread(self.filename, stop_before_pixels=True)
-		blob = dcm[0x200d,0x3cf4][0][0x200d,0x3cf1][0]
-		headers = blob[0x200d,0x3cfb].value
-		data = blob[0x200d,0x3cf3].value
-		framecount = int.from_bytes(data[4:8], byteorder='little')
-		offsets = [int.from_bytes(data[i*4+8:i*4+12], byteorder='little') for i in range(framecount)]
-		offsets.append(len(data))
-		self.frames = []
-		for frame in range(framecount):
-			framedata = data[offsets[frame]:offsets[frame+1]]
-			dt = zlib.decompress(framedata[32:])
-			sh = (368, 712)
-			arr = np.ndarray(shape=sh, buffer=dt, dtype='uint8')
-			arr = np.flip(arr, (0,1))
-			self.frames.append(arr)
+		header = self.getHeader()
+		# straight from the file if the header cache knows where the blob is
+		self.blob = header.readBlob(self.filename)
+		if self.blob is None:
+			dcm = dicom.dcmread(self.filename, stop_before_pixels=True)
+			blob = dcm[0x200d,0x3cf4][0][0x200d,0x3cf1][0]
+			self.blob = blob[0x200d,0x3cf3].value
+			del dcm, blob
+		# only build the frame index here, frames are decompressed on demand (and
+		# kept, and prefetched, by the Dicom module's FrameCache)
+		self.framecount = int.from_bytes(self.blob[4:8], byteorder='little')
+		offsets = np.frombuffer(self.blob, dtype='<u4', count=self.framecount, offset=8)
+		self.offsets = np.append(offsets.astype(np.int64), len(self.blob))
+		self.shape = (header.rows, header.columns)
+		size = len(self.decompress(0)) if self.framecount else 0
+		if header.rows * header.columns != size:
+			raise ValueError('%s has %d bytes of scanlines per frame, but its header says %dx%d'
+				% (self.filename, size, header.rows, header.columns))
 		self.loaded = True
 
+	def decompress(self, frame):
+		start = self.offsets[frame] + self.FRAME_HEADER_SIZE
+		return zlib.decompress(memoryview(self.blob)[start:self.offsets[frame+1]])
+
 	def load(self):
 		pass
 
 	def getFrame(self, framenum):
-		return Image.fromarray(self.frames[framenum-1], 'L')
+		frame = min(max(framenum - 1, 0), self.framecount - 1)
+		arr = np.frombuffer(self.decompress(frame), dtype='uint8').reshape(self.shape)
+		return Image.fromarray(np.ascontiguousarray(arr[::-1, ::-1]), 'L')
+
+# readers opened by the PNG extraction workers, so each process indexes a file once
+_pngWorkerReaders = {}
+
+def _extractPNGs(filename, png_name, framenums, lazy=True):
+	'''
+	process pool worker for DicomPNGReader: encodes the given (1-indexed) frames,
+	decoding them one at a time if `lazy`, or all of the pixel data at once if not
+	'''
+	if not lazy:
+		pixels = DicomMemmapReader.normalize(dicom.dcmread(filename).pixel_array)
+		for framenum in framenums:
+			DicomPNGReader.savePNG(Image.fromarray(pixels[framenum-1]), png_name % framenum)
+		return len(framenums)
+	reader = _pngWorkerReaders.get(filename)
+	if reader is None:
+		reader = DicomLazyReader(filename)
+		reader.load()
+		_pngWorkerReaders.clear()
+		_pngWorkerReaders[filename] = reader
+	for framenum in framenums:
+		DicomPNGReader.savePNG(reader.getFrame(framenum), png_name % framenum)
+	return len(framenums)
 
 class DicomPNGReader(DicomReader):
 
 	label = 'Extract to PNGs'
 
+	# number of frames handed to a worker at a time
+	CHUNK_SIZE = 16
+
 	def __init__(self, filename, png_dir=None):
 		DicomReader.__init__(self, filename)
 		name = os.path.splitext(os.path.basename(filename))[0]
@@ -130,33 +365,73 @@ class DicomPNGReader(DicomReader):
 		self.png_dir = os.path.join(dr, name + '_dicom_to_png')
 		info(self.png_dir)
 		self.png_name = os.path.join(self.png_dir, name + '_frame_%04d.png')
-		self.loaded = os.path.exists(self.png_dir)
-
-	def load(self):
-		os.mkdir(self.png_dir)
+		self.lazy = True
+		self.loaded = os.path.exists(self.png_dir) and self.isComplete()
+
+	def readHeader(self):
+		header = self.getHeader()
+		syntax = header.syntax
+		# frames that can't be decoded one at a time are all left to a single worker,
+		# so that we don't decode the whole file once per process
+		self.lazy = not syntax.is_deflated and (not syntax.is_compressed or syntax in DicomLazyReader.PIL_SYNTAXES)
+		return header.framecount, header.rows, header.columns
+
+	def isComplete(self):
+		'''
+		cheap check that there is a PNG for every frame (without validating them)
+		'''
+		frames = self.readHeader()[0]
+		return len([ f for f in os.listdir(self.png_dir) if f.endswith('.png') ]) >= frames
+
+	@staticmethod
+	def hasPNG(filename, rows, columns):
+		'''
+		checks whether `filename` is a PNG of the given size, from its IHDR chunk
+		'''
+		try:
+			with open(filename, 'rb') as f:
+				header = f.read(24)
+		except OSError:
+			return False
+		if len(header) < 24 or header[:8] != b'\x89PNG\r\n\x1a\n':
+			return False
+		return struct.unpack('>II', header[16:24]) == (columns, rows)
+
+	@staticmethod
+	def savePNG(img, filename):
+		# write under a temporary name so an interrupted run never leaves a partial PNG
+		tmp_name = filename + '.part'
+		img.save(tmp_name, format='PNG', compress_level=1)
+		os.replace(tmp_name, filename)
+
+	def getMissingFrames(self):
+		frames, rows, columns = self.readHeader()
+		return [ f for f in range(1, frames+1) if not self.hasPNG(self.png_name % f, rows, columns) ]
+
+	def submit(self, executor, missing=None):
+		'''
+		queues the extraction of every frame that doesn't have a PNG yet (or only of
+		`missing`), returning a list of futures that resolve to the number of frames
+		they encoded
+		'''
+		os.makedirs(self.png_dir, exist_ok=True)
+		if missing is None:
+			missing = self.getMissingFrames()
+		chunk = self.CHUNK_SIZE if self.lazy else max(len(missing), 1)
+		return [ executor.submit(_extractPNGs, self.filename, self.png_name, missing[i:i+chunk], self.lazy)
+			for i in range(0, len(missing), chunk) ]
+
+	def load(self, workers=None):
 		info( 'Reading DICOM data ...', end='\r' )
-		dcm = dicom.dcmread(self.filename)
-		pixels = dcm.pixel_array
-
-		# check encoding, manipulate array if we need to
-		if len(pixels.shape) == 3:      # greyscale
-			RGB = False
-			frames, rows, columns = pixels.shape
-		elif len(pixels.shape) == 4:    # RGB-encoded
-			RGB = True
-			if pixels.shape[0] == 3:    # handle RGB-first
-				rgb, frames, rows, columns = pixels.shape
-			else:                       # and RGB-last
-				frames, rows, columns, rgb = pixels.shape
-			pixels = pixels.reshape([ frames, rows, columns, rgb ])
-
-		printProgressBar(0, frames, prefix = 'Processing:', suffix = 'complete')
-		for f in range(frames):
-			printProgressBar(f+1, frames, prefix = 'Processing:', suffix = ('complete (%d of %d)' % (f+1,frames)))
-			arr = pixels[ f,:,:,: ] if RGB else pixels[ f,:,: ]
-			img = Image.fromarray( arr )
-			img.save(self.png_name % (f+1), format='PNG', compress_level=1)
-
+		with ProcessPoolExecutor(max_workers=workers) as executor:
+			missing = self.getMissingFrames()
+			futures = self.submit(executor, missing)
+			total = len(missing)
+			done = 0
+			printProgressBar(0, max(total, 1), prefix = 'Processing:', suffix = 'complete')
+			for future in as_completed(futures):
+				done += future.result()
+				printProgressBar(done, total, prefix = 'Processing:', suffix = ('complete (%d of %d)' % (done, total)))
 		self.loaded = True
 
 	def getFrame(self, framenum):
@@ -172,12 +447,7 @@ class ULTScanLineReader(FrameReader):
 
 	def __init__(self, data, metadata):
 		FrameReader.__init__(self, data)
-		#f = open(data, 'rb')
-		#self.data.write(f.read())
-		#f.close()
-		self.data = open(data, 'rb')
-		# sometimes copying to a temporary file misses things
-		# however, if we do this it might not get closed
+		self.data.close()
 		f = open(metadata)
 		for l in f.readlines():
 			k, v = l.strip().split('=')
@@ -186,52 +456,54 @@ class ULTScanLineReader(FrameReader):
 			else:
 				self.__dict__[k] = int(v)
 		f.close()
-		self.loaded = True
-		self.radspace = np.linspace(self.ZeroOffset, self.ZeroOffset+self.PixPerVector, num=self.PixPerVector)
-		total = self.Angle * self.NumVectors
-		self.thetaspace = np.linspace((math.pi + total) / 2, (math.pi - total) / 2, num=self.NumVectors)
+		self.converter = getScanConverter(self.NumVectors, self.PixPerVector, self.ZeroOffset, self.Angle)
 		self.FrameSize = self.NumVectors * self.PixPerVector
-		self.data.seek(0, os.SEEK_END)
-		self.FrameCount = self.data.tell() // self.FrameSize
+		self.FrameCount = os.path.getsize(data) // self.FrameSize
+		# expose the raw scanlines as a read-only (FrameCount, NumVectors, PixPerVector)
+		# array, so frames (and ranges of frames) are views rather than copies
+		shape = (self.FrameCount, self.NumVectors, self.PixPerVector)
+		if self.FrameCount:
+			self.data = np.memmap(data, dtype='uint8', mode='r', shape=shape)
+		else:
+			self.data = np.zeros(shape, dtype='uint8')
+		self.loaded = True
 
 	def load(self):
 		raise NotImplementedError()
 
 	def getFrame(self, framenum):
-		self.data.seek(max(self.FrameSize * (framenum - 1), 0))
-		byt = self.data.read(self.FrameSize)
-		data = np.ndarray(shape=(self.NumVectors, self.PixPerVector), buffer=byt, dtype='uint8').swapaxes(0,1)
-		fig = plt.figure()
-		fig.patch.set_facecolor('black')
-		ax = fig.add_subplot(111, polar='True')
-		ax.axis('off')
-		ax.set_thetamin(0)
-		ax.set_thetamax(180)
-		ax.pcolormesh(self.thetaspace, self.radspace, data, cmap='gray')
-		canvas = FigureCanvasAgg(fig)
-		canvas.draw()
-		r = self.ZeroOffset+self.PixPerVector
-		px = ax.transData.transform([[0,0], [math.pi/2, r], [self.thetaspace[0], r], [self.thetaspace[-1], r]])
-		xmin = math.floor(px[2][0])
-		xmax = math.ceil(px[3][0])
-		ymin = math.floor(px[0][1])
-		ymax = math.ceil(px[1][1])
-		ret = Image.frombytes('RGB', canvas.get_width_height(), self.argb2rgb(canvas.tostring_argb()))
-		plt.close(fig)
-		return ret.crop((xmin, ymin, xmax, ymax))
-
-	def argb2rgb(self, argb):
-		argb_split = [argb[i] for i in range (0, len(argb))]
-		del argb_split[0::4]  # remove every 4th byte starting with index 0
-		#print(argb_split[::4])
-		return bytes(argb_split)
+		frame = self.data[min(max(framenum - 1, 0), self.FrameCount - 1)]
+		return Image.fromarray(self.converter.convert(frame), 'L')
+
+	def getFrames(self, start=1, stop=None, step=1):
+		'''
+		returns raw scanlines for frames start..stop (1-indexed, inclusive) as a
+		(frames, NumVectors, PixPerVector) view of the file
+		'''
+		return self.data[start-1:stop:step]
+
+	def getMeanFrame(self, start=1, stop=None):
+		'''
+		returns the mean (NumVectors, PixPerVector) frame over a range of frames
+		'''
+		return self.getFrames(start, stop).mean(axis=0)
+
+	def getVectorProfiles(self, start=1, stop=None):
+		'''
+		returns the mean intensity of each scanline in each frame, as a
+		(frames, NumVectors) array
+		'''
+		return self.getFrames(start, stop).mean(axis=2)
 
 	def getFrameTimes(self):
+		return self.getFrameTimesArray().tolist()
+
+	def getFrameTimesArray(self):
 		inc = 1.0 / self.FramesPerSec
-		return [self.TimeInSecsOfFirstFrame + i * inc for i in range(self.FrameCount)]
+		return self.TimeInSecsOfFirstFrame + np.arange(self.FrameCount) * inc
 
 READERS = {
-	'dicom': [DicomImgReader, DicomScanLineReader, DicomPNGReader],
+	'dicom': [DicomImgReader, DicomMemmapReader, DicomLazyReader, DicomScanLineReader, DicomPNGReader],
 	'ult': [ULTScanLineReader],
 	None: []
 }
@@ -0,0 +1,193 @@
+'''
+A per-recording cache of what we need from a DICOM's header: the frame times,
+frame count, dimensions, transfer syntax and where the (Philips) scanline blob
+lives in the file.  Reading a DICOM header means parsing every element before
+the pixel data, which we'd otherwise do on every file switch, so headers are
+kept in memory and (once setCacheDir() has been called) in one .npz file per
+recording under the project's `.ultratrace/` directory.  Entries are keyed by
+the recording's path and only trusted while its size and mtime are unchanged.
+'''
+
+from .logging import *
+
+import hashlib
+import numpy as np
+import os
+import pydicom as dicom
+import threading
+
+CACHE_VERSION = 1
+
+# ultrasound data sequence > item > private blob tags of Philips recordings
+ULTRASOUND_SEQUENCE = (0x200d, 0x3cf4)
+ULTRASOUND_ITEM = (0x200d, 0x3cf1)
+SCANLINE_BLOB = (0x200d, 0x3cf3)
+FRAME_HEADERS = (0x200d, 0x3cfb)
+
+# each frame has a 32-byte header starting with its timestamp (in microseconds)
+FRAME_HEADER_SIZE = 32
+
+_cacheDir = None
+_headers = {}
+_lock = threading.Lock()
+
+def setCacheDir(path):
+    '''
+    Persist headers under `path` (or only keep them in memory, if None)
+    '''
+    global _cacheDir
+    _cacheDir = path
+
+class DicomHeader:
+    def __init__(self, size, mtime, framecount, rows, columns, syntax,
+            frameTimes=None, blobOffset=-1, blobLength=-1):
+        self.size = size
+        self.mtime = mtime
+        self.framecount = framecount
+        self.rows = rows
+        self.columns = columns
+        self.syntax = dicom.uid.UID(syntax)
+        self.frameTimes = frameTimes # float64 array of seconds, or None
+        self.blobOffset = blobOffset # file offset of the scanline blob's value, or -1
+        self.blobLength = blobLength
+
+    def getFrameTimes(self):
+        if self.frameTimes is None:
+            raise ValueError('no frame times in the DICOM header')
+        return self.frameTimes
+
+    def readBlob(self, filename):
+        '''
+        Reads the scanline blob straight from the file (or returns None if we don't
+        know where it is)
+        '''
+        if self.blobOffset < 0:
+            return None
+        with open(filename, 'rb') as f:
+            f.seek(self.blobOffset)
+            return f.read(self.blobLength)
+
+    def save(self, path):
+        arrays = {
+            'meta': np.array([ CACHE_VERSION, self.size, self.mtime, self.framecount,
+                self.rows, self.columns, self.blobOffset, self.blobLength ], dtype=np.int64),
+            'syntax': np.array(str(self.syntax)),
+        }
+        if self.frameTimes is not None:
+            arrays['frameTimes'] = self.frameTimes
+        tmpfile = path + '.tmp.npz' # NB: np.savez() adds the extension otherwise
+        np.savez(tmpfile, **arrays)
+        os.replace(tmpfile, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            version, size, mtime, framecount, rows, columns, blobOffset, blobLength = data['meta'].tolist()
+            if version != CACHE_VERSION:
+                return None
+            frameTimes = data['frameTimes'] if 'frameTimes' in data else None
+            return cls(size, mtime, framecount, rows, columns, str(data['syntax']),
+                frameTimes, blobOffset, blobLength)
+
+def getFrameTimesFromHeaders(headers):
+    '''
+    Decodes the timestamp at the start of every 32-byte frame header (in one go,
+    rather than a slice at a time) relative to the first frame, in seconds
+    '''
+    count = -(-len(headers) // FRAME_HEADER_SIZE)
+    # a truncated last header reads as if it were zero-padded
+    padded = np.zeros(count * FRAME_HEADER_SIZE, dtype=np.uint8)
+    padded[:len(headers)] = np.frombuffer(headers, dtype=np.uint8)
+    stamps = padded.view('<u4')[::FRAME_HEADER_SIZE // 4].astype(np.float64) / 1000000
+    if len(stamps):
+        stamps -= stamps[0]
+    return stamps
+
+def readDicomHeader(filename, st=None):
+    '''
+    Reads a DicomHeader from the DICOM itself
+    '''
+    st = st or os.stat(filename)
+    dcm = dicom.dcmread(filename, stop_before_pixels=True)
+    framecount = int(dcm.get('NumberOfFrames', 1) or 1)
+    header = DicomHeader(st.st_size, st.st_mtime_ns, framecount,
+        int(dcm.get('Rows', 0)), int(dcm.get('Columns', 0)), dcm.file_meta.TransferSyntaxUID)
+
+    # NB: before anything below turns the raw elements into values
+    blobOffset = findBlobOffset(dcm)
+
+    item = None
+    try:
+        item = dcm[ULTRASOUND_SEQUENCE][0][ULTRASOUND_ITEM][0]
+    except (KeyError, IndexError):
+        pass
+
+    try:
+        header.frameTimes = getFrameTimesFromHeaders(item[FRAME_HEADERS].value)
+    except (KeyError, TypeError):
+        frametime = dcm.get('FrameTime')
+        if frametime is not None:
+            header.frameTimes = np.arange(framecount) * float(frametime) / 1000
+
+    if blobOffset >= 0:
+        # only trust the offset if the bytes there really are the blob
+        blob = item[SCANLINE_BLOB].value
+        with open(filename, 'rb') as f:
+            f.seek(blobOffset)
+            if f.read(len(blob)) == blob:
+                header.blobOffset, header.blobLength = blobOffset, len(blob)
+    return header
+
+def findBlobOffset(dcm):
+    '''
+    Works out where the value of the scanline blob is in the file (or returns -1).
+    pydicom gives the position of nested (raw) elements relative to the value of
+    their enclosing sequence, so we add those up
+    '''
+    try:
+        offset = dcm.get_item(ULTRASOUND_SEQUENCE).value_tell
+        middle = dcm[ULTRASOUND_SEQUENCE][0]
+        offset += middle.get_item(ULTRASOUND_ITEM).value_tell
+        inner = middle[ULTRASOUND_ITEM][0]
+        offset += inner.get_item(SCANLINE_BLOB).value_tell
+        return offset
+    except (AttributeError, KeyError, IndexError, TypeError):
+        return -1
+
+def getCacheFile(filename):
+    key = hashlib.sha1(os.path.realpath(filename).encode('utf-8')).hexdigest()
+    return os.path.join(_cacheDir, key + '.npz')
+
+def getDicomHeader(filename):
+    '''
+    Returns the DicomHeader of a recording, only reading the DICOM if neither the
+    memory nor the disk cache has an up-to-date copy
+    '''
+    st = os.stat(filename)
+    key = os.path.realpath(filename)
+    with _lock:
+        header = _headers.get(key)
+    if header is not None and (header.size, header.mtime) == (st.st_size, st.st_mtime_ns):
+        return header
+
+    cacheFile = getCacheFile(filename) if _cacheDir else None
+    header = None
+    if cacheFile and os.path.exists(cacheFile):
+        try:
+            header = DicomHeader.load(cacheFile)
+        except Exception as e:
+            warn('Ignoring unreadable header cache %s (%s)' % (cacheFile, e))
+        if header is not None and (header.size, header.mtime) != (st.st_size, st.st_mtime_ns):
+            header = None
+
+    if header is None:
+        header = readDicomHeader(filename, st)
+        if cacheFile:
+            try:
+                header.save(cacheFile)
+            except OSError as e:
+                warn('Unable to write header cache %s (%s)' % (cacheFile, e))
+
+    with _lock:
+        _headers[key] = header
+    return header
@@ -0,0 +1,108 @@
+'''
+Scan conversion of raw ultrasound scanlines (vectors of samples fanning out from
+the probe) into a cartesian image, using a lookup table that only depends on the
+recording geometry from `US.txt`.
+
+The output reproduces the image we used to get by drawing each frame as a polar
+`pcolormesh` on a default (640x480) matplotlib figure and cropping it to the fan,
+so that trace coordinates saved against those images remain valid.
+'''
+
+from functools import lru_cache
+
+import math
+import numpy as np
+
+# layout of the old polar axes on the default 640x480 figure, in display pixels
+# (origin bottom-left): the fan's centre and the radius of the axes' r-limit
+FIGURE_HEIGHT = 480
+FAN_CENTRE_X = 328.0
+FAN_CENTRE_Y = 145.2
+FAN_RADIUS = 184.8
+
+class ScanConverter:
+    def __init__(self, numVectors, pixPerVector, zeroOffset, angle):
+        '''
+        Precomputes, for every output pixel inside the fan, the four (vector, sample)
+        neighbours and their bilinear weights
+
+        @param
+            numVectors :   number of scanlines per frame
+            pixPerVector : number of samples along each scanline
+            zeroOffset :   distance (in samples) from the probe centre to the first sample
+            angle :        angle (in radians) between neighbouring scanlines
+        '''
+        self.numVectors = numVectors
+        self.pixPerVector = pixPerVector
+
+        # same sample positions as the old `radspace` / `thetaspace`
+        rstep = pixPerVector / max(pixPerVector - 1, 1)
+        total = angle * numVectors
+        theta0 = (math.pi + total) / 2
+        thetaN = (math.pi - total) / 2
+        tstep = (theta0 - thetaN) / max(numVectors - 1, 1)
+
+        # matplotlib autoscaled r to the outer edge of the last row of cells
+        rmax = zeroOffset + pixPerVector
+        scale = FAN_RADIUS / (rmax + rstep / 2)
+
+        # crop box, in display pixels
+        xmin = math.floor(FAN_CENTRE_X + rmax * scale * math.cos(theta0))
+        xmax = math.ceil(FAN_CENTRE_X + rmax * scale * math.cos(thetaN))
+        ymin = math.floor(FAN_CENTRE_Y)
+        ymax = math.ceil(FAN_CENTRE_Y + rmax * scale)
+        self.width = xmax - xmin
+        self.height = ymax - ymin
+
+        # polar coordinates of every output pixel centre (NB: the old crop used
+        # display y-coordinates as image rows, which we keep for compatibility)
+        cols = np.arange(self.width) + xmin + 0.5
+        rows = FIGURE_HEIGHT - (np.arange(self.height) + ymin + 0.5)
+        dx = cols[np.newaxis, :] - FAN_CENTRE_X
+        dy = rows[:, np.newaxis] - FAN_CENTRE_Y
+        r = np.hypot(dx, dy) / scale
+        theta = np.arctan2(dy, dx)
+
+        # fractional (vector, sample) indices, keeping the half-cell borders that
+        # pcolormesh drew around the outermost samples
+        v = (theta0 - theta) / tstep if numVectors > 1 else np.zeros_like(theta)
+        u = (r - zeroOffset) / rstep
+        inside = (v >= -0.5) & (v <= numVectors - 0.5) & (u >= -0.5) & (u <= pixPerVector - 0.5)
+        self.pixels = np.flatnonzero(inside)
+        v = np.clip(v.ravel()[self.pixels], 0, numVectors - 1)
+        u = np.clip(u.ravel()[self.pixels], 0, pixPerVector - 1)
+
+        v0 = np.minimum(np.floor(v).astype(np.intp), max(numVectors - 2, 0))
+        u0 = np.minimum(np.floor(u).astype(np.intp), max(pixPerVector - 2, 0))
+        fv = (v - v0).astype(np.float32)
+        fu = (u - u0).astype(np.float32)
+        dv = pixPerVector if numVectors > 1 else 0
+        du = 1 if pixPerVector > 1 else 0
+
+        # raw frames are stored vector-major, i.e. as (numVectors, pixPerVector)
+        base = v0 * pixPerVector + u0
+        self.indices = np.stack([base, base + du, base + dv, base + dv + du])
+        self.weights = np.stack([
+            (1 - fv) * (1 - fu),
+            (1 - fv) * fu,
+            fv * (1 - fu),
+            fv * fu ])
+
+    def convert(self, frame, out=None):
+        '''
+        Scan-converts a single frame (anything indexable as a flat uint8 array of
+        numVectors * pixPerVector samples) into a (height, width) uint8 array
+        '''
+        if out is None:
+            out = np.zeros((self.height, self.width), dtype=np.uint8)
+        samples = np.asarray(frame).reshape(-1)[self.indices]
+        values = np.einsum('ij,ij->j', samples, self.weights)
+        out.reshape(-1)[self.pixels] = np.rint(values).astype(np.uint8)
+        return out
+
+@lru_cache(maxsize=8)
+def getScanConverter(numVectors, pixPerVector, zeroOffset, angle):
+    '''
+    Returns the (shared) ScanConverter for a given recording geometry
+    '''
+    return ScanConverter(numVectors, pixPerVector, zeroOffset, angle)
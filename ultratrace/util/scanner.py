@@ -0,0 +1,155 @@
+'''
+Walks a project directory and sniffs the MIME type of every file, for building
+a new metadata.json.  Sniffing is done in a thread pool (with one libmagic handle
+per thread), and the results are kept in a scan cache keyed by (path, size,
+mtime), so that rescanning an unchanged directory only needs to stat each file.
+'''
+
+from .logging import *
+
+from concurrent.futures import ThreadPoolExecutor
+from magic import Magic # python-magic
+from tqdm import tqdm
+import json
+import os
+import stat
+import threading
+
+# libmagic handles aren't thread-safe, so each thread gets its own
+_local = threading.local()
+
+def getMimeType(path):
+    '''
+    Sniffs the MIME type of a file, reusing this thread's libmagic handle
+    '''
+    if not hasattr(_local, 'magic'):
+        _local.magic = Magic(mime=True)
+    return _local.magic.from_file(path)
+
+class ScanEntry:
+    def __init__(self, dirpath, name, realpath, size, mtime, mimeType=None):
+        self.dirpath = dirpath # the directory we found it in
+        self.name = name
+        self.path = os.path.join(dirpath, name)
+        self.realpath = realpath
+        self.size = size
+        self.mtime = mtime
+        self.mimeType = mimeType
+
+class DirectoryScanner:
+    CACHE_VERSION = 1
+
+    def __init__(self, cacheFile=None, workers=8):
+        '''
+        @param
+            cacheFile : where to persist the scan cache (or None not to)
+            workers :   number of threads to sniff files with
+        '''
+        self.cacheFile = cacheFile
+        self.workers = workers
+        self.cache = self.loadCache()
+        self.hits = 0
+        self.misses = 0
+
+    def loadCache(self):
+        if self.cacheFile == None or not os.path.exists(self.cacheFile):
+            return {}
+        try:
+            with open(self.cacheFile, 'r') as f:
+                data = json.load(f)
+            if data.get('version') != self.CACHE_VERSION:
+                return {}
+            return data['entries']
+        except (OSError, ValueError, KeyError) as e:
+            warn('Ignoring unreadable scan cache %s (%s)' % (self.cacheFile, e))
+            return {}
+
+    def saveCache(self):
+        if self.cacheFile == None:
+            return
+        tmpfile = self.cacheFile + '.tmp'
+        try:
+            with open(tmpfile, 'w') as f:
+                json.dump({ 'version': self.CACHE_VERSION, 'entries': self.cache }, f, separators=(',', ':'))
+            os.replace(tmpfile, self.cacheFile)
+        except OSError as e:
+            warn('Unable to write scan cache %s (%s)' % (self.cacheFile, e))
+
+    def walk(self, root, skip):
+        '''
+        Yields a ScanEntry (without a MIME type) for every file below `root`, top
+        down, skipping directories for which `skip(path)` is true.  Everything we
+        need comes from os.scandir(), so (symlinks aside) each file costs a
+        single stat
+        '''
+        dirs = [root]
+        while dirs:
+            path = dirs.pop()
+            try:
+                entries = sorted(os.scandir(path), key=lambda e: e.name)
+            except OSError as e:
+                warn('Unable to scan %s (%s)' % (path, e))
+                continue
+            subdirs = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if not skip(entry.path):
+                        subdirs.append(entry.path)
+                    continue
+                try:
+                    st = entry.stat()
+                except OSError:
+                    warn('Unable to open %s (broken symlink?)' % entry.path)
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    # symlinked directories, devices, FIFOs etc.
+                    continue
+                realpath = entry.path
+                if entry.is_symlink():
+                    realpath = os.path.realpath(entry.path)
+                    if not os.path.exists(realpath):
+                        warn('Unable to open %s (broken symlink?)' % entry.path)
+                        continue
+                yield ScanEntry(path, entry.name, realpath, st.st_size, st.st_mtime_ns)
+            dirs.extend(reversed(subdirs))
+
+    def scan(self, root, skip=lambda path: False):
+        '''
+        Returns a list of ScanEntries for every file below `root`, with their
+        MIME types
+        '''
+        entries = list(self.walk(root, skip))
+
+        mimeTypes = {}
+        toSniff = []
+        for entry in entries:
+            cached = self.cache.get(entry.realpath)
+            if cached != None and cached[0] == entry.size and cached[1] == entry.mtime:
+                mimeTypes[entry.realpath] = cached[2]
+                self.hits += 1
+            elif entry.realpath not in mimeTypes:
+                mimeTypes[entry.realpath] = None
+                toSniff.append(entry.realpath)
+                self.misses += 1
+
+        if toSniff:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                results = executor.map(self.sniff, toSniff)
+                for path, mimeType in tqdm(zip(toSniff, results), total=len(toSniff)):
+                    mimeTypes[path] = mimeType
+
+        # forget about anything that's gone
+        self.cache = {}
+        for entry in entries:
+            entry.mimeType = mimeTypes[entry.realpath]
+            self.cache[entry.realpath] = [ entry.size, entry.mtime, entry.mimeType ]
+        self.saveCache()
+        return entries
+
+    @staticmethod
+    def sniff(path):
+        try:
+            return getMimeType(path)
+        except Exception as e:
+            warn('Unable to determine the type of %s (%s)' % (path, e))
+            return None
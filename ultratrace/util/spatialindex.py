@@ -0,0 +1,66 @@
+'''
+A uniform grid over (true) crosshair coordinates, so that hit-testing a click or
+a selection box only has to look at the crosshairs in nearby cells.
+'''
+
+import math
+
+class SpatialIndex:
+    def __init__(self, cellSize=1/64):
+        '''
+        @param
+            cellSize : width/height of a grid cell, in true coordinates (i.e. as a
+                       fraction of the image)
+        '''
+        self.cellSize = cellSize
+        self.cells = {}
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.positions)
+
+    def getCell(self, x, y):
+        return ( math.floor(x / self.cellSize), math.floor(y / self.cellSize) )
+
+    def add(self, item, x, y):
+        if item in self.positions:
+            self.move(item, x, y)
+            return
+        cell = self.getCell(x, y)
+        self.positions[item] = cell
+        self.cells.setdefault(cell, set()).add(item)
+
+    def remove(self, item):
+        cell = self.positions.pop(item, None)
+        if cell != None:
+            self.cells[cell].discard(item)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def move(self, item, x, y):
+        cell = self.getCell(x, y)
+        if self.positions.get(item) != cell:
+            self.remove(item)
+            self.positions[item] = cell
+            self.cells.setdefault(cell, set()).add(item)
+
+    def clear(self):
+        self.cells = {}
+        self.positions = {}
+
+    def query(self, x1, y1, x2, y2):
+        '''
+        returns the items in every cell overlapping the box (x1,y1)-(x2,y2), i.e.
+        a superset of the items inside it
+        '''
+        cx1, cy1 = self.getCell(min(x1, x2), min(y1, y2))
+        cx2, cy2 = self.getCell(max(x1, x2), max(y1, y2))
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self.cells):
+            # a big box: cheaper to walk the cells we have than the ones it covers
+            return [ item for cell, items in self.cells.items()
+                if cx1 <= cell[0] <= cx2 and cy1 <= cell[1] <= cy2 for item in items ]
+        found = []
+        for cx in range(cx1, cx2 + 1):
+            for cy in range(cy1, cy2 + 1):
+                found.extend(self.cells.get((cx, cy), ()))
+        return found
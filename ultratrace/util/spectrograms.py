@@ -0,0 +1,363 @@
+'''
+Spectrograms for the Spectrogram module, as a pyramid of tiles per recording
+(and window length and maximum frequency).  Level 0 has a slice every
+MIN_TIME_STEP seconds (or as often as Praat will let us), each level above it
+has half as many, and every level is cut into tiles of TILE_SLICES slices.
+Tiles are only computed the first time they're needed, and are then kept in
+memory and (once setCacheDir() has been called) as .npy files under the
+project's `.ultratrace/` directory.  Drawing a view means picking the coarsest
+level that still has a slice per pixel and putting together the few tiles that
+cover it, so zooming and scrolling cost the same however long the recording is.
+'''
+
+from .logging import *
+
+from collections import OrderedDict
+import hashlib
+import math
+import numpy as np
+import os
+import parselmouth
+import shutil
+import threading
+import wave
+
+TILE_VERSION = 1
+
+# the time step of the finest level, and the number of slices per tile
+MIN_TIME_STEP = 0.0005
+TILE_SLICES = 512
+
+# tiles kept in memory, per pyramid
+MAX_TILES = 64
+
+_cacheDir = None
+
+# Praat isn't thread-safe, so only one thread calls into it at a time
+praatLock = threading.Lock()
+
+def setCacheDir(path):
+    '''
+    Persist tiles under `path` (or only keep them in memory, if None)
+    '''
+    global _cacheDir
+    _cacheDir = path
+
+def getMinimumTimeStep(wl):
+    '''
+    Praat won't compute a (Gaussian window) spectrogram at a finer time step
+    than this, whatever we ask for
+    '''
+    return wl / (8 * math.sqrt(math.pi))
+
+def getDuration(filename):
+    '''
+    the duration of a recording from its header (so without reading the
+    samples), or None if it isn't a WAV or FLAC file we can make sense of
+    '''
+    try:
+        with wave.open(filename, 'rb') as w:
+            return w.getnframes() / w.getframerate()
+    except (EOFError, wave.Error):
+        pass
+    with open(filename, 'rb') as f:
+        header = f.read(26)
+    # the STREAMINFO block every FLAC file starts with has the sample rate (20
+    # bits) and, if known, the number of samples (the last 36 bits)
+    if len(header) == 26 and header[:4] == b'fLaC' and header[4] & 0x7f == 0:
+        bits = int.from_bytes(header[18:26], byteorder='big')
+        rate, samples = bits >> 44, bits & (2 ** 36 - 1)
+        if rate and samples:
+            return samples / rate
+    return None
+
+def toDecibels(values):
+    '''
+    float32 dB of a spectrogram's values, highest frequency first
+    '''
+    db = values.astype(np.float32)
+    with np.errstate(divide='ignore'):
+        np.log10(db, out=db)
+    db *= 10
+    return np.flip(db, 0)
+
+class SpectrogramPyramid:
+    def __init__(self, getSound, duration, wl, maxFreq, path=None):
+        self.getSound = getSound
+        self.duration = duration
+        self.wl = wl
+        self.maxFreq = maxFreq
+        self.path = path # directory for the tile files, or None
+        self.baseStep = max(MIN_TIME_STEP, getMinimumTimeStep(wl))
+        self.levels = 1
+        while self.getSliceCount(self.levels - 1) > TILE_SLICES:
+            self.levels += 1
+        self.tiles = OrderedDict()
+        self.lock = threading.RLock()
+        self.computed = 0
+        self.loaded = 0
+
+    def getTimeStep(self, level):
+        return self.baseStep * 2 ** level
+
+    def getSliceCount(self, level):
+        return max(1, math.ceil(self.duration / self.getTimeStep(level)))
+
+    def getLevel(self, start, end, width):
+        '''
+        the coarsest level with at least one slice per pixel between `start`
+        and `end` (or the finest level, if none has)
+        '''
+        step = (end - start) / max(1, width)
+        level = 0
+        while level + 1 < self.levels and self.getTimeStep(level + 1) <= step:
+            level += 1
+        return level
+
+    def getSlices(self, level, start, end):
+        '''
+        the range of slices of `level` that cover [start, end]
+        '''
+        step = self.getTimeStep(level)
+        return max(0, int(start / step)), min(self.getSliceCount(level), math.ceil(end / step))
+
+    def getView(self, start, end, width, level=None, isCancelled=None):
+        '''
+        returns the float32 dB matrix (highest frequency first) of the slices of
+        `level` (by default, the one getLevel() picks) that cover [start, end],
+        or None if `isCancelled()` says it's no longer wanted before we're done
+        '''
+        if level is None:
+            level = self.getLevel(start, end, width)
+        first, last = self.getSlices(level, start, end)
+        if last <= first:
+            return np.empty((0, 0), dtype=np.float32)
+        tiles = []
+        for index in range(first // TILE_SLICES, (last - 1) // TILE_SLICES + 1):
+            if isCancelled is not None and isCancelled():
+                return None
+            tiles.append(self.getTile(level, index))
+        offset = first % TILE_SLICES
+        db = np.concatenate(tiles, axis=1) if len(tiles) > 1 else tiles[0]
+        return db[:, offset:offset + last - first].astype(np.float32)
+
+    def hasTile(self, level, index):
+        '''
+        whether a tile is in memory or on disk (so getting it is cheap)
+        '''
+        with self.lock:
+            if (level, index) in self.tiles:
+                return True
+        return bool(self.path) and os.path.exists(self.getTileFile(level, index))
+
+    def getCachedLevel(self, start, end, width):
+        '''
+        the finest level, from the one getLevel() picks up, whose tiles covering
+        [start, end] we already have (or None)
+        '''
+        for level in range(self.getLevel(start, end, width), self.levels):
+            first, last = self.getSlices(level, start, end)
+            if all(self.hasTile(level, index) for index in range(first // TILE_SLICES, (last - 1) // TILE_SLICES + 1)):
+                return level
+        return None
+
+    def getTileFile(self, level, index):
+        return os.path.join(self.path, '%d-%d.npy' % (level, index))
+
+    def getTile(self, level, index):
+        key = (level, index)
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                return tile
+
+        tileFile = self.getTileFile(level, index) if self.path else None
+        if tileFile and os.path.exists(tileFile):
+            try:
+                tile = np.load(tileFile, mmap_mode='r')
+                self.loaded += 1
+            except (OSError, ValueError) as e:
+                warn('Ignoring unreadable spectrogram tile %s (%s)' % (tileFile, e))
+
+        if tile is None:
+            tile = self.computeTile(level, index)
+            self.computed += 1
+            if tileFile:
+                try:
+                    tmpfile = tileFile + '.tmp.npy' # NB: np.save() adds the extension otherwise
+                    np.save(tmpfile, tile)
+                    os.replace(tmpfile, tileFile)
+                except OSError as e:
+                    warn('Unable to write spectrogram tile %s (%s)' % (tileFile, e))
+
+        with self.lock:
+            self.tiles[key] = tile
+            self.tiles.move_to_end(key)
+            while len(self.tiles) > MAX_TILES:
+                self.tiles.popitem(last=False)
+        return tile
+
+    def computeTile(self, level, index):
+        '''
+        computes the (float16) dB of the `index`th tile of `level`, whose slices
+        are centred at (i + 0.5) * step
+        '''
+        step = self.getTimeStep(level)
+        first = index * TILE_SLICES
+        count = min(TILE_SLICES, self.getSliceCount(level) - first)
+        times = (first + np.arange(count) + 0.5) * step
+
+        # Praat centres its slices in the clip, so we centre the clip on the
+        # tile, with room for the (Gaussian, so twice as wide) window and a
+        # spare slice either side; then the slices line up with ours, except
+        # at the ends of the recording (where we take the nearest ones)
+        middle = (times[0] + times[-1]) / 2
+        half = (count - 1) / 2 * step + step + self.wl + step / 4
+        sound = self.getSound()
+        with praatLock:
+            clip = sound.extract_part(from_time=max(0, middle - half),
+                to_time=min(self.duration, middle + half), preserve_times=True)
+            spec = clip.to_spectrogram(window_length=self.wl, time_step=step, maximum_frequency=self.maxFreq)
+            nearest = np.rint((times - spec.x1) / spec.dx).astype(int).clip(0, spec.nx - 1)
+            values = spec.values[:, nearest]
+        return toDecibels(values).astype(np.float16)
+
+class SpectrogramService:
+    def __init__(self, maxSounds=2, maxPyramids=4):
+        self.sounds = OrderedDict()
+        self.pyramids = OrderedDict()
+        self.maxSounds = maxSounds
+        self.maxPyramids = maxPyramids
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def getKey(filename):
+        st = os.stat(filename)
+        return (os.path.realpath(filename), st.st_size, st.st_mtime_ns)
+
+    def remember(self, cache, key, value, limit):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+    def getSound(self, filename):
+        '''
+        the parselmouth.Sound of a recording (only read from disk once)
+        '''
+        key = self.getKey(filename)
+        with self.lock:
+            sound = self.sounds.get(key)
+            if sound is not None:
+                self.sounds.move_to_end(key)
+                return sound
+        # NB: not holding self.lock, so that getting a pyramid (on the Tk thread)
+        #     never waits for the worker to load a recording
+        debug('SpectrogramService: loading %s' % filename)
+        with praatLock:
+            sound = parselmouth.Sound(filename)
+        with self.lock:
+            self.remember(self.sounds, key, sound, self.maxSounds)
+        return sound
+
+    def getTileDir(self, key, wl, maxFreq):
+        '''
+        the directory for a pyramid's tiles (clearing out those of older
+        versions of the recording), or None if we aren't persisting them
+        '''
+        if not _cacheDir:
+            return None
+        path, size, mtime = key
+        recordingDir = os.path.join(_cacheDir, hashlib.sha1(path.encode('utf-8')).hexdigest())
+        prefix = 'v%d-%d-%d-' % (TILE_VERSION, size, mtime)
+        tileDir = os.path.join(recordingDir, prefix + '%r-%r' % (wl, maxFreq))
+        try:
+            if os.path.isdir(recordingDir):
+                for name in os.listdir(recordingDir):
+                    if not name.startswith(prefix):
+                        shutil.rmtree(os.path.join(recordingDir, name), ignore_errors=True)
+            os.makedirs(tileDir, exist_ok=True)
+        except OSError as e:
+            warn('Unable to use spectrogram cache %s (%s)' % (tileDir, e))
+            return None
+        return tileDir
+
+    def getPyramid(self, filename, wl, maxFreq):
+        '''
+        the SpectrogramPyramid of a recording for a window length and maximum
+        frequency (which only needs the recording's header, unless getDuration()
+        can't read it; its tiles load the samples when they're first computed)
+        '''
+        key = self.getKey(filename)
+        with self.lock:
+            pyramid = self.pyramids.get(key + (wl, maxFreq))
+            if pyramid is None:
+                duration = getDuration(filename)
+                if duration is None:
+                    duration = self.getSound(filename).get_total_duration()
+                pyramid = SpectrogramPyramid(lambda: self.getSound(filename),
+                    duration, wl, maxFreq, self.getTileDir(key, wl, maxFreq))
+                self.remember(self.pyramids, key + (wl, maxFreq), pyramid, self.maxPyramids)
+            else:
+                self.pyramids.move_to_end(key + (wl, maxFreq))
+            return pyramid
+
+    def getView(self, filename, wl, maxFreq, start, end, width):
+        '''
+        returns the dB matrix for the part of the recording between `start` and
+        `end`, with at least a slice per pixel of `width` where possible
+        '''
+        return self.getPyramid(filename, wl, maxFreq).getView(start, end, width)
+
+class SpectrogramRenderer:
+    '''
+    Renders dB matrices as RGB images of a given size, in one pass over the
+    pixels (rather than the dB matrix) and into buffers that are reused for as
+    long as the size stays the same
+    '''
+    def __init__(self):
+        self.size = None
+        self.indices = {}
+
+    def allocate(self, width, height):
+        self.size = (width, height)
+        self.levels = np.empty((height, width), dtype=np.float32)
+        self.codes = np.empty((height, width), dtype=np.uint8)
+        self.rgb = np.empty((height, width, 3), dtype=np.uint8)
+        self.indices = {}
+
+    def getIndices(self, shape):
+        '''
+        the (flat) index into a dB matrix of `shape` of the slice and frequency
+        nearest to the centre of each pixel
+        '''
+        indices = self.indices.get(shape)
+        if indices is None:
+            width, height = self.size
+            rows = ((np.arange(height) + 0.5) * shape[0] / height).astype(np.intp)
+            columns = ((np.arange(width) + 0.5) * shape[1] / width).astype(np.intp)
+            indices = self.indices[shape] = rows[:, np.newaxis] * shape[1] + columns
+        return indices
+
+    def render(self, db, dyn, width, height, lut):
+        '''
+        returns a (height, width, 3) uint8 array of `db`, with its loudest
+        `dyn` dB coloured by `lut` (see colormaps.getLUT()); NB: the array is
+        overwritten by the next render()
+        '''
+        if self.size != (width, height):
+            self.allocate(width, height)
+        loudest = db.max()
+        if np.isfinite(loudest):
+            levels = self.levels
+            np.take(np.ascontiguousarray(db), self.getIndices(db.shape), out=levels)
+            levels -= loudest - dyn
+            levels *= 255.0 / dyn
+            np.clip(levels, 0, 255, out=levels)
+            np.copyto(self.codes, levels, casting='unsafe')
+        else:
+            # silence (-inf dB throughout) is the bottom of the colour map
+            self.codes.fill(0)
+        np.take(lut, self.codes, axis=0, out=self.rgb)
+        return self.rgb
@@ -0,0 +1,73 @@
+import struct
+import zlib
+
+import numpy as np
+import pytest
+from pydicom.dataset import Dataset, FileMetaDataset
+from pydicom.sequence import Sequence
+from pydicom.uid import ExplicitVRLittleEndian, generate_uid
+
+from ..framereader import DicomScanLineReader
+
+
+# the geometry of the Philips recordings we've seen so far
+SHAPE = (368, 712)
+
+
+def make_scanline_dicom(path, frames, shape, header, timestamps=None, rows=None, columns=None):
+    '''
+    writes a Philips-style DICOM whose private blob holds zlib-compressed
+    scanline frames, each preceded by a 32-byte `header` (and, if given, a
+    table of frame `timestamps` in microseconds); its Rows and Columns are
+    those of `shape` unless given
+    '''
+    arrays = [ (np.arange(shape[0] * shape[1]) * (i + 1) % 256).astype(np.uint8).reshape(shape)
+        for i in range(frames) ]
+    blobs = [ header + zlib.compress(arr.tobytes()) for arr in arrays ]
+    offsets = []
+    offset = 8 + 4 * frames
+    for blob in blobs:
+        offsets.append(offset)
+        offset += len(blob)
+    data = bytes(4) + struct.pack('<I', frames) + struct.pack('<%dI' % frames, *offsets) + b''.join(blobs)
+
+    meta = FileMetaDataset()
+    meta.TransferSyntaxUID = ExplicitVRLittleEndian
+    meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.3.1'
+    meta.MediaStorageSOPInstanceUID = generate_uid()
+    inner = Dataset()
+    inner.add_new(0x200d3cf3, 'OB', data)
+    if timestamps is not None:
+        inner.add_new(0x200d3cfb, 'OB', b''.join(struct.pack('<I', t) + bytes(28) for t in timestamps))
+    middle = Dataset()
+    middle.add_new(0x200d3cf1, 'SQ', Sequence([inner]))
+    ds = Dataset()
+    ds.file_meta = meta
+    ds.add_new(0x200d3cf4, 'SQ', Sequence([middle]))
+    ds.NumberOfFrames = frames
+    ds.Rows = shape[0] if rows is None else rows
+    ds.Columns = shape[1] if columns is None else columns
+    ds.FrameTime = 33
+    ds.save_as(str(path), enforce_file_format=True)
+    return arrays
+
+
+def test_geometry_from_header(tmp_path):
+    path = tmp_path / 'scanlines.dicom'
+    arrays = make_scanline_dicom(path, 3, SHAPE, bytes(32))
+    reader = DicomScanLineReader(str(path))
+    assert reader.shape == SHAPE
+    assert np.array_equal(np.array(reader.getFrame(2)), arrays[1][::-1, ::-1])
+
+    path = tmp_path / 'other.dicom'
+    arrays = make_scanline_dicom(path, 3, (96, 50), bytes(32))
+    reader = DicomScanLineReader(str(path))
+    assert reader.shape == (96, 50)
+    assert np.array_equal(np.array(reader.getFrame(3)), arrays[2][::-1, ::-1])
+
+
+def test_geometry_mismatch(tmp_path):
+    path = tmp_path / 'mismatch.dicom'
+    make_scanline_dicom(path, 2, (96, 50), bytes(32), rows=50, columns=50)
+    with pytest.raises(ValueError):
+        DicomScanLineReader(str(path))
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from .. import headercache
+from ..framereader import DicomReader, DicomScanLineReader
+from .test_framereader import SHAPE, make_scanline_dicom
+
+
+@pytest.fixture
+def cacheDir(tmp_path, monkeypatch):
+    path = tmp_path / 'headers'
+    path.mkdir()
+    monkeypatch.setattr(headercache, '_cacheDir', str(path))
+    monkeypatch.setattr(headercache, '_headers', {})
+    return path
+
+
+def decodeSliced(headers):
+    # how DicomReader.getFrameTimes() used to do it
+    offset = float(int.from_bytes(headers[:4], byteorder='little')) / 1000000
+    return [float(int.from_bytes(headers[i:i+4], byteorder='little')) / 1000000 - offset
+        for i in range(0, len(headers), 32)]
+
+
+def test_frame_times_from_headers():
+    headers = b''.join(int(t).to_bytes(4, 'little') + bytes(28) for t in [1000000, 1033000, 1066000])
+    assert np.allclose(headercache.getFrameTimesFromHeaders(headers), [0.0, 0.033, 0.066])
+    # the same (to the bit) as decoding a slice at a time, truncated headers and all
+    for data in [headers, headers[:-30], b'']:
+        assert headercache.getFrameTimesFromHeaders(data).tolist() == decodeSliced(data)
+
+
+def test_header_is_cached(tmp_path, cacheDir, mocker):
+    path = tmp_path / 'scanlines.dicom'
+    arrays = make_scanline_dicom(path, 3, SHAPE, bytes(32),
+        timestamps=[5000000, 5020000, 5040000])
+    header = headercache.getDicomHeader(str(path))
+    assert header.framecount == 3
+    assert np.allclose(header.frameTimes, [0, 0.02, 0.04])
+    assert header.blobOffset > 0
+    assert len(list(cacheDir.iterdir())) == 1
+
+    # another session only needs the cache file
+    headercache._headers.clear()
+    dcmread = mocker.patch('ultratrace.util.framereader.dicom.dcmread')
+    assert np.allclose(DicomReader(str(path)).getFrameTimes(), [0, 0.02, 0.04])
+    reader = DicomScanLineReader(str(path))
+    assert np.array_equal(np.array(reader.getFrame(1)), arrays[0][::-1, ::-1])
+    dcmread.assert_not_called()
+
+
+def test_changed_file_is_reread(tmp_path, cacheDir):
+    path = tmp_path / 'scanlines.dicom'
+    make_scanline_dicom(path, 2, SHAPE, bytes(32))
+    assert np.allclose(headercache.getDicomHeader(str(path)).frameTimes, [0, 0.033])
+    make_scanline_dicom(path, 4, SHAPE, bytes(32))
+    assert headercache.getDicomHeader(str(path)).framecount == 4
@@ -0,0 +1,48 @@
+import numpy as np
+
+from ...modules.metadata import Metadata
+
+
+US_TXT = '''NumVectors=4
+PixPerVector=8
+ZeroOffset=0
+Angle=0.1
+PixelsPerMm=1.0
+FramesPerSec=100.0
+TimeInSecsOfFirstFrame=0.0
+'''
+
+
+def make_recording(path, name, prompt):
+    (path / (name + '.txt')).write_text(prompt)
+    (path / (name + 'US.txt')).write_text(US_TXT)
+    (path / (name + '.ult')).write_bytes(bytes(4 * 8 * 10))
+    return { 'name': name, '.txt': name + '.txt', '.ult': name + '.ult', 'US.txt': name + 'US.txt' }
+
+
+def test_import_ult_measurement(tmp_path):
+    metadata = Metadata.__new__(Metadata)
+    metadata.path = str(tmp_path)
+    metadata.data = { 'files': [
+        make_recording(tmp_path, 'a', 'pa\n01/02/2020 10:00:00\n'),
+        make_recording(tmp_path, 'b', 'ta\n01/02/2020 10:00:00\n'),
+        make_recording(tmp_path, 'c', 'ka\n01/02/2020 11:00:00\n'),
+    ] }
+    points = '\t'.join('%d,5' % i for i in range(84))
+    lines = [
+        'Client\tTime\tDate\tX,Y "tongue"',
+        'x\t0,055\t01/02/2020 10:00:00\t' + points,
+        'x\t0,025\t01/02/2020 11:00:00\t' + points,
+        'x\t0,025\t01/02/2020 12:00:00\t' + points,
+    ]
+    (tmp_path / 'SPLINES.dat').write_text('\n'.join(lines) + '\n')
+    metadata.importULTMeasurement('SPLINES.dat')
+
+    assert metadata.data['defaultTraceName'] == 'tongue'
+    # like it always has, a line is imported into the first recording whose prompt
+    # has its date (and lines that match none are skipped)
+    files = metadata.data['traces']['tongue']['files']
+    assert sorted(files) == ['a', 'c']
+    assert list(files['a']) == ['5'] and list(files['c']) == ['2']
+    xs = [ point['x'] for point in files['a']['5'] ]
+    assert len(xs) == 42 and np.all(np.diff(xs) > 0)
@@ -0,0 +1,151 @@
+import os
+import wave
+
+import numpy as np
+import pytest
+
+from .. import colormaps, spectrograms
+from ..spectrograms import SpectrogramRenderer, SpectrogramService, TILE_SLICES
+
+
+@pytest.fixture(autouse=True)
+def cacheDir(tmp_path, monkeypatch):
+    path = tmp_path / 'spectrograms'
+    path.mkdir()
+    monkeypatch.setattr(spectrograms, '_cacheDir', str(path))
+    return path
+
+
+def make_wav(path, duration=4.0, rate=16000):
+    t = np.arange(int(duration * rate)) / rate
+    rng = np.random.default_rng(0)
+    samples = (np.sin(2 * np.pi * 440 * t) * 8000 + rng.standard_normal(len(t)) * 500).astype('<i2')
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+    return str(path)
+
+
+def test_tiles_computed_once(tmp_path, mocker):
+    path = make_wav(tmp_path / 'a.wav')
+    service = SpectrogramService()
+    sound = mocker.spy(spectrograms.parselmouth, 'Sound')
+    service.getView(path, 0.005, 5000.0, 0.5, 1.0, 800)
+    pyramid = service.getPyramid(path, 0.005, 5000.0)
+    computed = pyramid.computed
+    service.getView(path, 0.005, 5000.0, 0.6, 0.9, 480)
+    assert sound.call_count == 1
+    assert pyramid.computed == computed
+
+
+def test_pyramids_only_read_the_header(tmp_path, mocker):
+    path = make_wav(tmp_path / 'a.wav')
+    flac = str(tmp_path / 'a.flac')
+    spectrograms.parselmouth.Sound(path).save(flac, 'FLAC')
+    assert spectrograms.getDuration(path) == spectrograms.getDuration(flac) == 4.0
+    (tmp_path / 'b.wav').write_bytes(bytes(64))
+    assert spectrograms.getDuration(str(tmp_path / 'b.wav')) is None
+
+    sound = mocker.spy(spectrograms.parselmouth, 'Sound')
+    service = SpectrogramService()
+    assert service.getPyramid(path, 0.005, 5000.0).duration == 4.0
+    assert service.getPyramid(flac, 0.005, 5000.0).duration == 4.0
+    assert sound.call_count == 0
+
+
+def test_views_use_the_coarsest_level_with_enough_slices(tmp_path):
+    path = make_wav(tmp_path / 'a.wav')
+    pyramid = SpectrogramService().getPyramid(path, 0.005, 5000.0)
+    assert pyramid.getSliceCount(pyramid.levels - 1) <= TILE_SLICES
+
+    view = pyramid.getView(0, 4.0, 500)
+    level = pyramid.getLevel(0, 4.0, 500)
+    assert pyramid.getTimeStep(level) <= 4.0 / 500 < pyramid.getTimeStep(level + 1)
+    assert view.dtype == np.float32
+    assert 500 <= view.shape[1] < 1000
+
+    # deeper than the finest level just gets the finest level
+    assert pyramid.getLevel(1.0, 1.01, 800) == 0
+
+
+def test_tiles_line_up_with_a_direct_computation(tmp_path):
+    path = make_wav(tmp_path / 'a.wav')
+    service = SpectrogramService()
+    pyramid = service.getPyramid(path, 0.005, 5000.0)
+    step = pyramid.getTimeStep(1)
+    view = pyramid.getView(TILE_SLICES * step, 2 * TILE_SLICES * step, 0, level=1)
+
+    times = (TILE_SLICES + np.arange(view.shape[1]) + 0.5) * step
+    middle = (times[0] + times[-1]) / 2
+    half = (len(times) - 1) / 2 * step + 4 * step + 0.005 + step / 4
+    clip = service.getSound(path).extract_part(from_time=middle - half, to_time=middle + half, preserve_times=True)
+    spec = clip.to_spectrogram(window_length=0.005, time_step=step, maximum_frequency=5000.0)
+    expected = spectrograms.toDecibels(spec.values[:, np.rint((times - spec.x1) / spec.dx).astype(int)])
+    assert np.allclose(view, expected, atol=0.1)
+
+
+def test_tiles_persisted(tmp_path, cacheDir):
+    path = make_wav(tmp_path / 'a.wav')
+    first = SpectrogramService().getView(path, 0.005, 5000.0, 0, 4.0, 500)
+
+    pyramid = SpectrogramService().getPyramid(path, 0.005, 5000.0)
+    assert np.array_equal(pyramid.getView(0, 4.0, 500), first)
+    assert (pyramid.computed, pyramid.loaded) == (0, 1)
+
+    # tiles of older versions of the recording are cleared out
+    (recordingDir,) = os.listdir(str(cacheDir))
+    make_wav(path, duration=2.0)
+    SpectrogramService().getView(path, 0.005, 5000.0, 0, 2.0, 500)
+    assert len(os.listdir(os.path.join(str(cacheDir), recordingDir))) == 1
+
+
+def test_cached_level(tmp_path, monkeypatch):
+    monkeypatch.setattr(spectrograms, '_cacheDir', None)
+    path = make_wav(tmp_path / 'a.wav')
+    pyramid = SpectrogramService().getPyramid(path, 0.005, 5000.0)
+    level = pyramid.getLevel(1.0, 2.0, 500)
+    assert pyramid.getCachedLevel(1.0, 2.0, 500) is None
+
+    pyramid.getView(0, 4.0, 0, level=level + 2)
+    assert pyramid.getCachedLevel(1.0, 2.0, 500) == level + 2
+    pyramid.getView(1.0, 2.0, 500)
+    assert pyramid.getCachedLevel(1.0, 2.0, 500) == level
+
+
+def test_cancelled_views_stop_computing(tmp_path):
+    path = make_wav(tmp_path / 'a.wav')
+    pyramid = SpectrogramService().getPyramid(path, 0.005, 5000.0)
+    assert pyramid.getView(0, 4.0, 0, level=0, isCancelled=lambda: pyramid.computed > 0) is None
+    assert pyramid.computed == 1
+
+
+def test_renderer_scales_and_colours():
+    db = np.tile(np.linspace(-100, -10, 200, dtype=np.float32), (50, 1))
+    db[0, 0] = -np.inf
+    renderer = SpectrogramRenderer()
+    rgb = renderer.render(db, 45.0, 100, 25, colormaps.getLUT('Grey'))
+    assert rgb.shape == (25, 100, 3)
+    # everything below the dynamic range is the bottom of the colour map
+    assert (rgb[:, :50] == 0).all()
+    assert rgb[0, -1, 0] >= 250
+    assert (np.diff(rgb[0, :, 0].astype(int)) >= 0).all()
+
+    # buffers are reused for the same size, whatever the colour map
+    praat = renderer.render(db, 45.0, 100, 25, colormaps.getLUT('Praat'))
+    assert praat is rgb
+    assert (praat[..., 0] == 255 - renderer.codes).all()
+
+
+def test_renderer_silence():
+    db = np.full((50, 200), -np.inf, dtype=np.float32)
+    # (no NaN levels on the way)
+    with np.errstate(invalid='raise'):
+        rgb = SpectrogramRenderer().render(db, 45.0, 100, 25, colormaps.getLUT('Praat'))
+    assert (rgb == 255).all()
+
+
+def test_unknown_colormaps_fall_back():
+    assert np.array_equal(colormaps.getLUT('no such map'), colormaps.getLUT(colormaps.DEFAULT))
+    assert colormaps.DEFAULT in colormaps.getNames()
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+from textgrid import TextGrid as TextGridFile, IntervalTier
+
+from .. import textgridcache
+
+
+@pytest.fixture(autouse=True)
+def entries(monkeypatch):
+    entries = textgridcache.OrderedDict()
+    monkeypatch.setattr(textgridcache, '_entries', entries)
+    return entries
+
+
+def make_textgrid(path, mark='hello'):
+    tg = TextGridFile(maxTime=1.0)
+    tier = IntervalTier('text', 0, 1.0)
+    tier.add(0, 1.0, mark)
+    tg.append(tier)
+    textgridcache.writeTextGrid(tg, str(path))
+    return tg
+
+
+def test_parsed_once(tmp_path, mocker):
+    path = tmp_path / 'a.TextGrid'
+    make_textgrid(path)
+    parse = mocker.spy(textgridcache, 'parseTextGrid')
+    first = textgridcache.readTextGrid(str(path))
+    second = textgridcache.readTextGrid(str(path))
+    assert parse.call_count == 1
+    assert second[0][0].mark == 'hello'
+
+    # callers get their own tiers
+    first.pop(0)
+    first.append(IntervalTier('other', 0, 1.0))
+    assert textgridcache.readTextGrid(str(path)).getNames() == ['text']
+
+
+def test_invalidated_on_write(tmp_path):
+    path = tmp_path / 'a.TextGrid'
+    make_textgrid(path)
+    assert textgridcache.readTextGrid(str(path))[0][0].mark == 'hello'
+    make_textgrid(path, 'goodbye')
+    assert textgridcache.readTextGrid(str(path))[0][0].mark == 'goodbye'
+
+
+def test_non_unicode(tmp_path):
+    path = tmp_path / 'a.TextGrid'
+    make_textgrid(path, 'слово')
+    with open(str(path), encoding='utf-8') as f:
+        contents = f.read()
+    with open(str(path), 'w', encoding='Windows-1251') as f:
+        f.write(contents)
+    assert textgridcache.readTextGrid(str(path))[0][0].mark == 'слово'
+    assert not [name for name in os.listdir(str(tmp_path)) if name != 'a.TextGrid']
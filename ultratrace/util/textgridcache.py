@@ -0,0 +1,111 @@
+'''
+A project-wide cache of parsed TextGrids, so that switching back to a file (or
+searching the whole project) doesn't mean parsing its TextGrid again.  Entries
+are keyed by path and only trusted while the file's size and mtime are
+unchanged; writing a TextGrid through writeTextGrid() drops its entry.
+
+Callers get their own copy of the tiers (so that adding, removing or
+reordering tiers and points doesn't leak into the cache), but the Interval and
+Point objects themselves are shared, since nothing modifies those in place.
+'''
+
+from .logging import *
+
+from collections import OrderedDict
+from textgrid import TextGrid as TextGridFile
+from textgrid.exceptions import TextGridError
+import copy
+import os
+import threading
+
+MAX_ENTRIES = 256
+
+ENCODINGS = [ 'utf-8', 'Windows-1251', 'Windows-1252', 'ISO-8859-1' ]
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+
+def copyTextGrid(tg):
+    '''
+    Copies a TextGrid and its tiers, sharing the (immutable) intervals and points
+    '''
+    tg = copy.copy(tg)
+    tiers = []
+    for tier in tg.tiers:
+        tier = copy.copy(tier)
+        if hasattr(tier, 'intervals'):
+            tier.intervals = list(tier.intervals)
+        if hasattr(tier, 'points'):
+            tier.points = list(tier.points)
+        tiers.append(tier)
+    tg.tiers = tiers
+    return tg
+
+def guessEncoding(filename):
+    '''
+    Returns the first of ENCODINGS that the whole file decodes as (or None)
+    '''
+    with open(filename, 'rb') as f:
+        byt = f.read()
+    for encoding in ENCODINGS:
+        try:
+            byt.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+        # NB: skip a byte order mark, like the textgrid lib does
+        return 'utf-8-sig' if encoding == 'utf-8' else encoding
+    return None
+
+def parseTextGrid(filename):
+    '''
+    Parses a TextGrid, letting the textgrid lib detect UTF-8/UTF-16 first and
+    falling back to the first 8-bit encoding the file decodes as (or returns None)
+    '''
+    try:
+        return TextGridFile.fromFile(filename)
+    except (TextGridError, UnicodeDecodeError):
+        encoding = guessEncoding(filename)
+        if encoding is None:
+            error("can't load from file: unable to decode non-Unicode textgrid", filename)
+            return None
+        tg = TextGridFile()
+        try:
+            tg.read(filename, encoding=encoding)
+        except (TextGridError, UnicodeDecodeError) as e:
+            error(e)
+            return None
+        return tg
+
+def readTextGrid(filename):
+    '''
+    Returns (a copy of) the parsed TextGrid at `filename`, or None if it can't be
+    parsed
+    '''
+    key = os.path.realpath(filename)
+    st = os.stat(filename)
+    stamp = (st.st_size, st.st_mtime_ns)
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None and entry[0] == stamp:
+            _entries.move_to_end(key)
+            return copyTextGrid(entry[1])
+    tg = parseTextGrid(filename)
+    if tg is None:
+        return None
+    with _lock:
+        _entries[key] = (stamp, tg)
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return copyTextGrid(tg)
+
+def writeTextGrid(tg, filename):
+    '''
+    Writes a TextGrid out to file, dropping any cached copy of the old contents
+    '''
+    invalidate(filename)
+    tg.write(filename)
+
+def invalidate(filename):
+    with _lock:
+        _entries.pop(os.path.realpath(filename), None)
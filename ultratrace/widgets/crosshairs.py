@@ -39,10 +39,13 @@ class Crosshairs:
         # self.resetTrueCoords()
         self.isSelected = False
         self.isVisible = True
+        # SpatialIndex this crosshairs is kept in (set by the Trace module)
+        self.index = None
 
-        # draw on the canvas
-        self.hline = self.zframe.canvas.create_line(self.x-self.len, self.y, self.x+self.len, self.y, fill=self.unselectedColor, width=self.unselectedWidth)
-        self.vline = self.zframe.canvas.create_line(self.x, self.y-self.len, self.x, self.y+self.len, fill=self.unselectedColor, width=self.unselectedWidth)
+        # draw on the canvas (tagged so that the Trace module can move all of them
+        # at once when we zoom or pan)
+        self.hline = self.zframe.canvas.create_line(self.x-self.len, self.y, self.x+self.len, self.y, fill=self.unselectedColor, width=self.unselectedWidth, tags='crosshairs')
+        self.vline = self.zframe.canvas.create_line(self.x, self.y-self.len, self.x, self.y+self.len, fill=self.unselectedColor, width=self.unselectedWidth, tags='crosshairs')
 
     # def resetTrueCoords(self):
     #   '''
@@ -121,6 +124,25 @@ class Crosshairs:
         self.unselect()
         self.isVisible = False
 
+    def delete(self):
+        ''' remove from the canvas for good (i.e. once it can't be undone) '''
+        self.zframe.canvas.delete( self.hline, self.vline )
+        self.isSelected = False
+        self.isVisible = False
+        if self.index != None:
+            self.index.remove( self )
+
+    def resetCoords(self):
+        ''' recalculate our canvas coordinates after the canvas was moved/scaled '''
+        self.x, self.y = self.transformTrueToCoords(self.trueX, self.trueY)
+        self.len = self.transformLength( CROSSHAIR_SELECT_RADIUS )
+
+    def redraw(self):
+        ''' reset our canvas coordinates and move our lines to them '''
+        self.resetCoords()
+        self.zframe.canvas.coords( self.hline, self.x-self.len, self.y, self.x+self.len, self.y )
+        self.zframe.canvas.coords( self.vline, self.x, self.y-self.len, self.x, self.y+self.len )
+
     def draw(self):
         ''' called when we undo a delete '''
         self.zframe.canvas.itemconfigure( self.hline, state='normal' )
@@ -135,6 +157,8 @@ class Crosshairs:
             self.y += (click[1] - self.y)
             # self.x, self.y = self.transformTrueToCoords(self.trueX, self.trueY)
             self.trueX, self.trueY = self.transformCoordsToTrue(self.x, self.y)
+            if self.index != None:
+                self.index.move( self, self.trueX, self.trueY )
             self.len = self.transformLength( CROSSHAIR_SELECT_RADIUS )
             self.zframe.canvas.coords( self.hline, self.x-self.len, self.y, self.x+self.len, self.y )
             self.zframe.canvas.coords( self.vline, self.x, self.y-self.len, self.x, self.y+self.len )
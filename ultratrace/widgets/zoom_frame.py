@@ -2,6 +2,9 @@ from tkinter import Canvas
 from tkinter.ttk import Frame
 from PIL import ImageTk # pillow
 
+from collections import OrderedDict
+import math
+
 from .rect_tracker import RectTracker
 
 class ZoomFrame(Frame):
@@ -25,6 +28,18 @@ class ZoomFrame(Frame):
         self.shown = False
         self.aspect_ratio = 4.0/3.0
 
+        # scaled PhotoImages, keyed by (id(frame), scaled size, region of the scaled
+        # frame); entries keep a reference to the frame so the id can't be reused
+        self.photoCache = OrderedDict()
+        self.photoCacheSize = 16
+        # when zoomed in, we only render the part of the frame around the viewport,
+        # in tiles of this many (scaled) pixels
+        self.tileSize = 256
+        self.container = None
+        self.imageItem = None
+        self.shownImage = None
+        self.shownKey = None
+
         self.canvas = Canvas( master,  bg='grey', width=self.canvas_width, height=self.canvas_height, highlightthickness=0 )
         self.canvas.grid(row=0, column=0, sticky='news')
         self.canvas.update() # do i need
@@ -101,20 +116,85 @@ class ZoomFrame(Frame):
         self.showImage()
 
     def showImage(self, event=None):
-        # even if we're not showing a new frame, we want to remove the old one
-        self.canvas.delete('delendum')
-        if self.image != None:
-            self.container = self.canvas.create_rectangle(0,0,self.width,self.height,width=0, tags='delendum')
-            self.canvas.scale('all', 0, 0, self.imgscale, self.imgscale)
-            self.canvas.move('all', self.panX, self.panY)
-            bbox = self.canvas.bbox(self.container)
-            image = self.image.resize((bbox[2] - bbox[0], bbox[3] - bbox[1]))
-            imagetk = ImageTk.PhotoImage(image)
-            image = self.canvas.create_image(bbox[0], bbox[1], anchor='nw', image=imagetk, tags='delendum')
-            self.canvas.lower(image)
+        if self.image == None:
+            # even if we're not showing a new frame, we want to remove the old one
+            self.canvas.delete('delendum')
+            self.container = self.imageItem = self.shownImage = self.shownKey = None
+            return
+
+        width = max(round(self.width * self.imgscale), 1)
+        height = max(round(self.height * self.imgscale), 1)
+        x0, y0 = self.panX, self.panY
+        if self.container == None:
+            self.container = self.canvas.create_rectangle(0, 0, 0, 0, width=0, tags='delendum')
+        self.canvas.coords(self.container, x0, y0, x0 + width, y0 + height)
+
+        # if the bitmap on the canvas already covers the viewport, panning only
+        # needs to move it
+        needed = self.getVisibleRegion(width, height)
+        key = self.shownKey
+        if self.shownImage is not self.image or key[1] != (width, height) or not self.covers(key[2], needed):
+            key = (id(self.image), (width, height), self.getRenderRegion(width, height, needed))
+            imagetk = self.getPhotoImage(key, self.image)
+            if self.imageItem == None:
+                self.imageItem = self.canvas.create_image(0, 0, anchor='nw', tags='delendum')
+            self.canvas.itemconfig(self.imageItem, image=imagetk)
             self.canvas.imagetk = imagetk
-            self.shown = True
-            self.app.Trace.update()
+            self.shownImage = self.image
+            self.shownKey = key
+        region = key[2]
+        self.canvas.coords(self.imageItem, x0 + region[0], y0 + region[1])
+        self.canvas.lower(self.imageItem)
+        self.shown = True
+        self.app.Trace.update()
+
+    def getVisibleRegion(self, width, height):
+        '''
+        part of the scaled frame (in its own pixel coordinates) inside the viewport
+        '''
+        left = self.canvas.canvasx(0) - self.panX
+        top = self.canvas.canvasy(0) - self.panY
+        right = left + self.canvas.winfo_width()
+        bottom = top + self.canvas.winfo_height()
+        # never empty, even if the frame has been panned out of view
+        left = min(max(0, math.floor(left)), width - 1)
+        top = min(max(0, math.floor(top)), height - 1)
+        return ( left, top, max(min(width, math.ceil(right)), left + 1), max(min(height, math.ceil(bottom)), top + 1) )
+
+    def getRenderRegion(self, width, height, visible):
+        '''
+        part of the scaled frame to render: all of it if it isn't much bigger than
+        the viewport, otherwise the visible part plus a margin, snapped to tiles (so
+        that nearby viewports share cached bitmaps)
+        '''
+        vw = max(visible[2] - visible[0], 1)
+        vh = max(visible[3] - visible[1], 1)
+        if width * height <= 4 * self.canvas.winfo_width() * self.canvas.winfo_height():
+            return (0, 0, width, height)
+        tile = self.tileSize
+        return ( max(0, (visible[0] - vw // 2) // tile * tile),
+            max(0, (visible[1] - vh // 2) // tile * tile),
+            min(width, -(-(visible[2] + vw // 2) // tile) * tile),
+            min(height, -(-(visible[3] + vh // 2) // tile) * tile) )
+
+    @staticmethod
+    def covers(region, other):
+        return region[0] <= other[0] and region[1] <= other[1] and region[2] >= other[2] and region[3] >= other[3]
+
+    def getPhotoImage(self, key, image):
+        if key in self.photoCache and self.photoCache[key][0] is image:
+            self.photoCache.move_to_end(key)
+            return self.photoCache[key][1]
+        _, (width, height), region = key
+        sx = image.width / width
+        sy = image.height / height
+        box = (region[0] * sx, region[1] * sy, region[2] * sx, region[3] * sy)
+        size = (max(region[2] - region[0], 1), max(region[3] - region[1], 1))
+        imagetk = ImageTk.PhotoImage(image.resize(size, box=box))
+        self.photoCache[key] = (image, imagetk)
+        while len(self.photoCache) > self.photoCacheSize:
+            self.photoCache.popitem(last=False)
+        return imagetk
 
     def wheel(self, event):
         if self.image != None:
@@ -137,9 +217,10 @@ class ZoomFrame(Frame):
             self.zoom += 1
             self.imgscale /= self.delta
 
-        bbox = self.canvas.coords(self.container)
-        self.panX = bbox[0]
-        self.panY = bbox[1]
+        if self.container != None:
+            bbox = self.canvas.coords(self.container)
+            self.panX = bbox[0]
+            self.panY = bbox[1]
         self.showImage()
 
     def zoomIn(self):
@@ -147,9 +228,10 @@ class ZoomFrame(Frame):
             self.zoom -= 1
             self.imgscale *= self.delta
 
-        bbox = self.canvas.coords(self.container)
-        self.panX = bbox[0]
-        self.panY = bbox[1]
+        if self.container != None:
+            bbox = self.canvas.coords(self.container)
+            self.panX = bbox[0]
+            self.panY = bbox[1]
         self.showImage()
 
     def scrollY(self, *args, **kwargs):
@@ -2,9 +2,12 @@ import argparse
 import logging
 
 from .app import initialize_app
+from .model.spectrogram import FORMATS, SpectrogramParams, render_project
 
 logging.basicConfig(level=logging.DEBUG)
 
+DEFAULT_PARAMS = SpectrogramParams()
+
 
 def main():
 
@@ -55,6 +58,25 @@ def main():
     parser.add_argument(
         "--theme", help="name of Ttk theme to use for widgets",
     )
+    parser.add_argument(
+        "--no-rescan",
+        dest="rescan",
+        action="store_false",
+        help="don't check an existing project for added, removed or changed files",
+    )
+    parser.add_argument(
+        "--sqlite",
+        dest="use_store",
+        action="store_true",
+        help="keep the project in .ultratrace/project.sqlite3 instead of project.pkl "
+        "(importing the latter, or a legacy metadata.json, the first time)",
+    )
+    parser.add_argument(
+        "--max-memory",
+        type=int,
+        default=512,
+        help="memory (in MiB) to keep loaded files in, before unloading the least recently used ones",
+    )
     parser.add_argument(
         "--max-undo-memory",
         type=int,
@@ -62,9 +84,81 @@ def main():
         help="number of operations to remember in the UndoManager",
     )
 
+    parser.add_argument(
+        "--render-spectrograms",
+        metavar="DIR",
+        help="render the spectrogram of every recording into DIR and exit (implies --headless)",
+    )
+    parser.add_argument(
+        "--spectrogram-format",
+        choices=FORMATS,
+        default="png",
+        help="write rendered spectrograms as PNGs or as .npy arrays of their dB values",
+    )
+    parser.add_argument(
+        "--window-length",
+        type=float,
+        default=DEFAULT_PARAMS.window_length,
+        help="spectrogram window length (in seconds)",
+    )
+    parser.add_argument(
+        "--max-frequency",
+        type=int,
+        default=DEFAULT_PARAMS.max_frequency,
+        help="spectrogram maximum frequency (in Hz)",
+    )
+    parser.add_argument(
+        "--dynamic-range",
+        type=int,
+        default=DEFAULT_PARAMS.dynamic_range,
+        help="spectrogram dynamic range (in dB)",
+    )
+    parser.add_argument(
+        "--n-slices",
+        type=int,
+        default=DEFAULT_PARAMS.n_slices,
+        help="width (in slices) of each rendered spectrogram",
+    )
+    parser.add_argument(
+        "--segment-ms",
+        type=int,
+        default=None,
+        help="render each recording in segments of this many ms (rather than whole)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of processes to render spectrograms with (default: one per CPU)",
+    )
+
     args = parser.parse_args()
 
-    app = initialize_app(headless=args.headless, path=args.path, theme=args.theme)
+    app = initialize_app(
+        headless=args.headless or args.render_spectrograms is not None,
+        path=args.path,
+        theme=args.theme,
+        rescan=args.rescan,
+        memory_budget=args.max_memory * 1024 * 1024,
+        use_store=args.use_store,
+    )
+
+    if args.render_spectrograms is not None:
+        params = SpectrogramParams(
+            window_length=args.window_length,
+            max_frequency=args.max_frequency,
+            dynamic_range=args.dynamic_range,
+            n_slices=args.n_slices,
+        )
+        render_project(
+            app.project.files,
+            args.render_spectrograms,
+            params=params,
+            fmt=args.spectrogram_format,
+            segment_ms=args.segment_ms,
+            workers=args.workers,
+        )
+        return
 
     app.main()
 
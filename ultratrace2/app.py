@@ -11,6 +11,9 @@ class App:
         headless: bool = False,
         path: Optional[str] = None,
         theme: Optional[str] = None,
+        rescan: bool = True,
+        memory_budget: Optional[int] = None,
+        use_store: bool = False,
     ):
 
         if path is None and not headless:
@@ -18,7 +21,9 @@ class App:
         if not path:
             raise ValueError("You must choose a directory to open")
 
-        self.project: Project = Project.get_by_path(path)
+        self.project: Project = Project.get_by_path(
+            path, rescan=rescan, memory_budget=memory_budget, use_store=use_store
+        )
 
         if not headless:
             self.gui = GUI(theme=theme)
@@ -32,9 +37,21 @@ app: Optional[App] = None
 
 
 def initialize_app(
-    headless: bool = False, path: Optional[str] = None, theme: Optional[str] = None
+    headless: bool = False,
+    path: Optional[str] = None,
+    theme: Optional[str] = None,
+    rescan: bool = True,
+    memory_budget: Optional[int] = None,
+    use_store: bool = False,
 ) -> App:
 
     global app
-    app = App(headless=headless, path=path, theme=theme,)
+    app = App(
+        headless=headless,
+        path=path,
+        theme=theme,
+        rescan=rescan,
+        memory_budget=memory_budget,
+        use_store=use_store,
+    )
     return app
@@ -1,8 +1,19 @@
 import logging
 import os
 
-from typing import Dict, FrozenSet, Mapping, Optional, Sequence, Type
+from typing import (
+    Any,
+    Dict,
+    FrozenSet,
+    List,
+    Mapping,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Type,
+)
 
+from .descriptor import FileDescriptor
 from .loaders.base import (
     AlignmentFileLoader,
     ImageSetFileLoader,
@@ -11,12 +22,19 @@ from .loaders.base import (
     FileLoadError,
 )
 from .registry import get_loader_for
+from .residency import ResidencyManager, ResidencyStats
+from .scanner import DirectoryScanner, ScanEntry
 
 
 logger = logging.getLogger(__name__)
 
 
 class FileBundle:
+    """The files sharing a name (e.g. `file00.dicom`, `file00.wav`, `file00.TextGrid`).
+
+    Bundles only hold `FileDescriptor`s; the loaders are materialized when they're
+    first accessed (e.g. through `alignment_file` or `get_alignment_file()`)."""
+
     def __init__(
         self,
         name: str,
@@ -25,51 +43,163 @@ class FileBundle:
         sound_file: Optional[SoundFileLoader] = None,
     ):
         self.name = name
+        self.alignment_descriptor: Optional[FileDescriptor[AlignmentFileLoader]] = None
+        self.image_set_descriptor: Optional[FileDescriptor[ImageSetFileLoader]] = None
+        self.sound_descriptor: Optional[FileDescriptor[SoundFileLoader]] = None
         self.alignment_file = alignment_file
         self.image_set_file = image_set_file
         self.sound_file = sound_file
 
+    def get_descriptors(self) -> List[FileDescriptor]:
+        return [
+            d
+            for d in [
+                self.alignment_descriptor,
+                self.image_set_descriptor,
+                self.sound_descriptor,
+            ]
+            if d is not None
+        ]
+
     def has_impl(self) -> bool:
-        return any(
-            f is not None
-            for f in [self.alignment_file, self.image_set_file, self.sound_file]
+        return bool(self.get_descriptors())
+
+    def set_descriptor(self, descriptor: FileDescriptor) -> None:
+        if issubclass(descriptor.loader_cls, AlignmentFileLoader):
+            if self.alignment_descriptor is not None:
+                logger.warning("Overwriting existing alignment file")
+            self.alignment_descriptor = descriptor
+        elif issubclass(descriptor.loader_cls, ImageSetFileLoader):
+            if self.image_set_descriptor is not None:
+                logger.warning("Overwriting existing image-set file")
+            self.image_set_descriptor = descriptor
+        elif issubclass(descriptor.loader_cls, SoundFileLoader):
+            if self.sound_descriptor is not None:
+                logger.warning("Overwriting existing sound file")
+            self.sound_descriptor = descriptor
+        else:
+            raise ValueError(f"Invalid loader class: {descriptor.loader_cls.__name__}")
+
+    @property
+    def alignment_file(self) -> Optional[AlignmentFileLoader]:
+        if self.alignment_descriptor is None:
+            return None
+        return self.alignment_descriptor.load()
+
+    @alignment_file.setter
+    def alignment_file(self, alignment_file: Optional[AlignmentFileLoader]) -> None:
+        self.alignment_descriptor = (
+            None
+            if alignment_file is None
+            else FileDescriptor.from_loader(alignment_file)
+        )
+
+    @property
+    def image_set_file(self) -> Optional[ImageSetFileLoader]:
+        if self.image_set_descriptor is None:
+            return None
+        return self.image_set_descriptor.load()
+
+    @image_set_file.setter
+    def image_set_file(self, image_set_file: Optional[ImageSetFileLoader]) -> None:
+        self.image_set_descriptor = (
+            None
+            if image_set_file is None
+            else FileDescriptor.from_loader(image_set_file)
+        )
+
+    @property
+    def sound_file(self) -> Optional[SoundFileLoader]:
+        if self.sound_descriptor is None:
+            return None
+        return self.sound_descriptor.load()
+
+    @sound_file.setter
+    def sound_file(self, sound_file: Optional[SoundFileLoader]) -> None:
+        self.sound_descriptor = (
+            None if sound_file is None else FileDescriptor.from_loader(sound_file)
         )
 
     def get_alignment_file(self) -> Optional[AlignmentFileLoader]:
         return self.alignment_file
 
     def set_alignment_file(self, alignment_file: AlignmentFileLoader) -> None:
-        if self.alignment_file is not None:
-            logger.warning("Overwriting existing alignment file")
-        self.alignment_file = alignment_file
+        self.set_descriptor(FileDescriptor.from_loader(alignment_file))
 
     def get_image_set_file(self) -> Optional[ImageSetFileLoader]:
         return self.image_set_file
 
     def set_image_set_file(self, image_set_file: ImageSetFileLoader) -> None:
-        if self.image_set_file is not None:
-            logger.warning("Overwriting existing image-set file")
-        self.image_set_file = image_set_file
+        self.set_descriptor(FileDescriptor.from_loader(image_set_file))
 
     def get_sound_file(self) -> Optional[SoundFileLoader]:
         return self.sound_file
 
     def set_sound_file(self, sound_file: SoundFileLoader) -> None:
-        if self.sound_file is not None:
-            logger.warning("Overwriting existing sound file")
-        self.sound_file = sound_file
+        self.set_descriptor(FileDescriptor.from_loader(sound_file))
+
+    def remove_file(self, path: str) -> List[FileDescriptor]:
+        """Drop whichever of our files was loaded from `path`, if any (and return
+        their descriptors)."""
+        removed: List[FileDescriptor] = []
+        if (
+            self.alignment_descriptor is not None
+            and self.alignment_descriptor.path == path
+        ):
+            removed.append(self.alignment_descriptor)
+            self.alignment_descriptor = None
+        if (
+            self.image_set_descriptor is not None
+            and self.image_set_descriptor.path == path
+        ):
+            removed.append(self.image_set_descriptor)
+            self.image_set_descriptor = None
+        if self.sound_descriptor is not None and self.sound_descriptor.path == path:
+            removed.append(self.sound_descriptor)
+            self.sound_descriptor = None
+        return removed
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        # NB: projects pickled before we had descriptors hold the loaders themselves
+        for kind in ["alignment", "image_set", "sound"]:
+            loader = state.pop(f"{kind}_file", None)
+            if f"{kind}_descriptor" not in state:
+                state[f"{kind}_descriptor"] = (
+                    None if loader is None else FileDescriptor.from_loader(loader)
+                )
+        self.__dict__.update(state)
 
     def __repr__(self):
-        return f'Bundle("{self.name}",{self.alignment_file},{self.image_set_file},{self.sound_file})'
+        return f'Bundle("{self.name}",{self.alignment_descriptor},{self.image_set_descriptor},{self.sound_descriptor})'
 
     def __eq__(self, other):
         return (
             self.name == other.name
-            and self.alignment_file == other.alignment_file
-            and self.image_set_file == other.image_set_file
-            and self.sound_file == other.sound_file
+            and self.alignment_descriptor == other.alignment_descriptor
+            and self.image_set_descriptor == other.image_set_descriptor
+            and self.sound_descriptor == other.sound_descriptor
         )
 
+    def __hash__(self):
+        # NB: traces key their crosshairs by bundle (and equal bundles share a name)
+        return hash(self.name)
+
+
+class IndexedFile(NamedTuple):
+    bundle_name: Optional[str]  # `None` if we couldn't load it
+    realpath: str
+    size: int
+    mtime_ns: int
+
+
+class RescanResult(NamedTuple):
+    added: List[str]
+    removed: List[str]
+    changed: List[str]
+
+    def is_empty(self) -> bool:
+        return not (self.added or self.removed or self.changed)
+
 
 class FileBundleList:
 
@@ -86,64 +216,168 @@ class FileBundleList:
     def __init__(self, bundles: Mapping[str, FileBundle]):
 
         self.current_bundle = None
-        self.bundles: Mapping[str, FileBundle] = bundles
+        self.bundles: Dict[str, FileBundle] = dict(bundles)
+
+        # loaders are materialized on demand, and released again when we're over
+        # our memory budget
+        self.residency = ResidencyManager()
+        self._attach_residency()
+
+        # the files we've seen under the root path (see `update_from_dir()`)
+        self.file_index: Dict[str, IndexedFile] = {}
 
         self.has_alignment_impl: bool = False
         self.has_image_set_impl: bool = False
         self.has_sound_impl: bool = False
-
-        for bundle in bundles.values():
-            self.has_alignment_impl |= bundle.alignment_file is not None
-            self.has_image_set_impl |= bundle.image_set_file is not None
-            self.has_sound_impl |= bundle.sound_file is not None
+        self._update_impls()
+
+    def _update_impls(self) -> None:
+        self.has_alignment_impl = False
+        self.has_image_set_impl = False
+        self.has_sound_impl = False
+        for bundle in self.bundles.values():
+            self.has_alignment_impl |= bundle.alignment_descriptor is not None
+            self.has_image_set_impl |= bundle.image_set_descriptor is not None
+            self.has_sound_impl |= bundle.sound_descriptor is not None
+
+    def set_memory_budget(self, budget: int) -> None:
+        """Set how many bytes the loaders of our files may take up (roughly)."""
+        self.residency.set_budget(budget)
+
+    def get_residency_stats(self) -> ResidencyStats:
+        return self.residency.get_stats()
+
+    def _attach_residency(self) -> None:
+        for bundle in self.bundles.values():
+            for descriptor in bundle.get_descriptors():
+                descriptor.residency = self.residency
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["residency"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.residency = ResidencyManager()
+        self._attach_residency()
 
     @classmethod
     def build_from_dir(
-        cls, root_path: str, extra_exclude_dirs: Sequence[str] = []
+        cls,
+        root_path: str,
+        extra_exclude_dirs: Sequence[str] = [],
+        scan_cache_file: Optional[str] = None,
     ) -> "FileBundleList":
 
+        bundles: Dict[str, FileBundle] = {}
+        file_index: Dict[str, IndexedFile] = {}
+        cls._scan_into(
+            bundles, file_index, root_path, extra_exclude_dirs, scan_cache_file
+        )
+
+        file_bundles = cls(bundles)
+        file_bundles.file_index = file_index
+        return file_bundles
+
+    def update_from_dir(
+        self,
+        root_path: str,
+        extra_exclude_dirs: Sequence[str] = [],
+        scan_cache_file: Optional[str] = None,
+    ) -> RescanResult:
+        """Bring the bundles up to date with the files under `root_path`.
+
+        Files are compared with the index from the last scan by their `stat()` data,
+        and only added and changed files are (re)loaded.  Bundles left without any
+        files are dropped; other bundles are updated in place, so anything referring
+        to them (e.g. traces) is unaffected."""
+
+        # NB: projects pickled before we kept an index have to load everything again
+        file_index = getattr(self, "file_index", {})
+        result = self._scan_into(
+            self.bundles, file_index, root_path, extra_exclude_dirs, scan_cache_file
+        )
+        self.file_index = file_index
+        self._attach_residency()
+        self._update_impls()
+        return result
+
+    @classmethod
+    def _scan_into(
+        cls,
+        bundles: Dict[str, FileBundle],
+        file_index: Dict[str, IndexedFile],
+        root_path: str,
+        extra_exclude_dirs: Sequence[str],
+        scan_cache_file: Optional[str],
+    ) -> RescanResult:
+
         assert os.path.exists(root_path)  # should have been validated by Project
 
         # FIXME: implement `extra_exclude_dirs` as a command-line arg
         exclude_dirs = cls.exclude_dirs.union(extra_exclude_dirs)
 
-        bundles: Dict[str, FileBundle] = {}
+        # NB: MIME types are sniffed in parallel (and cached in `scan_cache_file`, if
+        #     given), but loading is still done in the scan order
+        scanner = DirectoryScanner(scan_cache_file)
+        entries = {entry.path: entry for entry in scanner.scan(root_path, exclude_dirs)}
+        for path in scanner.broken:
+            logger.warning(f'unable to open "{path}" (broken symlink?)')
+
+        removed = [path for path in file_index if path not in entries]
+        added = [path for path in entries if path not in file_index]
+        changed = [
+            path
+            for path, entry in entries.items()
+            if path in file_index
+            and (entry.realpath, entry.size, entry.mtime_ns) != file_index[path][1:]
+        ]
 
-        # NB: `topdown=True` increases runtime cost from O(n) -> O(n^2), but it allows us to
-        #     modify `dirs` in-place so that we can skip certain directories.  For more info,
-        #     see https://stackoverflow.com/questions/19859840/excluding-directories-in-os-walk
-        for path, dirs, filenames in os.walk(root_path, topdown=True):
-            dirs[:] = [d for d in dirs if d not in exclude_dirs]
-
-            for filename in filenames:
-
-                name, _ = os.path.splitext(filename)
-                filepath_or_symlink = os.path.join(path, filename)
-                filepath = os.path.realpath(filepath_or_symlink)
-                if not os.path.exists(filepath):
-                    logger.warning(
-                        f'unable to open "{filepath_or_symlink}" (broken symlink?)'
-                    )
-                    continue
-
-                file_loader: Optional[Type[FileLoaderBase]] = get_loader_for(filepath)
-                if file_loader is None:
-                    logger.warning(f"unrecognized filetype: {filepath}")
-                    continue
-
-                if name not in bundles:
-                    bundles[name] = FileBundle(name)
-
-                try:
-                    loaded_file = file_loader.from_file(filepath)
-                    if loaded_file is not None:
-                        if isinstance(loaded_file, AlignmentFileLoader):
-                            bundles[name].set_alignment_file(loaded_file)
-                        elif isinstance(loaded_file, ImageSetFileLoader):
-                            bundles[name].set_image_set_file(loaded_file)
-                        elif isinstance(loaded_file, SoundFileLoader):
-                            bundles[name].set_sound_file(loaded_file)
-                except FileLoadError as e:
-                    logger.error(e)
-
-        return cls(bundles)
+        touched = set()
+        for path in removed + changed:
+            indexed = file_index.pop(path)
+            if indexed.bundle_name in bundles:
+                for descriptor in bundles[indexed.bundle_name].remove_file(
+                    indexed.realpath
+                ):
+                    if descriptor.residency is not None:
+                        descriptor.residency.forget(descriptor)
+                touched.add(indexed.bundle_name)
+        for path in added + changed:
+            file_index[path] = cls._load_file(bundles, entries[path])
+
+        for name in touched:
+            if not bundles[name].has_impl():
+                del bundles[name]
+
+        return RescanResult(added, removed, changed)
+
+    @staticmethod
+    def _load_file(bundles: Dict[str, FileBundle], entry: ScanEntry) -> IndexedFile:
+        """Describe a file for its bundle (without loading it)."""
+
+        name, _ = os.path.splitext(os.path.basename(entry.path))
+        filepath = entry.realpath
+        unloaded = IndexedFile(None, filepath, entry.size, entry.mtime_ns)
+
+        file_loader: Optional[Type[FileLoaderBase]] = None
+        if entry.mime_type is not None:
+            file_loader = get_loader_for(filepath, entry.mime_type)
+        if file_loader is None:
+            logger.warning(f"unrecognized filetype: {filepath}")
+            return unloaded
+
+        if name not in bundles:
+            bundles[name] = FileBundle(name)
+
+        try:
+            header = file_loader.read_header(filepath)
+        except FileLoadError as e:
+            logger.error(e)
+            return unloaded
+
+        bundles[name].set_descriptor(
+            FileDescriptor(filepath, file_loader, entry.size, entry.mtime_ns, header)
+        )
+        return unloaded._replace(bundle_name=name)
@@ -0,0 +1,100 @@
+import logging
+
+from typing import Any, Dict, Generic, Optional, Type, TypeVar, TYPE_CHECKING
+
+from .loaders.base import FileLoaderBase
+
+if TYPE_CHECKING:
+    from .residency import ResidencyManager  # noqa: F401
+
+
+logger = logging.getLogger(__name__)
+
+
+Loader = TypeVar("Loader", bound=FileLoaderBase)
+
+
+class FileDescriptor(Generic[Loader]):
+    """A file that we know how to load, without (necessarily) having loaded it.
+
+    Descriptors only hold what a directory scan gives us cheaply: the path, the loader
+    class, the `stat()` data and whatever the loader can read from the file's header
+    (see `FileLoaderBase.read_header()`).  The loader itself is only materialized by
+    `load()`, and can be dropped again by `release()` (e.g. by a `ResidencyManager`
+    that keeps us under a memory budget)."""
+
+    def __init__(
+        self,
+        path: str,
+        loader_cls: Type[Loader],
+        size: int = 0,
+        mtime_ns: int = 0,
+        header: Optional[Dict[str, Any]] = None,
+    ):
+        self.path = path
+        self.loader_cls = loader_cls
+        self.size = size
+        self.mtime_ns = mtime_ns
+        self.header: Dict[str, Any] = header or {}
+        self.residency: Optional["ResidencyManager"] = None
+        self._loader: Optional[Loader] = None
+        self.loads = 0
+        # descriptors wrapping an already-constructed loader can't reload it
+        self._releasable = True
+
+    @classmethod
+    def from_loader(cls, loader: Loader) -> "FileDescriptor[Loader]":
+        descriptor = cls(loader.get_path(), type(loader))
+        descriptor._loader = loader
+        descriptor._releasable = False
+        return descriptor
+
+    def get_path(self) -> str:
+        return self.path
+
+    def is_loaded(self) -> bool:
+        return self._loader is not None
+
+    def get_loaded(self) -> Optional[Loader]:
+        """The loader, if it's been materialized (without materializing it)."""
+        return self._loader
+
+    def load(self) -> Loader:
+        """Materialize the loader, if we haven't already.
+
+        NB: Like `FileLoaderBase.from_file()`, this throws a `FileLoadError` if the
+            file can't be loaded."""
+        loader = self._loader
+        if loader is None:
+            logger.debug(f"loading {self.path}")
+            loader = self._loader = self.loader_cls.from_file(self.path)
+            self.loads += 1
+        if self.residency is not None and self._releasable:
+            self.residency.touch(self)
+        return loader
+
+    def release(self) -> bool:
+        """Drop the loader (it'll be loaded again on the next `load()`); returns
+        whether there was anything to drop."""
+        if self._loader is None or not self._releasable:
+            return False
+        logger.debug(f"releasing {self.path}")
+        self._loader = None
+        return True
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        # NB: the residency manager is per-process, and loaders can be reloaded
+        #     (so we don't want their decoded data in our pickles)
+        state["residency"] = None
+        if self._releasable:
+            state["_loader"] = None
+        return state
+
+    def __repr__(self):
+        return f"{self.loader_cls.__name__}({self.path})"
+
+    def __eq__(self, other):
+        if not isinstance(other, FileDescriptor):
+            return NotImplemented
+        return self.path == other.path and self.loader_cls == other.loader_cls
@@ -1,8 +1,9 @@
 import logging
+import numpy as np
 
 from abc import ABC, abstractmethod
 from PIL import Image  # type: ignore
-from typing import Sequence, Tuple, Type, TypeVar
+from typing import Any, Dict, Optional, Sequence, Tuple, Type, TypeVar
 from typing_extensions import Protocol
 
 
@@ -36,6 +37,20 @@ class FileLoaderBase(ABC):
         NB: If this concrete method fails to load the data at the given path, then
             it should throw a `FileLoadError`."""
 
+    @classmethod
+    def read_header(cls, path: str) -> Dict[str, Any]:
+        """Read whatever metadata we can get cheaply (i.e. without decoding the
+        file), for describing a file before it's loaded.
+
+        NB: If the file is clearly not in our format, then this should throw a
+            `FileLoadError`; otherwise, it's fine to return less (or nothing)."""
+        return {}
+
+    def get_footprint(self) -> Optional[int]:
+        """Estimate how many bytes of memory we're holding on to (e.g. decoded pixel
+        or sample data), or `None` if we can't tell."""
+        return None
+
     def __eq__(self, other):
         return self.get_path() == other.get_path() and type(self) == type(other)
 
@@ -115,3 +130,8 @@ class SoundFileLoader(FileLoaderBase):
     @abstractmethod
     def __len__(self) -> int:
         """Length of file in ms"""
+
+    def get_samples(self) -> Tuple[np.ndarray, int]:
+        """The samples, as a float array of shape (channels, samples) scaled to
+        [-1, 1], and the sample rate (in Hz)."""
+        raise NotImplementedError(f"{type(self).__name__} can't provide samples")
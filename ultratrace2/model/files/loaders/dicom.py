@@ -1,17 +1,330 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_right
+from io import BytesIO
 from PIL import Image, ImageFile  # type: ignore
+from typing import Any, BinaryIO, Dict, List, Optional, Sequence, Tuple
 
+import logging
 import numpy as np
 import os
 import pydicom  # type: ignore
+import struct
 
 from .base import FileLoadError, ImageSetFileLoader
 
+try:
+    # pydicom >= 3.0 can decode a single frame straight from a file
+    from pydicom.pixels import pixel_array as decode_pixel_array  # type: ignore
+except ImportError:
+    decode_pixel_array = None  # type: ignore
+
+
+logger = logging.getLogger(__name__)
+
 
 # PIL (via pydicom) will fail to load "truncated" images sometimes, so we need to tell it to
 # ignore these.  For context, see https://github.com/python-pillow/Pillow/issues/1510
 ImageFile.LOAD_TRUNCATED_IMAGES = True
 
 
+PIXEL_DATA_TAG = 0x7FE00010
+ITEM_TAG = 0xFFFEE000
+SEQUENCE_DELIMITER_TAG = 0xFFFEE0DD
+
+# JPEG start-of-image and JPEG 2000 start-of-codestream markers
+FRAME_START_MARKERS = (b"\xff\xd8", b"\xff\x4f")
+
+# Encapsulated transfer syntaxes whose frames PIL can decode by itself (NB: not JPEG
+# Extended, 1.2.840.10008.1.2.4.51, whose 12-bit images PIL generally can't decode)
+PIL_TRANSFER_SYNTAXES = frozenset(
+    [
+        "1.2.840.10008.1.2.4.50",  # JPEG Baseline (Process 1)
+        "1.2.840.10008.1.2.4.90",  # JPEG 2000 (Lossless Only)
+        "1.2.840.10008.1.2.4.91",  # JPEG 2000
+    ]
+)
+
+DEFLATED_TRANSFER_SYNTAX = "1.2.840.10008.1.2.1.99"
+
+# NB: the Tuple is <file_offset, length> of a single fragment's value
+Fragment = Tuple[int, int]
+
+
+class DICOMFrames(ABC):
+    """Random access to the frames of a DICOM's Pixel Data element.
+
+    Frames are always returned as `(n_rows, n_columns)` arrays for greyscale images and
+    `(n_rows, n_columns, rgb_data)` arrays for full-color images."""
+
+    def __init__(self, n_frames: int, n_rows: int, n_columns: int, n_samples: int):
+        self.n_frames = n_frames
+        self.n_rows = n_rows
+        self.n_columns = n_columns
+        self.n_samples = n_samples
+
+    def __len__(self) -> int:
+        return self.n_frames
+
+    def get_frame_shape(self) -> Tuple[int, ...]:
+        if self.n_samples == 1:
+            return (self.n_rows, self.n_columns)
+        return (self.n_rows, self.n_columns, self.n_samples)
+
+    @abstractmethod
+    def get_frame(self, i: int) -> np.ndarray:
+        ...
+
+    def get_footprint(self) -> int:
+        """Bytes of pixel data held in memory (frames read lazily don't count)."""
+        return 0
+
+
+class DecodedDICOMFrames(DICOMFrames):
+    """Frames from a pixel array that has already been decoded into memory."""
+
+    def __init__(self, pixels: np.ndarray):
+        if len(pixels.shape) == 2:
+            # For DICOM consisting of a single frame, we need to add a singleton axis.
+            pixels = np.expand_dims(pixels, axis=0)
+        elif len(pixels.shape) == 4 and pixels.shape[0] == 3 and pixels.shape[3] != 3:
+            # RGB-first
+            pixels = np.moveaxis(pixels, 0, -1)
+        if not (
+            len(pixels.shape) == 3 or (len(pixels.shape) == 4 and pixels.shape[3] == 3)
+        ):
+            raise ValueError(f"unknown shape {pixels.shape}")
+        n_samples = pixels.shape[3] if len(pixels.shape) == 4 else 1
+        super().__init__(pixels.shape[0], pixels.shape[1], pixels.shape[2], n_samples)
+        self.pixels = pixels
+
+    def get_frame(self, i: int) -> np.ndarray:
+        return self.pixels[i]
+
+    def get_footprint(self) -> int:
+        return self.pixels.nbytes
+
+
+class NativeDICOMFrames(DICOMFrames):
+    """Frames of uncompressed Pixel Data, memory-mapped directly from the file."""
+
+    def __init__(
+        self,
+        path: str,
+        offset: int,
+        dtype: np.dtype,
+        n_frames: int,
+        n_rows: int,
+        n_columns: int,
+        n_samples: int,
+        is_planar: bool,
+    ):
+        super().__init__(n_frames, n_rows, n_columns, n_samples)
+        self.is_planar = is_planar and n_samples > 1
+        shape: Tuple[int, ...]
+        if n_samples == 1:
+            shape = (n_frames, n_rows, n_columns)
+        elif self.is_planar:
+            shape = (n_frames, n_samples, n_rows, n_columns)
+        else:
+            shape = (n_frames, n_rows, n_columns, n_samples)
+        self.pixels = np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+    def get_frame(self, i: int) -> np.ndarray:
+        frame = self.pixels[i]
+        if not frame.dtype.isnative:
+            frame = frame.astype(frame.dtype.newbyteorder("="))
+        if self.is_planar:
+            return np.ascontiguousarray(np.moveaxis(frame, 0, -1))
+        return frame
+
+
+class EncapsulatedDICOMFrames(DICOMFrames):
+    """Frames of compressed Pixel Data, decoded by PIL one frame at a time."""
+
+    def __init__(
+        self,
+        path: str,
+        frame_fragments: Sequence[Sequence[Fragment]],
+        n_rows: int,
+        n_columns: int,
+        n_samples: int,
+    ):
+        super().__init__(len(frame_fragments), n_rows, n_columns, n_samples)
+        self.path = path
+        self.frame_fragments = frame_fragments
+
+    def read_frame_bytes(self, i: int) -> bytes:
+        chunks = []
+        with open(self.path, "rb") as fp:
+            for offset, length in self.frame_fragments[i]:
+                fp.seek(offset)
+                chunks.append(fp.read(length))
+        return b"".join(chunks)
+
+    def get_frame(self, i: int) -> np.ndarray:
+        with Image.open(BytesIO(self.read_frame_bytes(i))) as img:
+            return np.asarray(img)
+
+
+class PydicomDICOMFrames(DICOMFrames):
+    """Frames in a transfer syntax PIL can't handle, decoded one at a time by pydicom."""
+
+    def __init__(
+        self, path: str, n_frames: int, n_rows: int, n_columns: int, n_samples: int
+    ):
+        super().__init__(n_frames, n_rows, n_columns, n_samples)
+        self.path = path
+
+    def get_frame(self, i: int) -> np.ndarray:
+        return decode_pixel_array(self.path, index=i)
+
+
+def read_fragments(fp: BinaryIO) -> Tuple[List[int], List[Fragment]]:
+    """Read the Basic Offset Table and the fragment offsets of encapsulated Pixel Data,
+    starting from the current position of `fp` (i.e. the first Item tag).
+
+    Only the item headers are read, the fragments themselves are skipped over."""
+
+    def read_item_header() -> Tuple[int, int]:
+        header = fp.read(8)
+        if len(header) < 8:
+            return SEQUENCE_DELIMITER_TAG, 0  # truncated file
+        group, element, length = struct.unpack("<HHI", header)
+        return (group << 16) | element, length
+
+    tag, length = read_item_header()
+    if tag != ITEM_TAG:
+        raise ValueError("missing Basic Offset Table")
+    basic_offsets = list(struct.unpack(f"<{length // 4}I", fp.read(length)))
+
+    fragments: List[Fragment] = []
+    while True:
+        tag, length = read_item_header()
+        if tag == SEQUENCE_DELIMITER_TAG:
+            break
+        if tag != ITEM_TAG:
+            raise ValueError(f"unexpected tag {tag:08X} in encapsulated Pixel Data")
+        fragments.append((fp.tell(), length))
+        fp.seek(length, os.SEEK_CUR)
+
+    return basic_offsets, fragments
+
+
+def group_fragments_into_frames(
+    fp: BinaryIO, n_frames: int, offsets: Sequence[int], fragments: Sequence[Fragment]
+) -> List[List[Fragment]]:
+    """Work out which fragments make up each frame, using the offset table if there is
+    one and otherwise falling back to the heuristics from PS3.5 Annex A.4."""
+
+    if len(fragments) == 0:
+        raise ValueError("no fragments in encapsulated Pixel Data")
+
+    if n_frames == 1:
+        return [list(fragments)]
+
+    if offsets:
+        # offsets are relative to the first byte of the first fragment's Item tag
+        first_item = fragments[0][0] - 8
+        frames: List[List[Fragment]] = [[] for _ in offsets]
+        for fragment in fragments:
+            frames[bisect_right(offsets, fragment[0] - 8 - first_item) - 1].append(
+                fragment
+            )
+        return frames
+
+    if len(fragments) == n_frames:
+        return [[fragment] for fragment in fragments]
+
+    frames = []
+    for fragment in fragments:
+        fp.seek(fragment[0])
+        if fp.read(2) in FRAME_START_MARKERS or len(frames) == 0:
+            frames.append([])
+        frames[-1].append(fragment)
+    if len(frames) != n_frames:
+        raise ValueError(
+            f"unable to split {len(fragments)} fragments into {n_frames} frames"
+        )
+    return frames
+
+
+def get_native_dtype(dicom: pydicom.Dataset, is_little_endian: bool) -> np.dtype:
+    bits_allocated = dicom.BitsAllocated
+    if bits_allocated not in (8, 16, 32):
+        raise ValueError(f"unsupported BitsAllocated: {bits_allocated}")
+    kind = "i" if dicom.get("PixelRepresentation", 0) == 1 else "u"
+    byteorder = "<" if is_little_endian else ">"
+    return np.dtype(f"{byteorder}{kind}{bits_allocated // 8}")
+
+
+def index_frames(path: str) -> Optional[DICOMFrames]:
+    """Parse only the header and the layout of the Pixel Data element of a DICOM file.
+
+    Returns `None` if the frames can't be read lazily (e.g. for deflated datasets), in
+    which case callers should fall back to decoding the whole `pixel_array`."""
+
+    with open(path, "rb") as fp:
+        dicom = pydicom.dcmread(fp, stop_before_pixels=True)
+        # NB: pydicom leaves the file positioned at the start of the Pixel Data element
+
+        transfer_syntax = dicom.file_meta.TransferSyntaxUID
+        if transfer_syntax == DEFLATED_TRANSFER_SYNTAX:
+            return None
+
+        endian = "<" if transfer_syntax.is_little_endian else ">"
+        header = fp.read(8)
+        if len(header) < 8:
+            raise ValueError("no Pixel Data")
+        group, element = struct.unpack(f"{endian}HH", header[:4])
+        if (group << 16) | element != PIXEL_DATA_TAG:
+            return None
+        if transfer_syntax.is_implicit_VR:
+            (length,) = struct.unpack(f"{endian}I", header[4:])
+        else:
+            # OB and OW have a 2-byte VR, 2 reserved bytes, and a 4-byte length
+            (length,) = struct.unpack(f"{endian}I", fp.read(4))
+
+        n_frames = int(dicom.get("NumberOfFrames", 1) or 1)
+        n_rows = dicom.Rows
+        n_columns = dicom.Columns
+        n_samples = dicom.get("SamplesPerPixel", 1)
+
+        if length != 0xFFFFFFFF:
+            # native (uncompressed) Pixel Data
+            dtype = get_native_dtype(dicom, transfer_syntax.is_little_endian)
+            frame_size = n_rows * n_columns * n_samples * dtype.itemsize
+            if length < n_frames * frame_size:
+                raise ValueError(
+                    f"Pixel Data too short for {n_frames} frames ({length} bytes)"
+                )
+            return NativeDICOMFrames(
+                path,
+                fp.tell(),
+                dtype,
+                n_frames,
+                n_rows,
+                n_columns,
+                n_samples,
+                dicom.get("PlanarConfiguration", 0) == 1,
+            )
+
+        if transfer_syntax not in PIL_TRANSFER_SYNTAXES:
+            if decode_pixel_array is None:
+                return None
+            return PydicomDICOMFrames(path, n_frames, n_rows, n_columns, n_samples)
+
+        basic_offsets, fragments = read_fragments(fp)
+        if "ExtendedOffsetTable" in dicom:
+            extended = dicom.ExtendedOffsetTable
+            basic_offsets = list(struct.unpack(f"<{len(extended) // 8}Q", extended))
+        frame_fragments = group_fragments_into_frames(
+            fp, n_frames, basic_offsets, fragments
+        )
+        return EncapsulatedDICOMFrames(
+            path, frame_fragments, n_rows, n_columns, n_samples
+        )
+
+
 class DICOMLoader(ImageSetFileLoader):
     def get_path(self) -> str:
         return self._path
@@ -19,29 +332,31 @@ class DICOMLoader(ImageSetFileLoader):
     def set_path(self, path) -> None:
         self._path = path
 
-    def __init__(self, path: str, pixels: np.ndarray):
-        """Construct the DICOMLoader from a pixel array.
+    def __init__(self, path: str, frames: DICOMFrames):
+        """Construct the DICOMLoader from a (possibly lazy) set of frames.
 
-        The `shape` of the pixel array should be `(n_frames, n_rows, n_columns)` for greyscale
-        images and `(n_frames, n_rows, n_columns, rgb_data)` for full-color images."""
+        Frames are only decoded when they're requested with `get_frame()`."""
         self.set_path(path)
-        self.pixels = pixels
+        self.frames = frames
         # FIXME: these should be in the `.ultratrace/` dir
         self.png_dir = f"{path}-frames"
         if not os.path.exists(self.png_dir):
             os.mkdir(self.png_dir, mode=0o755)
 
     def is_greyscale(self) -> bool:
-        return len(self.pixels.shape) == 3
+        return self.frames.n_samples == 1
 
     def __len__(self) -> int:
-        return self.pixels.shape[0]
+        return len(self.frames)
 
     def get_height(self) -> int:
-        return self.pixels.shape[1]
+        return self.frames.n_rows
 
     def get_width(self) -> int:
-        return self.pixels.shape[2]
+        return self.frames.n_columns
+
+    def get_footprint(self) -> Optional[int]:
+        return self.frames.get_footprint()
 
     def get_png_filepath_for_frame(self, i: int) -> str:
         return os.path.join(self.png_dir, f"{i:06}.png")
@@ -51,10 +366,7 @@ class DICOMLoader(ImageSetFileLoader):
         if os.path.exists(png_filepath):
             return Image.open(png_filepath)
         else:
-            arr = (
-                self.pixels[i, :, :] if self.is_greyscale() else self.pixels[i, :, :, :]
-            )
-            img = Image.fromarray(arr)
+            img = Image.fromarray(self.frames.get_frame(i))
             img.save(png_filepath, format="PNG", compress_level=1)
             return img
 
@@ -65,39 +377,34 @@ class DICOMLoader(ImageSetFileLoader):
             if not os.path.exists(path):
                 raise FileNotFoundError(f"Cannot load from path: '{path}'")
 
-            dicom = pydicom.read_file(path)
-
-            pixels: np.ndarray = dicom.pixel_array
+            frames = index_frames(path)
+            if frames is None:
+                logger.warning(
+                    f"unable to read frames of {path} lazily, decoding all pixel data"
+                )
+                frames = DecodedDICOMFrames(pydicom.dcmread(path).pixel_array)
 
-            if len(pixels.shape) == 2:
-                # For DICOM consisting of a single frame, we need to add a singleton axis.
-                pixels = np.expand_dims(pixels, axis=0)
-                return cls(path, pixels)
-
-            elif len(pixels.shape) == 3:
-                n_frames, n_rows, n_columns = pixels.shape
-                return cls(path, pixels)
-
-            elif len(pixels.shape) == 4:
-                # full-color RGB
-                if pixels.shape[0] == 3:
-                    # RGB-first
-                    rgb, n_frames, n_rows, n_columns = pixels.shape
-                    pixels.reshape((n_frames, n_rows, n_columns, rgb))
-                    return cls(path, pixels)
-
-                elif pixels.shape[3] == 3:
-                    # RGB-last
-                    n_frames, n_rows, n_columns, rgb = pixels.shape
-                    return cls(path, pixels)
-
-            raise ValueError(f"Invalid DICOM ({path}), unknown shape {pixels.shape}")
+            return cls(path, frames)
 
         except Exception as e:
             raise FileLoadError(
                 f"Invalid DICOM ({path}), unable to read: {str(e)}"
             ) from e
 
+    @classmethod
+    def read_header(cls, path: str) -> Dict[str, Any]:
+        try:
+            dataset = pydicom.dcmread(path, stop_before_pixels=True)
+            return {
+                "n_frames": int(dataset.get("NumberOfFrames", 1)),
+                "n_rows": int(dataset.Rows),
+                "n_columns": int(dataset.Columns),
+            }
+        except Exception as e:
+            raise FileLoadError(
+                f"Invalid DICOM ({path}), unable to read header: {str(e)}"
+            ) from e
+
     def convert_to_png(self, *args, **kwargs):
         # FIXME: implement this as a helper function
         raise NotImplementedError()
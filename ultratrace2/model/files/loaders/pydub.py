@@ -1,5 +1,8 @@
+import numpy as np
 import pydub  # type: ignore
 
+from typing import Optional, Tuple
+
 from .base import FileLoadError, SoundFileLoader
 
 
@@ -17,10 +20,21 @@ class PydubLoader(SoundFileLoader):
     def __len__(self) -> int:
         return len(self.audio_segment)
 
+    def get_footprint(self) -> Optional[int]:
+        return len(self.audio_segment.raw_data)
+
+    def get_samples(self) -> Tuple[np.ndarray, int]:
+        segment = self.audio_segment
+        samples = np.array(segment.get_array_of_samples(), dtype=np.float64)
+        samples /= 1 << (8 * segment.sample_width - 1)
+        # NB: pydub interleaves the channels
+        samples = samples.reshape(-1, segment.channels).T
+        return samples, segment.frame_rate
+
     @classmethod
     def from_file(cls, path: str) -> "PydubLoader":
         try:
             audio_segment = pydub.AudioSegment.from_file(path)
-            return PydubLoader(path, audio_segment)
+            return cls(path, audio_segment)
         except Exception as e:
             raise FileLoadError(f"Invalid AudioSegment ({path}), unable to read") from e
@@ -1,8 +1,27 @@
+from io import BytesIO
 from PIL import Image  # type: ignore
+from pydicom.dataset import Dataset, FileMetaDataset  # type: ignore
+from pydicom.encaps import encapsulate  # type: ignore
+from pydicom.uid import (  # type: ignore
+    ExplicitVRBigEndian,
+    ExplicitVRLittleEndian,
+    ImplicitVRLittleEndian,
+    JPEGBaseline8Bit,
+    UID,
+    generate_uid,
+)
 
+import numpy as np
+import pydicom  # type: ignore
 import pytest
 
-from ..dicom import DICOMLoader
+from ..dicom import (
+    DICOMLoader,
+    EncapsulatedDICOMFrames,
+    NativeDICOMFrames,
+    group_fragments_into_frames,
+    index_frames,
+)
 from ..base import FileLoadError
 
 
@@ -41,3 +60,124 @@ def test_loading_from_valid_file(path, n_frames, height, width, is_greyscale) ->
     assert loader.get_width() == width
     assert loader.is_greyscale() == is_greyscale
     assert isinstance(loader.get_frame(0), Image.Image)
+
+
+def _write_dicom(path, pixels, transfer_syntax=ExplicitVRLittleEndian, planar=False):
+    file_meta = FileMetaDataset()
+    file_meta.TransferSyntaxUID = transfer_syntax
+    file_meta.MediaStorageSOPClassUID = UID("1.2.840.10008.5.1.4.1.1.3.1")
+    file_meta.MediaStorageSOPInstanceUID = generate_uid()
+    dicom = Dataset()
+    dicom.file_meta = file_meta
+    dicom.SOPClassUID = file_meta.MediaStorageSOPClassUID
+    dicom.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+    dicom.NumberOfFrames = pixels.shape[0]
+    dicom.Rows = pixels.shape[1]
+    dicom.Columns = pixels.shape[2]
+    dicom.BitsAllocated = dicom.BitsStored = 8 * pixels.itemsize
+    dicom.HighBit = dicom.BitsStored - 1
+    dicom.PixelRepresentation = 0
+    if len(pixels.shape) == 4:
+        dicom.SamplesPerPixel = 3
+        dicom.PhotometricInterpretation = "RGB"
+        dicom.PlanarConfiguration = 1 if planar else 0
+        if planar:
+            pixels = np.moveaxis(pixels, -1, 1)
+    else:
+        dicom.SamplesPerPixel = 1
+        dicom.PhotometricInterpretation = "MONOCHROME2"
+    if transfer_syntax == JPEGBaseline8Bit:
+        frames = []
+        for frame in pixels:
+            buf = BytesIO()
+            Image.fromarray(frame).save(buf, format="JPEG", quality=95)
+            frames.append(buf.getvalue())
+        dicom.PixelData = encapsulate(frames)
+        dicom["PixelData"].VR = "OB"
+        dicom["PixelData"].is_undefined_length = True
+    elif transfer_syntax == ExplicitVRBigEndian:
+        dicom.PixelData = pixels.astype(pixels.dtype.newbyteorder(">")).tobytes()
+    else:
+        dicom.PixelData = np.ascontiguousarray(pixels).tobytes()
+    dicom.is_little_endian = transfer_syntax != ExplicitVRBigEndian
+    dicom.is_implicit_VR = transfer_syntax == ImplicitVRLittleEndian
+    pydicom.dcmwrite(path, dicom, write_like_original=False)
+
+
+def _get_pixels(shape, dtype=np.uint8) -> np.ndarray:
+    return (np.arange(np.prod(shape)) % 251).astype(dtype).reshape(shape)
+
+
+@pytest.mark.parametrize(
+    "shape,dtype,transfer_syntax,planar",
+    [
+        ((5, 24, 32), np.uint8, ExplicitVRLittleEndian, False),
+        ((5, 24, 32), np.uint8, ImplicitVRLittleEndian, False),
+        ((5, 24, 32), np.uint16, ExplicitVRLittleEndian, False),
+        ((5, 24, 32), np.uint16, ExplicitVRBigEndian, False),
+        ((5, 24, 32, 3), np.uint8, ExplicitVRLittleEndian, False),
+        ((5, 24, 32, 3), np.uint8, ExplicitVRLittleEndian, True),
+        ((1, 24, 32), np.uint8, ExplicitVRLittleEndian, False),
+    ],
+)
+def test_native_frames_are_read_lazily(
+    shape, dtype, transfer_syntax, planar, tmp_path, mocker
+) -> None:
+    path = str(tmp_path / "native.dcm")
+    pixels = _get_pixels(shape, dtype)
+    _write_dicom(path, pixels, transfer_syntax, planar)
+    decode = mocker.spy(Dataset, "pixel_array")
+
+    frames = index_frames(path)
+    assert isinstance(frames, NativeDICOMFrames)
+    assert len(frames) == shape[0]
+    assert frames.get_frame_shape() == shape[1:]
+    for i in range(shape[0]):
+        assert np.array_equal(frames.get_frame(i), pixels[i])
+    decode.assert_not_called()
+
+
+def test_encapsulated_frames_are_read_lazily(tmp_path) -> None:
+    path = str(tmp_path / "jpeg.dcm")
+    pixels = np.zeros((4, 32, 48), dtype=np.uint8)
+    for i in range(4):
+        start, stop = i * 8, (i + 1) * 8
+        pixels[i, :, start:stop] = 255
+    _write_dicom(path, pixels, JPEGBaseline8Bit)
+
+    frames = index_frames(path)
+    assert isinstance(frames, EncapsulatedDICOMFrames)
+    assert len(frames) == 4
+    for i in range(4):
+        frame = frames.get_frame(i)
+        assert frame.shape == (32, 48)
+        assert np.abs(frame.astype(int) - pixels[i]).mean() < 8
+
+
+@pytest.mark.parametrize("n_fragments_per_frame", [1, 3])
+def test_group_fragments_without_offset_table(n_fragments_per_frame: int) -> None:
+    frame_data = b"\xff\xd8" + bytes(10)
+    chunk = len(frame_data) // n_fragments_per_frame + 1
+    contents = BytesIO()
+    fragments = []
+    for _ in range(3):
+        for j in range(0, len(frame_data), chunk):
+            data = frame_data[j:][:chunk]
+            fragments.append((contents.tell(), len(data)))
+            contents.write(data)
+    frames = group_fragments_into_frames(contents, 3, [], fragments)
+    assert len(frames) == 3
+    assert all(len(frame) == n_fragments_per_frame for frame in frames)
+
+
+def test_dicom_loader_uses_lazy_frames(tmp_path) -> None:
+    path = str(tmp_path / "native.dcm")
+    pixels = _get_pixels((3, 24, 32))
+    _write_dicom(path, pixels)
+
+    loader = DICOMLoader.from_file(path)
+    assert len(loader) == 3
+    assert loader.get_height() == 24
+    assert loader.get_width() == 32
+    assert loader.is_greyscale()
+    assert np.array_equal(np.asarray(loader.get_frame(2)), pixels[2])
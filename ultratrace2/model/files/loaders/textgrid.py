@@ -1,8 +1,7 @@
-from typing import IO, Sequence
+from typing import Sequence
 
 import logging
 import os
-import tempfile
 import textgrid  # type: ignore
 
 from .base import AlignmentFileLoader, FileLoadError, Intervals
@@ -104,17 +103,10 @@ class TextGridLoader(AlignmentFileLoader):
         if encoding == "utf-8" or encoding == "utf-16":
             return textgrid.TextGrid.fromFile(path)
         else:
-            with tempfile.NamedTemporaryFile() as temp_file:
-                TextGridLoader.copy_to_temp_file_with_encoding(
-                    path, temp_file, encoding
-                )
-                return textgrid.TextGrid.fromFile(temp_file.name)
-
-    @staticmethod
-    def copy_to_temp_file_with_encoding(
-        original_path: str, temp_file: IO[bytes], encoding: str
-    ) -> None:
-        with open(original_path, "rb") as orig_file:
-            transcoded_contents = orig_file.read().decode(encoding).encode("utf-8")
-            temp_file.write(transcoded_contents)
-            temp_file.seek(0)
+            # NB: check the whole file decodes before parsing (the parser would
+            #     otherwise accept a wrong 8-bit encoding without complaint)
+            with open(path, "rb") as fp:
+                fp.read().decode(encoding)
+            tg_data = textgrid.TextGrid()
+            tg_data.read(path, encoding=encoding)
+            return tg_data
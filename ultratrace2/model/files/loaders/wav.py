@@ -1,3 +1,7 @@
+import wave
+
+from typing import Any, Dict
+
 from .pydub import PydubLoader
 
 
@@ -5,3 +9,19 @@ class WAVLoader(PydubLoader):
     @staticmethod
     def get_priority() -> int:
         return 3
+
+    @classmethod
+    def read_header(cls, path: str) -> Dict[str, Any]:
+        try:
+            with wave.open(path, "rb") as fp:
+                n_frames = fp.getnframes()
+                frame_rate = fp.getframerate()
+                return {
+                    "channels": fp.getnchannels(),
+                    "frame_rate": frame_rate,
+                    "n_frames": n_frames,
+                    "duration": n_frames / frame_rate,
+                }
+        except (wave.Error, EOFError, ZeroDivisionError):
+            # e.g. a compressed WAV, which only pydub (ffmpeg) can read
+            return {}
@@ -1,4 +1,3 @@
-import magic  # type: ignore
 import os
 
 from typing import Dict, Mapping, Optional, Sequence, Set, Type, Union
@@ -9,6 +8,7 @@ from .loaders.base import (
     ImageSetFileLoader,
     SoundFileLoader,
 )
+from .scanner import get_mime_type
 
 
 AbstractLoader = Union[
@@ -61,10 +61,15 @@ def register_loader_for_extensions_and_mime_types(
         __mime_type_to_loaders_map[mime_type] = loader_cls
 
 
-def get_loader_for(path: str) -> Optional[Type[FileLoaderBase]]:
+def get_loader_for(
+    path: str, mime_type: Optional[str] = None
+) -> Optional[Type[FileLoaderBase]]:
+    """Find the loader for a file, sniffing its MIME type unless it's already known
+    (e.g. from a DirectoryScanner)."""
 
     _, extension = os.path.splitext(path.lower())
-    mime_type = magic.Magic(mime=True).from_file(path)
+    if mime_type is None:
+        mime_type = get_mime_type(path)
     if mime_type is None:
         # Early return since we can't possibly match anymore
         return None
@@ -0,0 +1,97 @@
+import logging
+
+from collections import OrderedDict
+from typing import NamedTuple, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .descriptor import FileDescriptor  # noqa: F401
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_BUDGET = 512 * 1024 * 1024
+
+
+class ResidencyStats(NamedTuple):
+    budget: int
+    resident_bytes: int
+    resident_files: int
+    loads: int  # including reloads
+    reloads: int  # of files we'd evicted before
+    evictions: int
+    evicted_bytes: int
+
+
+class ResidencyManager:
+    """Keeps the loaders of `FileDescriptor`s under a memory budget.
+
+    Descriptors report every `load()` here, and we keep them in least-recently-used
+    order along with an estimate of their loader's footprint (see
+    `FileLoaderBase.get_footprint()`; loaders that can't tell are assumed to take up
+    about as much as their file).  Once the loaders we know about add up to more than
+    `budget` bytes, the least-recently-used ones are released, and they'll be loaded
+    again on their next access.  The most recently used loader is never released,
+    even if it's over budget by itself."""
+
+    def __init__(self, budget: int = DEFAULT_BUDGET):
+        self.budget = budget
+        self.resident_bytes = 0
+        # NB: keyed by `id()`, since descriptors aren't hashable
+        self._resident: "OrderedDict[int, Tuple[FileDescriptor, int]]" = OrderedDict()
+        self.loads = 0
+        self.reloads = 0
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def set_budget(self, budget: int) -> None:
+        self.budget = budget
+        self._evict()
+
+    def get_stats(self) -> ResidencyStats:
+        return ResidencyStats(
+            budget=self.budget,
+            resident_bytes=self.resident_bytes,
+            resident_files=len(self._resident),
+            loads=self.loads,
+            reloads=self.reloads,
+            evictions=self.evictions,
+            evicted_bytes=self.evicted_bytes,
+        )
+
+    def touch(self, descriptor: "FileDescriptor") -> None:
+        key = id(descriptor)
+        if key in self._resident:
+            self._resident.move_to_end(key)
+            return
+        footprint = self.estimate_footprint(descriptor)
+        self._resident[key] = (descriptor, footprint)
+        self.resident_bytes += footprint
+        self.loads += 1
+        if descriptor.loads > 1:
+            self.reloads += 1
+        self._evict()
+
+    def forget(self, descriptor: "FileDescriptor") -> None:
+        """Stop tracking a descriptor (e.g. because its file is gone)."""
+        entry = self._resident.pop(id(descriptor), None)
+        if entry is not None:
+            self.resident_bytes -= entry[1]
+
+    @staticmethod
+    def estimate_footprint(descriptor: "FileDescriptor") -> int:
+        loader = descriptor.get_loaded()
+        footprint = None if loader is None else loader.get_footprint()
+        return descriptor.size if footprint is None else footprint
+
+    def _evict(self) -> None:
+        while self.resident_bytes > self.budget and len(self._resident) > 1:
+            _, (descriptor, footprint) = self._resident.popitem(last=False)
+            self.resident_bytes -= footprint
+            if descriptor.release():
+                self.evictions += 1
+                self.evicted_bytes += footprint
+                logger.debug(
+                    f"evicted {descriptor.get_path()} ({footprint} bytes), "
+                    f"{self.resident_bytes}/{self.budget} bytes resident"
+                )
@@ -0,0 +1,174 @@
+import json
+import logging
+import magic  # type: ignore
+import os
+import stat as st
+import threading
+
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AbstractSet, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+# libmagic handles aren't thread-safe, so each thread gets its own
+_local = threading.local()
+
+
+def get_mime_type(path: str) -> Optional[str]:
+    """Sniff the MIME type of a file, reusing this thread's libmagic handle."""
+    handle = getattr(_local, "magic", None)
+    if handle is None:
+        handle = _local.magic = magic.Magic(mime=True)
+    return handle.from_file(path)
+
+
+class ScanEntry(NamedTuple):
+    path: str  # as found under the root (possibly a symlink)
+    realpath: str
+    size: int
+    mtime_ns: int
+    mime_type: Optional[str]
+
+
+class DirectoryScanner:
+    """Walks a directory tree and sniffs the MIME type of every file.
+
+    MIME types are persisted in a scan cache keyed by (path, size, mtime), so
+    rescanning an unchanged tree only costs one `stat()` per file; everything
+    else is sniffed in a thread pool."""
+
+    CACHE_VERSION = 1
+
+    def __init__(self, cache_file: Optional[str] = None, max_workers: int = 8):
+        self.cache_file = cache_file
+        self.max_workers = max_workers
+        self.cache: Dict[str, Tuple[int, int, Optional[str]]] = self._load_cache()
+        self.hits = 0
+        self.misses = 0
+        self.broken: List[str] = []
+
+    def _load_cache(self) -> Dict[str, Tuple[int, int, Optional[str]]]:
+        if self.cache_file is None or not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file) as fp:
+                data = json.load(fp)
+            if data.get("version") != self.CACHE_VERSION:
+                return {}
+            return {
+                path: (size, mtime_ns, mime_type)
+                for path, (size, mtime_ns, mime_type) in data["entries"].items()
+            }
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.warning(f"ignoring unreadable scan cache {self.cache_file}: {e}")
+            return {}
+
+    def _save_cache(self) -> None:
+        if self.cache_file is None:
+            return
+        tmp_file = self.cache_file + ".tmp"
+        try:
+            with open(tmp_file, "w") as fp:
+                json.dump(
+                    {"version": self.CACHE_VERSION, "entries": self.cache},
+                    fp,
+                    separators=(",", ":"),
+                )
+            os.replace(tmp_file, self.cache_file)
+        except OSError as e:
+            logger.warning(f"unable to write scan cache {self.cache_file}: {e}")
+
+    def walk(
+        self, root_path: str, exclude_dirs: AbstractSet[str]
+    ) -> Iterator[Tuple[str, str, os.stat_result]]:
+        """Yields (path, realpath, stat) for every file under `root_path`, top-down,
+        skipping `exclude_dirs` (like `os.walk()`, symlinked directories aren't
+        followed).  Broken symlinks are skipped too, and collected in `broken`."""
+        dirs = [root_path]
+        while dirs:
+            path = dirs.pop(0)
+            try:
+                entries = sorted(os.scandir(path), key=lambda entry: entry.name)
+            except OSError as e:
+                logger.warning(f"unable to scan {path}: {e}")
+                continue
+            subdirs = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in exclude_dirs:
+                        subdirs.append(entry.path)
+                    continue
+                try:
+                    # cached by `scandir()` unless this is a symlink
+                    stat = entry.stat()
+                except OSError:
+                    self.broken.append(entry.path)
+                    continue
+                if not st.S_ISREG(stat.st_mode):
+                    # symlinked directories, devices, FIFOs etc.
+                    continue
+                realpath = entry.path
+                if entry.is_symlink():
+                    realpath = os.path.realpath(entry.path)
+                    if not os.path.exists(realpath):
+                        self.broken.append(entry.path)
+                        continue
+                yield entry.path, realpath, stat
+            dirs[0:0] = subdirs
+
+    def scan(
+        self, root_path: str, exclude_dirs: AbstractSet[str] = frozenset()
+    ) -> List[ScanEntry]:
+        found: List[Tuple[str, str, os.stat_result]] = []
+        mime_types: Dict[str, Optional[str]] = {}
+        sniffing: List[Tuple[str, Future]] = []
+        checked = 0
+
+        # files are sniffed while we're still walking the tree
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            for path, realpath, stat in self.walk(root_path, exclude_dirs):
+                found.append((path, realpath, stat))
+                cached = self.cache.get(realpath)
+                if cached is not None and cached[:2] == (
+                    stat.st_size,
+                    stat.st_mtime_ns,
+                ):
+                    mime_types[realpath] = cached[2]
+                    self.hits += 1
+                elif realpath not in mime_types:
+                    mime_types[realpath] = None
+                    sniffing.append((realpath, executor.submit(self._sniff, realpath)))
+                    self.misses += 1
+                # fail early (e.g. on an unreadable file) rather than after the walk
+                while checked < len(sniffing) and sniffing[checked][1].done():
+                    sniffing[checked][1].result()
+                    checked += 1
+            for realpath, future in sniffing:
+                mime_types[realpath] = future.result()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        entries = [
+            ScanEntry(
+                path, realpath, stat.st_size, stat.st_mtime_ns, mime_types[realpath]
+            )
+            for path, realpath, stat in found
+        ]
+        # only keep what's still there
+        self.cache = {
+            entry.realpath: (entry.size, entry.mtime_ns, entry.mime_type)
+            for entry in entries
+        }
+        self._save_cache()
+        return entries
+
+    @staticmethod
+    def _sniff(path: str) -> Optional[str]:
+        try:
+            return get_mime_type(path)
+        except FileNotFoundError:
+            # removed since we walked the tree
+            logger.warning(f"unable to open {path}: file has disappeared")
+            return None
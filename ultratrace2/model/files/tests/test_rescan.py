@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from ..bundle import FileBundleList
+from ..loaders.base import SoundFileLoader
+
+
+class FakeSoundLoader(SoundFileLoader):
+    loads = 0
+
+    def __init__(self, path: str):
+        self.set_path(path)
+
+    def get_path(self) -> str:
+        return self._path
+
+    def set_path(self, path) -> None:
+        self._path = path
+
+    def __len__(self) -> int:
+        return 0
+
+    @classmethod
+    def from_file(cls, path: str) -> "FakeSoundLoader":
+        cls.loads += 1
+        return cls(path)
+
+
+@pytest.fixture
+def fake_loader(mocker):
+    FakeSoundLoader.loads = 0
+    mocker.patch(
+        "ultratrace2.model.files.scanner.get_mime_type", return_value="audio/x-wav"
+    )
+    mocker.patch(
+        "ultratrace2.model.files.bundle.get_loader_for", return_value=FakeSoundLoader
+    )
+    return FakeSoundLoader
+
+
+def test_update_from_dir(tmp_path, fake_loader):
+    (tmp_path / "a.wav").write_bytes(b"a")
+    (tmp_path / "b.wav").write_bytes(b"b")
+    files = FileBundleList.build_from_dir(str(tmp_path))
+    assert sorted(files.bundles) == ["a", "b"]
+    assert files.has_sound_impl
+    bundle_a = files.bundles["a"]
+    assert fake_loader.loads == 0
+
+    # nothing changed, nothing described again
+    result = files.update_from_dir(str(tmp_path))
+    assert result.is_empty()
+
+    (tmp_path / "b.wav").unlink()
+    (tmp_path / "c.wav").write_bytes(b"c")
+    (tmp_path / "a.wav").write_bytes(b"aa")
+    result = files.update_from_dir(str(tmp_path))
+    assert result.added == [str(tmp_path / "c.wav")]
+    assert result.removed == [str(tmp_path / "b.wav")]
+    assert result.changed == [str(tmp_path / "a.wav")]
+    assert sorted(files.bundles) == ["a", "c"]
+    assert fake_loader.loads == 0
+
+    # bundles are updated in place
+    assert files.bundles["a"] is bundle_a
+    assert bundle_a.sound_file is not None
+    assert bundle_a.sound_file.get_path() == os.path.join(str(tmp_path), "a.wav")
+    assert bundle_a.sound_descriptor is not None
+    assert bundle_a.sound_descriptor.size == 2
+    assert fake_loader.loads == 1
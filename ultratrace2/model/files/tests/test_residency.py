@@ -0,0 +1,77 @@
+import pickle
+
+from ..bundle import FileBundle
+from ..descriptor import FileDescriptor
+from ..residency import ResidencyManager
+from .test_rescan import FakeSoundLoader
+
+
+def make_descriptor(path: str, size: int) -> FileDescriptor:
+    return FileDescriptor(path, FakeSoundLoader, size=size)
+
+
+def test_descriptor_loads_lazily():
+    FakeSoundLoader.loads = 0
+    bundle = FileBundle("a")
+    bundle.set_descriptor(make_descriptor("a.wav", 10))
+    assert bundle.has_impl()
+    assert str(bundle) == 'Bundle("a",None,None,FakeSoundLoader(a.wav))'
+    assert FakeSoundLoader.loads == 0
+    assert bundle.get_sound_file() is bundle.get_sound_file()
+    assert FakeSoundLoader.loads == 1
+
+
+def test_descriptor_pickles_without_loader():
+    descriptor = make_descriptor("a.wav", 10)
+    descriptor.load()
+    assert descriptor.is_loaded()
+    assert not pickle.loads(pickle.dumps(descriptor)).is_loaded()
+
+    # ... unless we can't load it again
+    descriptor = FileDescriptor.from_loader(FakeSoundLoader("b.wav"))
+    assert pickle.loads(pickle.dumps(descriptor)).is_loaded()
+
+
+def test_residency_releases_least_recently_used():
+    residency = ResidencyManager(budget=25)
+    a, b, c = [make_descriptor(f"{name}.wav", 10) for name in "abc"]
+    for descriptor in [a, b, c]:
+        descriptor.residency = residency
+
+    a.load()
+    b.load()
+    a.load()
+    c.load()
+    assert (a.is_loaded(), b.is_loaded(), c.is_loaded()) == (True, False, True)
+    assert residency.resident_bytes == 20
+
+    # released loaders come back on their next access
+    assert b.load().get_path() == "b.wav"
+    assert (a.is_loaded(), b.is_loaded(), c.is_loaded()) == (False, True, True)
+
+
+class HeavySoundLoader(FakeSoundLoader):
+    def get_footprint(self):
+        return 100
+
+
+def test_residency_uses_footprints_and_counts():
+    residency = ResidencyManager(budget=150)
+    a, b = [FileDescriptor(f"{name}.wav", HeavySoundLoader, size=1) for name in "ab"]
+    for descriptor in [a, b]:
+        descriptor.residency = residency
+
+    a.load()
+    assert residency.resident_bytes == 100
+    b.load()
+    a.load()
+    stats = residency.get_stats()
+    assert (stats.resident_bytes, stats.resident_files) == (100, 1)
+    assert (stats.loads, stats.reloads) == (3, 1)
+    assert (stats.evictions, stats.evicted_bytes) == (2, 200)
+
+    residency.set_budget(50)
+    assert a.is_loaded()  # the most recently used file stays
+    residency.set_budget(250)
+    b.load()
+    assert (a.is_loaded(), b.is_loaded()) == (True, True)
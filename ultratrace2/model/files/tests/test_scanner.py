@@ -0,0 +1,68 @@
+import os
+
+from ..scanner import DirectoryScanner
+
+
+def make_tree(root):
+    (root / "sub").mkdir()
+    (root / ".git").mkdir()
+    (root / "a.txt").write_text("hello")
+    (root / "sub" / "b.txt").write_text("world")
+    (root / ".git" / "c.txt").write_text("ignored")
+
+
+def test_scan_finds_files(tmp_path, mocker):
+    make_tree(tmp_path)
+    mocker.patch(
+        "ultratrace2.model.files.scanner.get_mime_type", return_value="text/plain"
+    )
+    entries = DirectoryScanner().scan(str(tmp_path), {".git"})
+    assert [os.path.relpath(entry.path, tmp_path) for entry in entries] == [
+        "a.txt",
+        os.path.join("sub", "b.txt"),
+    ]
+    assert all(entry.mime_type == "text/plain" for entry in entries)
+
+
+def test_scan_skips_broken_symlinks(tmp_path, mocker):
+    (tmp_path / "missing.txt").symlink_to(tmp_path / "nowhere")
+    (tmp_path / "a.txt").write_text("hello")
+    (tmp_path / "link.txt").symlink_to(tmp_path / "a.txt")
+    mocker.patch(
+        "ultratrace2.model.files.scanner.get_mime_type", return_value="text/plain"
+    )
+    scanner = DirectoryScanner()
+    entries = scanner.scan(str(tmp_path))
+    assert scanner.broken == [str(tmp_path / "missing.txt")]
+    assert [(entry.path, entry.realpath) for entry in entries] == [
+        (str(tmp_path / "a.txt"), str(tmp_path / "a.txt")),
+        (str(tmp_path / "link.txt"), str(tmp_path / "a.txt")),
+    ]
+
+
+def test_scan_cache(tmp_path, mocker):
+    root = tmp_path / "root"
+    root.mkdir()
+    make_tree(root)
+    cache_file = str(tmp_path / "scan-cache.json")
+    mock_get_mime_type = mocker.patch(
+        "ultratrace2.model.files.scanner.get_mime_type", return_value="text/plain"
+    )
+
+    scanner = DirectoryScanner(cache_file)
+    scanner.scan(str(root), {".git"})
+    assert (scanner.hits, scanner.misses) == (0, 2)
+    assert mock_get_mime_type.call_count == 2
+
+    # an unchanged tree is only stat-ed
+    scanner = DirectoryScanner(cache_file)
+    scanner.scan(str(root), {".git"})
+    assert (scanner.hits, scanner.misses) == (2, 0)
+    assert mock_get_mime_type.call_count == 2
+
+    # only changed files are sniffed again
+    (root / "a.txt").write_text("hello, world")
+    scanner = DirectoryScanner(cache_file)
+    scanner.scan(str(root), {".git"})
+    assert (scanner.hits, scanner.misses) == (1, 1)
+    assert mock_get_mime_type.call_count == 3
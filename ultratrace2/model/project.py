@@ -2,8 +2,10 @@ import logging
 import os
 import pickle
 
+from typing import Optional
+
 from .trace import TraceList
-from .files.bundle import FileBundleList
+from .files.bundle import FileBundleList, RescanResult
 
 logger = logging.getLogger(__name__)
 
@@ -16,8 +18,25 @@ class Project:
         self.traces = traces
         self.files = files
 
-    def save(self):
-        raise NotImplementedError()
+    def save(self, save_file: str) -> None:
+        # write under a temporary name so that a failed save never clobbers the last one
+        tmp_file = save_file + ".tmp"
+        with open(tmp_file, "wb") as fp:
+            pickle.dump(self, fp)
+        os.replace(tmp_file, save_file)
+
+    def rescan(self, root_path: str) -> RescanResult:
+        """Pick up files added to, removed from or changed under `root_path` since the
+        last scan, keeping the traces."""
+        result = self.files.update_from_dir(
+            root_path, scan_cache_file=self.get_scan_cache_file(root_path)
+        )
+        if not result.is_empty():
+            logger.info(
+                f"Rescanned {root_path}: {len(result.added)} added, "
+                f"{len(result.removed)} removed, {len(result.changed)} changed"
+            )
+        return result
 
     @classmethod
     def load(cls, save_file: str) -> "Project":
@@ -26,8 +45,40 @@ class Project:
             assert isinstance(project, Project)
             return project
 
+    def save_to_store(self, root_path: str) -> None:
+        """Save to the SQLite store of the project at `root_path` (see store.py)."""
+        from .store import ProjectStore  # NB: store.py imports this module
+
+        with ProjectStore.open(root_path) as store:
+            store.save_project(self)
+
+    @classmethod
+    def load_from_store(cls, root_path: str) -> "Project":
+        """Load the project at `root_path` from its SQLite store (see store.py), with
+        whatever files are under `root_path` now (which the store doesn't pickle, so
+        they are always scanned, if only against the scan cache).  A store without
+        any traces yet is first filled from the project's `metadata.json` and/or
+        `project.pkl`, if it has either."""
+        from .store import ProjectStore  # NB: store.py imports this module
+
+        files = FileBundleList.build_from_dir(
+            root_path, scan_cache_file=cls.get_scan_cache_file(root_path)
+        )
+        with ProjectStore.open(root_path) as store:
+            if not store.get_traces():
+                store.migrate(root_path)
+            project = store.load_project(files)
+            store.save_project(project)
+        return project
+
     @classmethod
-    def get_by_path(cls, root_path: str) -> "Project":
+    def get_by_path(
+        cls,
+        root_path: str,
+        rescan: bool = True,
+        memory_budget: Optional[int] = None,
+        use_store: bool = False,
+    ) -> "Project":
 
         root_path = os.path.realpath(os.path.abspath(root_path))  # absolute path
         if not os.path.exists(root_path):
@@ -44,18 +95,37 @@ class Project:
         if not os.path.exists(save_dir):
             os.mkdir(save_dir, mode=0o755)
 
+        if use_store:
+            project = cls.load_from_store(root_path)
+            if memory_budget is not None:
+                project.files.set_memory_budget(memory_budget)
+            return project
+
         save_file = cls.get_save_file(root_path)
         try:
-            return cls.load(save_file)
+            project = cls.load(save_file)
         except Exception as e:
             logger.warning(e)
             logger.info(
                 f"Unable to find existing project at {root_path}, creating new one..."
             )
+        else:
+            # NB: outside the `try`, so a failed rescan can't replace the project
+            if rescan and not project.rescan(root_path).is_empty():
+                project.save(save_file)
+            if memory_budget is not None:
+                project.files.set_memory_budget(memory_budget)
+            return project
 
         traces = TraceList()
-        file_bundles = FileBundleList.build_from_dir(root_path)
-        return cls(traces, file_bundles)
+        file_bundles = FileBundleList.build_from_dir(
+            root_path, scan_cache_file=cls.get_scan_cache_file(root_path)
+        )
+        project = cls(traces, file_bundles)
+        project.save(save_file)
+        if memory_budget is not None:
+            project.files.set_memory_budget(memory_budget)
+        return project
 
     @staticmethod
     def get_save_dir(path: str) -> str:
@@ -66,6 +136,11 @@ class Project:
         save_dir = Project.get_save_dir(path)
         return os.path.join(save_dir, "project.pkl")
 
+    @staticmethod
+    def get_scan_cache_file(path: str) -> str:
+        save_dir = Project.get_save_dir(path)
+        return os.path.join(save_dir, "scan-cache.json")
+
     def filepath(self):
         raise NotImplementedError()
 
@@ -0,0 +1,199 @@
+import logging
+import numpy as np
+import os
+import parselmouth  # type: ignore
+
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image  # type: ignore
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from .files.bundle import FileBundle, FileBundleList
+from .files.descriptor import FileDescriptor
+from .files.loaders.base import FileLoadError, SoundFileLoader
+
+
+logger = logging.getLogger(__name__)
+
+
+FORMATS = ["png", "npy"]
+
+
+class SpectrogramParams(NamedTuple):
+    """The parameters of `GET /spectrogram` (see dev/rest-api-spec.md)."""
+
+    window_length: float = 0.005  # seconds
+    max_frequency: int = 5000  # Hz
+    dynamic_range: int = 90  # dB
+    n_slices: int = 1000  # i.e. the width of the image
+
+
+class Spectrogram(NamedTuple):
+    db: np.ndarray  # float32 (frequencies, slices), highest frequency first
+    start_ms: int
+    stop_ms: int
+
+
+def to_sound(sound_file: SoundFileLoader) -> parselmouth.Sound:
+    samples, rate = sound_file.get_samples()
+    return parselmouth.Sound(samples, sampling_frequency=rate)
+
+
+def compute_spectrogram(
+    sound: parselmouth.Sound, start_ms: int, stop_ms: int, params: SpectrogramParams
+) -> Spectrogram:
+    """Compute the spectrogram of [start_ms, stop_ms) of `sound`, with exactly
+    `params.n_slices` slices (centred in equal steps across the range)."""
+    start = max(0.0, start_ms / 1000)
+    stop = min(stop_ms / 1000, sound.get_total_duration())
+    if stop <= start or params.n_slices <= 0:
+        raise ValueError(f"Invalid spectrogram range ({start_ms}-{stop_ms} ms)")
+    time_step = (stop - start) / params.n_slices
+    times = start + (np.arange(params.n_slices) + 0.5) * time_step
+
+    # NB: Praat needs a whole (Gaussian, so twice as wide) window around the first
+    #     and last slices, and won't use a finer time step than it can resolve, so
+    #     we take the nearest of its slices to each of ours
+    extra = 2 * params.window_length + time_step
+    clip = sound.extract_part(
+        from_time=max(0.0, start - extra),
+        to_time=min(sound.get_total_duration(), stop + extra),
+        preserve_times=True,
+    )
+    spectrogram = clip.to_spectrogram(
+        window_length=params.window_length,
+        time_step=time_step,
+        maximum_frequency=params.max_frequency,
+    )
+    nearest = np.rint((times - spectrogram.x1) / spectrogram.dx).astype(int)
+    db = spectrogram.values[:, nearest.clip(0, spectrogram.nx - 1)].astype(np.float32)
+    with np.errstate(divide="ignore"):
+        np.log10(db, out=db)
+    db *= 10
+    return Spectrogram(np.ascontiguousarray(db[::-1]), start_ms, stop_ms)
+
+
+def render_spectrogram(spectrogram: Spectrogram, dynamic_range: float) -> np.ndarray:
+    """Greyscale (uint8) pixels of the loudest `dynamic_range` dB of a spectrogram,
+    black on white (like Praat)."""
+    loudest = spectrogram.db.max()
+    if not np.isfinite(loudest):
+        # silence (-inf dB throughout) is all white
+        return np.full(spectrogram.db.shape, 255, dtype=np.uint8)
+    levels = spectrogram.db - (loudest - dynamic_range)
+    levels *= 255 / dynamic_range
+    np.clip(levels, 0, 255, out=levels)
+    return 255 - levels.astype(np.uint8)
+
+
+def render_bundle(
+    bundle: FileBundle,
+    start_ms: int,
+    stop_ms: int,
+    params: Optional[SpectrogramParams] = None,
+) -> np.ndarray:
+    """Render (part of) the spectrogram of a bundle's sound file, e.g. for
+    `GET /spectrogram`."""
+    sound_file = bundle.get_sound_file()
+    if sound_file is None:
+        raise ValueError(f"Bundle {bundle.name} has no sound file")
+    params = params or SpectrogramParams()
+    spectrogram = compute_spectrogram(to_sound(sound_file), start_ms, stop_ms, params)
+    return render_spectrogram(spectrogram, params.dynamic_range)
+
+
+def get_segments(
+    duration_ms: int, segment_ms: Optional[int]
+) -> Iterator[Tuple[int, int]]:
+    if not segment_ms:
+        yield 0, duration_ms
+        return
+    for start_ms in range(0, duration_ms, segment_ms):
+        yield start_ms, min(start_ms + segment_ms, duration_ms)
+
+
+def save_spectrogram(
+    spectrogram: Spectrogram, path: str, params: SpectrogramParams, fmt: str
+) -> None:
+    # write under a temporary name so that an interrupted run never leaves half a file
+    tmp_path = f"{path}.tmp.{fmt}"
+    if fmt == "npy":
+        np.save(tmp_path, spectrogram.db)
+    else:
+        image = Image.fromarray(render_spectrogram(spectrogram, params.dynamic_range))
+        image.save(tmp_path)
+    os.replace(tmp_path, path)
+
+
+class RenderJob(NamedTuple):
+    name: str  # of the bundle
+    sound_descriptor: FileDescriptor[SoundFileLoader]
+    output_dir: str
+    params: SpectrogramParams
+    fmt: str
+    segment_ms: Optional[int]
+
+
+def run_render_job(job: RenderJob) -> List[str]:
+    """Render (each segment of) one recording to files, returning their paths.
+
+    NB: This runs in the worker processes of `render_project()`, so it only gets the
+        (picklable) descriptor, and loads the file itself."""
+    sound_file = job.sound_descriptor.load()
+    sound = to_sound(sound_file)
+    paths = []
+    for start_ms, stop_ms in get_segments(len(sound_file), job.segment_ms):
+        spectrogram = compute_spectrogram(sound, start_ms, stop_ms, job.params)
+        suffix = "" if job.segment_ms is None else f"-{start_ms:09d}-{stop_ms:09d}"
+        path = os.path.join(job.output_dir, f"{job.name}{suffix}.{job.fmt}")
+        save_spectrogram(spectrogram, path, job.params, job.fmt)
+        paths.append(path)
+    return paths
+
+
+def render_project(
+    files: FileBundleList,
+    output_dir: str,
+    params: Optional[SpectrogramParams] = None,
+    fmt: str = "png",
+    segment_ms: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> List[str]:
+    """Pre-render the spectrogram of every recording in a project (or of every
+    `segment_ms` of each) into `output_dir`, as PNGs or as .npy arrays of the dB
+    values, fanning the recordings out across a pool of `workers` processes (by
+    default, one per CPU).  Returns the paths of the files written.
+
+    Recordings that can't be loaded are logged and skipped."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Invalid spectrogram format: {fmt}")
+    if segment_ms is not None and segment_ms <= 0:
+        raise ValueError(f"Invalid segment length: {segment_ms}")
+    params = params or SpectrogramParams()
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = [
+        RenderJob(name, bundle.sound_descriptor, output_dir, params, fmt, segment_ms)
+        for name, bundle in sorted(files.bundles.items())
+        if bundle.sound_descriptor is not None
+    ]
+    workers = min(workers or os.cpu_count() or 1, max(1, len(jobs)))
+    logger.info(f"rendering {len(jobs)} spectrograms with {workers} workers")
+
+    paths: List[str] = []
+    if workers == 1:
+        # NB: no need for a pool (or for pickling the jobs)
+        for result in map(_try_render_job, jobs):
+            paths.extend(result)
+        return paths
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for result in executor.map(_try_render_job, jobs):
+            paths.extend(result)
+    return paths
+
+
+def _try_render_job(job: RenderJob) -> List[str]:
+    try:
+        return run_render_job(job)
+    except (FileLoadError, NotImplementedError, ValueError) as e:
+        logger.warning(f"Unable to render spectrogram of {job.name}: {e}")
+        return []
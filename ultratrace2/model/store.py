@@ -0,0 +1,383 @@
+import json
+import logging
+import os
+import sqlite3
+
+from PIL import ImageColor
+from typing import Dict, Iterator, List, Mapping, Optional, Sequence, Tuple
+
+from .color import Color
+from .project import Project
+from .files.bundle import FileBundleList
+from .trace import TraceList
+
+
+logger = logging.getLogger(__name__)
+
+Point = Tuple[float, float]
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS file_paths (
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    path TEXT NOT NULL,
+    PRIMARY KEY (file_id, kind)
+);
+CREATE TABLE IF NOT EXISTS traces (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    color TEXT NOT NULL,
+    is_default INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS xhairs (
+    id INTEGER PRIMARY KEY,
+    trace_id INTEGER NOT NULL REFERENCES traces(id) ON DELETE CASCADE,
+    file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE,
+    frame INTEGER NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS xhairs_by_file ON xhairs (file_id, frame, trace_id);
+CREATE INDEX IF NOT EXISTS xhairs_by_trace ON xhairs (trace_id, file_id, frame);
+"""
+
+
+def color_to_hex(color: Color) -> str:
+    return f"#{color.r:02x}{color.g:02x}{color.b:02x}"
+
+
+def hex_to_color(value: str) -> Color:
+    value = value.lstrip("#")
+    if len(value) != 6:
+        raise ValueError(f"Invalid hex color: '#{value}'")
+    return Color(int(value[0:2], 16), int(value[2:4], 16), int(value[4:6], 16))
+
+
+def normalize_color(value: str) -> str:
+    """Convert a color as saved by the legacy app (a Tk color name like "red", or
+    "#rrggbb") to "#rrggbb"."""
+    try:
+        r, g, b = ImageColor.getrgb(value)[:3]
+    except ValueError:
+        raise ValueError(f"Invalid color: {value!r}")
+    return color_to_hex(Color(r, g, b))
+
+
+def is_media_key(key: str) -> bool:
+    """Whether a key of a legacy metadata.json file entry is a media file (i.e. an
+    extension like ".wav", or the "US.txt" of an ULT recording) rather than
+    bookkeeping like "_prev" or "audio_relpath"."""
+    return key.startswith(".") or key == "US.txt"
+
+
+class ProjectStore:
+    """SQLite-backed storage for a project's file index, traces and crosshairs.
+
+    Crosshairs are stored one row per point, indexed both by (file, frame) and
+    by trace, so that per-file and per-trace queries don't need to load the rest
+    of the project."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("PRAGMA foreign_keys=ON")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise ValueError(
+                f"Unsupported project store version {version} (expected <= {SCHEMA_VERSION}): {db_path}"
+            )
+        with self.conn:
+            self.conn.executescript(SCHEMA)
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    @classmethod
+    def open(cls, root_path: str) -> "ProjectStore":
+        save_dir = Project.get_save_dir(root_path)
+        if not os.path.exists(save_dir):
+            os.mkdir(save_dir, mode=0o755)
+        return cls(cls.get_store_file(root_path))
+
+    @staticmethod
+    def get_store_file(root_path: str) -> str:
+        return os.path.join(Project.get_save_dir(root_path), "project.sqlite3")
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __enter__(self) -> "ProjectStore":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    # file index
+
+    def add_file(self, name: str, paths: Optional[Mapping[str, str]] = None) -> int:
+        with self.conn:
+            file_id = self._get_or_create_file(name)
+            for kind, path in (paths or {}).items():
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO file_paths (file_id, kind, path) VALUES (?, ?, ?)",
+                    (file_id, kind, path),
+                )
+        return file_id
+
+    def get_file_names(self) -> List[str]:
+        return [
+            row[0] for row in self.conn.execute("SELECT name FROM files ORDER BY name")
+        ]
+
+    def get_file_paths(self, name: str) -> Dict[str, str]:
+        return dict(
+            self.conn.execute(
+                "SELECT kind, path FROM file_paths JOIN files ON files.id = file_id WHERE name = ?",
+                (name,),
+            )
+        )
+
+    # traces
+
+    def add_trace(self, name: str, color: Color, is_default: bool = False) -> int:
+        with self.conn:
+            self._upsert_trace(name, color_to_hex(color), is_default)
+        return self._get_trace_id(name)
+
+    def get_traces(self) -> Dict[str, Color]:
+        return {
+            name: hex_to_color(color)
+            for name, color in self.conn.execute(
+                "SELECT name, color FROM traces ORDER BY id"
+            )
+        }
+
+    def get_default_trace(self) -> Optional[str]:
+        row = self.conn.execute(
+            "SELECT name FROM traces WHERE is_default = 1"
+        ).fetchone()
+        return None if row is None else row[0]
+
+    # crosshairs
+
+    def set_xhairs(
+        self, trace: str, file: str, frame: int, points: Sequence[Point]
+    ) -> None:
+        """Replace the crosshairs of a trace on one frame of a file."""
+        with self.conn:
+            trace_id = self._get_trace_id(trace)
+            file_id = self._get_or_create_file(file)
+            self._replace_xhairs(trace_id, file_id, frame, points)
+
+    def get_xhairs(self, trace: str, file: str, frame: int) -> List[Point]:
+        return [
+            (x, y)
+            for x, y in self.conn.execute(
+                "SELECT x, y FROM xhairs "
+                "JOIN traces ON traces.id = trace_id JOIN files ON files.id = file_id "
+                "WHERE traces.name = ? AND files.name = ? AND frame = ? ORDER BY xhairs.id",
+                (trace, file, frame),
+            )
+        ]
+
+    def get_traced_frames(self, file: str) -> Dict[str, List[int]]:
+        """All traced frames of a file, by trace name."""
+        frames: Dict[str, List[int]] = {}
+        for trace, frame in self.conn.execute(
+            "SELECT DISTINCT traces.name, frame FROM xhairs "
+            "JOIN traces ON traces.id = trace_id JOIN files ON files.id = file_id "
+            "WHERE files.name = ? ORDER BY traces.name, frame",
+            (file,),
+        ):
+            frames.setdefault(trace, []).append(frame)
+        return frames
+
+    def iter_traced_frames(self, trace: str) -> Iterator[Tuple[str, int]]:
+        """Every (file name, frame) with crosshairs for a trace, across the project,
+        streamed from the database."""
+        yield from self.conn.execute(
+            "SELECT DISTINCT files.name, frame FROM xhairs "
+            "JOIN traces ON traces.id = trace_id JOIN files ON files.id = file_id "
+            "WHERE traces.name = ? ORDER BY files.name, frame",
+            (trace,),
+        )
+
+    # migration
+
+    def import_metadata(self, metadata_file: str) -> None:
+        """One-shot import of a (legacy) `metadata.json`."""
+        with open(metadata_file) as fp:
+            data = json.load(fp)
+        default_trace = data.get("defaultTraceName")
+        with self.conn:
+            for entry in data.get("files", []):
+                paths = {
+                    kind: path
+                    for kind, path in entry.items()
+                    if is_media_key(kind) and isinstance(path, str)
+                }
+                file_id = self._get_or_create_file(entry["name"])
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO file_paths (file_id, kind, path) VALUES (?, ?, ?)",
+                    [(file_id, kind, path) for kind, path in paths.items()],
+                )
+            for name, trace in data.get("traces", {}).items():
+                color = normalize_color(trace.get("color") or "red")
+                trace_id = self._upsert_trace(name, color, name == default_trace)
+                for file, frames in trace.get("files", {}).items():
+                    file_id = self._get_or_create_file(file)
+                    for frame, points in frames.items():
+                        self._replace_xhairs(
+                            trace_id,
+                            file_id,
+                            int(frame),
+                            [(point["x"], point["y"]) for point in points],
+                        )
+
+    def import_project(self, project: Project) -> None:
+        """One-shot import of a (pickled) ultratrace2 `Project`."""
+        with self.conn:
+            self._write_project(project)
+
+    # projects
+
+    def save_project(self, project: Project) -> None:
+        """Save a project's file index, traces and crosshairs, replacing what we had
+        for its files and dropping the traces it no longer has.  (Crosshairs on files
+        that aren't in the project, e.g. while they're missing from disk, are kept.)"""
+        names = [trace.get_name() for trace in project.traces.traces.values()]
+        with self.conn:
+            self.conn.execute(
+                f"DELETE FROM traces WHERE name NOT IN ({', '.join('?' * len(names))})",
+                names,
+            )
+            for name in project.files.bundles:
+                file_id = self._get_or_create_file(name)
+                self.conn.execute(
+                    "DELETE FROM file_paths WHERE file_id = ?", (file_id,)
+                )
+                self.conn.execute("DELETE FROM xhairs WHERE file_id = ?", (file_id,))
+            self._write_project(project)
+
+    def load_project(self, files: FileBundleList) -> Project:
+        """A `Project` of `files` (e.g. as scanned from the project directory), with
+        the traces and crosshairs we have for them."""
+        traces = TraceList()
+        stored = self.get_traces()
+        if not stored:
+            return Project(traces, files)
+        traces.traces.clear()
+        by_name = {
+            name: traces.add_trace(name, color) for name, color in stored.items()
+        }
+        default_trace = by_name.get(self.get_default_trace() or "")
+        if default_trace is None:
+            default_trace = next(iter(by_name.values()))
+        traces.set_default_trace(default_trace)
+        traces.set_selected_trace(default_trace)
+        for trace, file, frame, x, y in self.conn.execute(
+            "SELECT traces.name, files.name, frame, x, y FROM xhairs "
+            "JOIN traces ON traces.id = trace_id JOIN files ON files.id = file_id "
+            "ORDER BY xhairs.id"
+        ):
+            bundle = files.bundles.get(file)
+            if bundle is not None:
+                by_name[trace].add_xhair(bundle, frame, x, y)
+        return Project(traces, files)
+
+    def migrate(self, root_path: str) -> bool:
+        """Import whichever of `metadata.json` and `.ultratrace/project.pkl` exist
+        under `root_path`; returns whether anything was imported."""
+        migrated = False
+        metadata_file = os.path.join(root_path, "metadata.json")
+        if os.path.exists(metadata_file):
+            logger.info(f"Importing {metadata_file}")
+            self.import_metadata(metadata_file)
+            migrated = True
+        project_file = Project.get_save_file(root_path)
+        if os.path.exists(project_file):
+            logger.info(f"Importing {project_file}")
+            self.import_project(Project.load(project_file))
+            migrated = True
+        return migrated
+
+    # helpers (these don't commit)
+
+    def _write_project(self, project: Project) -> None:
+        default_trace = project.traces.get_default_trace()
+        for name, bundle in project.files.bundles.items():
+            file_id = self._get_or_create_file(name)
+            for kind, descriptor in [
+                ("alignment", bundle.alignment_descriptor),
+                ("image_set", bundle.image_set_descriptor),
+                ("sound", bundle.sound_descriptor),
+            ]:
+                if descriptor is not None:
+                    self.conn.execute(
+                        "INSERT OR REPLACE INTO file_paths (file_id, kind, path) VALUES (?, ?, ?)",
+                        (file_id, kind, descriptor.get_path()),
+                    )
+        for trace in project.traces.traces.values():
+            trace_id = self._upsert_trace(
+                trace.get_name(),
+                color_to_hex(trace.get_color()),
+                trace is default_trace,
+            )
+            for bundle, frames in trace.xhairs.items():
+                file_id = self._get_or_create_file(bundle.name)
+                for frame, xhairs in frames.items():
+                    self._replace_xhairs(
+                        trace_id,
+                        file_id,
+                        frame,
+                        [(xhair.x, xhair.y) for xhair in xhairs],
+                    )
+
+    def _get_or_create_file(self, name: str) -> int:
+        self.conn.execute("INSERT OR IGNORE INTO files (name) VALUES (?)", (name,))
+        return self.conn.execute(
+            "SELECT id FROM files WHERE name = ?", (name,)
+        ).fetchone()[0]
+
+    def _upsert_trace(self, name: str, color: str, is_default: bool) -> int:
+        # NB: not `INSERT OR REPLACE`, which would delete the row (and with it, all
+        #     of the trace's crosshairs)
+        if is_default:
+            self.conn.execute(
+                "UPDATE traces SET is_default = 0 WHERE name != ?", (name,)
+            )
+        # (and not `ON CONFLICT ... DO UPDATE`, which needs SQLite 3.24)
+        self.conn.execute(
+            "INSERT OR IGNORE INTO traces (name, color) VALUES (?, ?)", (name, color)
+        )
+        self.conn.execute(
+            "UPDATE traces SET color = ?, is_default = MAX(is_default, ?) WHERE name = ?",
+            (color, int(is_default), name),
+        )
+        return self._get_trace_id(name)
+
+    def _get_trace_id(self, name: str) -> int:
+        row = self.conn.execute(
+            "SELECT id FROM traces WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"No such trace: {name}")
+        return row[0]
+
+    def _replace_xhairs(
+        self, trace_id: int, file_id: int, frame: int, points: Sequence[Point]
+    ) -> None:
+        self.conn.execute(
+            "DELETE FROM xhairs WHERE trace_id = ? AND file_id = ? AND frame = ?",
+            (trace_id, file_id, frame),
+        )
+        self.conn.executemany(
+            "INSERT INTO xhairs (trace_id, file_id, frame, x, y) VALUES (?, ?, ?, ?, ?)",
+            [(trace_id, file_id, frame, x, y) for x, y in points],
+        )
@@ -19,11 +19,13 @@ def test_load_project_invalid(save_file: str, error: Exception) -> None:
         Project.load(save_file)
 
 
-# FIXME: not implemented, so can't test :/
-"""
-def test_load_project_valid(save_file) -> None:
-    pass
-"""
+def test_save_and_load_project(tmp_path) -> None:
+    save_file = str(tmp_path / "project.pkl")
+    traces = TraceList()
+    Project(traces, FileBundleList({"x": FileBundle("x")})).save(save_file)
+    p = Project.load(save_file)
+    assert list(p.files.bundles) == ["x"]
+    assert p.traces.get_default_trace().get_name() == traces.get_default_trace().name
 
 
 @pytest.mark.parametrize(
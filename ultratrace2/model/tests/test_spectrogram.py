@@ -0,0 +1,125 @@
+import os
+import wave
+
+import numpy as np
+import pytest
+
+from PIL import Image  # type: ignore
+
+from ..files.bundle import FileBundle, FileBundleList
+from ..files.descriptor import FileDescriptor
+from ..files.loaders.wav import WAVLoader
+from ..spectrogram import (
+    Spectrogram,
+    SpectrogramParams,
+    compute_spectrogram,
+    render_bundle,
+    render_project,
+    render_spectrogram,
+    to_sound,
+)
+
+
+def make_wav(path, duration=2.0, rate=16000, channels=1, frequency=440) -> str:
+    t = np.arange(int(duration * rate)) / rate
+    samples = (np.sin(2 * np.pi * frequency * t) * 8000).astype("<i2")
+    if channels == 2:
+        samples = np.stack([samples, samples // 2], axis=1).ravel()
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(samples.tobytes())
+    return str(path)
+
+
+def make_files(tmp_path, names) -> FileBundleList:
+    bundles = {}
+    for name in names:
+        path = make_wav(tmp_path / f"{name}.wav")
+        bundle = FileBundle(name)
+        bundle.set_descriptor(FileDescriptor(path, WAVLoader))
+        bundles[name] = bundle
+    return FileBundleList(bundles)
+
+
+def test_samples(tmp_path) -> None:
+    loader = WAVLoader.from_file(make_wav(tmp_path / "a.wav", channels=2))
+    samples, rate = loader.get_samples()
+    assert rate == 16000
+    assert samples.shape == (2, 32000)
+    assert 0.2 < samples[0].max() <= 0.25
+    assert np.allclose(samples[1], samples[0] / 2, atol=1e-4)
+
+
+def test_compute_spectrogram(tmp_path) -> None:
+    loader = WAVLoader.from_file(make_wav(tmp_path / "a.wav"))
+    params = SpectrogramParams(n_slices=300)
+    spectrogram = compute_spectrogram(to_sound(loader), 500, 1500, params)
+    assert spectrogram.db.shape[1] == 300
+    assert spectrogram.db.dtype == np.float32
+
+    # the loudest frequency (highest first) is our 440Hz tone
+    loudest = spectrogram.db.mean(axis=1).argmax()
+    n_frequencies = spectrogram.db.shape[0]
+    frequency = (n_frequencies - loudest - 0.5) * params.max_frequency / n_frequencies
+    assert abs(frequency - 440) < 50
+
+    with pytest.raises(ValueError):
+        compute_spectrogram(to_sound(loader), 2500, 3000, params)
+
+
+def test_render_bundle(tmp_path) -> None:
+    bundle = make_files(tmp_path, ["a"]).bundles["a"]
+    pixels = render_bundle(bundle, 0, 2000, SpectrogramParams(n_slices=100))
+    assert pixels.dtype == np.uint8
+    assert pixels.shape[1] == 100
+    # the tone is black, and anything more than the dynamic range below it white
+    assert pixels.min() == 0 and pixels.max() == 255
+
+    with pytest.raises(ValueError):
+        render_bundle(FileBundle("empty"), 0, 2000)
+
+
+def test_render_silence() -> None:
+    silence = Spectrogram(np.full((64, 100), -np.inf, dtype=np.float32), 0, 1000)
+    # (no NaN levels on the way)
+    with np.errstate(invalid="raise"):
+        pixels = render_spectrogram(silence, 90)
+    assert pixels.dtype == np.uint8
+    assert pixels.shape == (64, 100)
+    assert (pixels == 255).all()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_render_project(tmp_path, workers) -> None:
+    files = make_files(tmp_path, ["a", "b"])
+    # unreadable files are skipped
+    (tmp_path / "c.wav").write_text("not a wav")
+    files.bundles["c"] = FileBundle("c")
+    files.bundles["c"].set_descriptor(
+        FileDescriptor(str(tmp_path / "c.wav"), WAVLoader)
+    )
+
+    output_dir = str(tmp_path / "out")
+    params = SpectrogramParams(n_slices=50)
+    paths = render_project(files, output_dir, params, workers=workers)
+    assert paths == [os.path.join(output_dir, f"{name}.png") for name in "ab"]
+    assert Image.open(paths[0]).size[0] == 50
+
+    paths = render_project(files, output_dir, params, fmt="npy", segment_ms=1500)
+    assert [os.path.basename(path) for path in paths] == [
+        "a-000000000-000001500.npy",
+        "a-000001500-000002000.npy",
+        "b-000000000-000001500.npy",
+        "b-000001500-000002000.npy",
+    ]
+    assert np.load(paths[0]).shape[1] == 50
+
+
+def test_render_project_invalid(tmp_path) -> None:
+    files = make_files(tmp_path, ["a"])
+    with pytest.raises(ValueError):
+        render_project(files, str(tmp_path), fmt="jpeg")
+    with pytest.raises(ValueError):
+        render_project(files, str(tmp_path), segment_ms=0)
@@ -0,0 +1,193 @@
+import json
+
+import pytest
+
+from ..color import Color
+from ..files.bundle import FileBundleList
+from ..project import Project
+from ..store import ProjectStore, color_to_hex, hex_to_color, normalize_color
+from ..trace import TraceList
+from .test_spectrogram import make_wav
+
+
+@pytest.fixture
+def store(tmp_path):
+    with ProjectStore.open(str(tmp_path)) as store:
+        yield store
+
+
+def test_color_hex_round_trip():
+    color = Color(1, 128, 255)
+    assert color_to_hex(color) == "#0180ff"
+    assert hex_to_color("#0180ff") == color
+    with pytest.raises(ValueError):
+        hex_to_color("#fff")
+
+
+def test_normalize_color():
+    assert normalize_color("red") == "#ff0000"
+    assert normalize_color("#00Ff00") == "#00ff00"
+    with pytest.raises(ValueError):
+        normalize_color("not-a-color")
+
+
+def test_open_creates_store_file(tmp_path):
+    with ProjectStore.open(str(tmp_path)):
+        pass
+    assert (tmp_path / ".ultratrace" / "project.sqlite3").exists()
+
+
+def test_set_and_get_xhairs(store):
+    store.add_trace("tongue", Color(255, 0, 0), is_default=True)
+    store.set_xhairs("tongue", "file1", 3, [(0.1, 0.2), (0.3, 0.4)])
+    assert store.get_xhairs("tongue", "file1", 3) == [(0.1, 0.2), (0.3, 0.4)]
+    store.set_xhairs("tongue", "file1", 3, [(0.5, 0.6)])
+    assert store.get_xhairs("tongue", "file1", 3) == [(0.5, 0.6)]
+    assert store.get_xhairs("tongue", "file1", 4) == []
+    assert store.get_default_trace() == "tongue"
+    with pytest.raises(KeyError):
+        store.set_xhairs("palate", "file1", 3, [(0.5, 0.6)])
+
+
+def test_traced_frames(store):
+    store.add_trace("tongue", Color(255, 0, 0))
+    store.add_trace("palate", Color(0, 0, 255))
+    store.set_xhairs("tongue", "file1", 2, [(0.1, 0.1)])
+    store.set_xhairs("tongue", "file1", 1, [(0.1, 0.1), (0.2, 0.2)])
+    store.set_xhairs("palate", "file1", 5, [(0.1, 0.1)])
+    store.set_xhairs("tongue", "file2", 7, [(0.1, 0.1)])
+    store.set_xhairs("tongue", "file2", 8, [])
+    assert store.get_traced_frames("file1") == {"palate": [5], "tongue": [1, 2]}
+    assert list(store.iter_traced_frames("tongue")) == [
+        ("file1", 1),
+        ("file1", 2),
+        ("file2", 7),
+    ]
+
+
+def test_import_metadata(store, tmp_path):
+    metadata = {
+        "defaultTraceName": "tongue",
+        "files": [
+            {
+                "name": "file1",
+                ".wav": "file1.wav",
+                ".TextGrid": "file1.TextGrid",
+                "_prev": None,
+                "_next": "file2",
+                "audio_relpath": "audio",
+                "processed": None,
+            }
+        ],
+        "traces": {
+            "tongue": {
+                "color": "red",
+                "files": {"file1": {"2": [{"x": 0.25, "y": 0.5}]}},
+            }
+        },
+    }
+    metadata_file = tmp_path / "metadata.json"
+    metadata_file.write_text(json.dumps(metadata))
+
+    assert store.migrate(str(tmp_path))
+    assert store.get_file_names() == ["file1"]
+    assert store.get_file_paths("file1") == {
+        ".wav": "file1.wav",
+        ".TextGrid": "file1.TextGrid",
+    }
+    assert store.get_traces() == {"tongue": Color(255, 0, 0)}
+    assert store.get_default_trace() == "tongue"
+    assert store.get_xhairs("tongue", "file1", 2) == [(0.25, 0.5)]
+
+
+def test_import_project(store, mocker):
+    MockFileBundle = mocker.patch("ultratrace2.model.files.bundle.FileBundle")
+    bundle = MockFileBundle.return_value
+    bundle.name = "file1"
+    bundle.alignment_descriptor = None
+    bundle.image_set_descriptor = None
+    bundle.sound_descriptor.get_path.return_value = "/data/file1.wav"
+    traces = TraceList()
+    trace = traces.get_default_trace()
+    trace.add_xhair(bundle, 4, 0.5, 0.75)
+    project = Project(traces, FileBundleList({"file1": bundle}))
+
+    store.import_project(project)
+    assert store.get_file_names() == ["file1"]
+    assert store.get_file_paths("file1") == {"sound": "/data/file1.wav"}
+    assert store.get_default_trace() == trace.get_name()
+    assert store.get_traces() == {trace.get_name(): trace.get_color()}
+    assert store.get_xhairs(trace.get_name(), "file1", 4) == [(0.5, 0.75)]
+
+
+def test_reimport_keeps_xhairs(store, tmp_path):
+    metadata = {
+        "traces": {
+            "tongue": {
+                "color": "red",
+                "files": {"file1": {"1": [{"x": 0.1, "y": 0.1}]}},
+            }
+        },
+    }
+    metadata_file = tmp_path / "metadata.json"
+    metadata_file.write_text(json.dumps(metadata))
+    store.import_metadata(str(metadata_file))
+
+    # the same trace, with different frames
+    metadata["traces"]["tongue"]["files"] = {"file1": {"2": [{"x": 0.2, "y": 0.2}]}}
+    metadata_file.write_text(json.dumps(metadata))
+    store.import_metadata(str(metadata_file))
+
+    assert store.get_xhairs("tongue", "file1", 1) == [(0.1, 0.1)]
+    assert store.get_xhairs("tongue", "file1", 2) == [(0.2, 0.2)]
+
+
+def get_xhairs(project, trace, name, frame):
+    bundle = project.files.bundles[name]
+    return sorted((xhair.x, xhair.y) for xhair in trace.xhairs[bundle][frame])
+
+
+def test_project_round_trip(tmp_path):
+    make_wav(tmp_path / "a.wav")
+    root_path = str(tmp_path)
+    project = Project.get_by_path(root_path, use_store=True)
+    bundle = project.files.bundles["a"]
+    tongue = project.traces.get_default_trace()
+    tongue.add_xhair(bundle, 3, 0.25, 0.5)
+    tongue.add_xhair(bundle, 3, 0.75, 0.5)
+    palate = project.traces.add_trace("palate", Color(0, 0, 255))
+    palate.add_xhair(bundle, 4, 0.1, 0.2)
+    project.traces.set_default_trace(palate)
+    project.save_to_store(root_path)
+
+    loaded = Project.get_by_path(root_path, use_store=True)
+    traces = {trace.get_name(): trace for trace in loaded.traces.traces.values()}
+    assert list(traces) == ["tongue", "palate"]
+    assert traces["palate"].get_color() == Color(0, 0, 255)
+    assert loaded.traces.get_default_trace() is traces["palate"]
+    assert get_xhairs(loaded, traces["tongue"], "a", 3) == [(0.25, 0.5), (0.75, 0.5)]
+    assert get_xhairs(loaded, traces["palate"], "a", 4) == [(0.1, 0.2)]
+    assert not (tmp_path / ".ultratrace" / "project.pkl").exists()
+
+    # traces (and crosshairs) removed from the project are removed from the store
+    del loaded.traces.traces[traces["palate"].id]
+    loaded.traces.set_default_trace(traces["tongue"])
+    loaded.save_to_store(root_path)
+    with ProjectStore.open(root_path) as store:
+        assert list(store.get_traces()) == ["tongue"]
+        assert store.get_default_trace() == "tongue"
+        assert store.get_traced_frames("a") == {"tongue": [3]}
+
+
+def test_project_store_imports_pickled_project(tmp_path):
+    make_wav(tmp_path / "a.wav")
+    root_path = str(tmp_path)
+    project = Project.get_by_path(root_path)
+    project.traces.get_default_trace().add_xhair(
+        project.files.bundles["a"], 1, 0.5, 0.5
+    )
+    project.save(Project.get_save_file(root_path))
+
+    loaded = Project.get_by_path(root_path, use_store=True)
+    tongue = loaded.traces.get_default_trace()
+    assert get_xhairs(loaded, tongue, "a", 1) == [(0.5, 0.5)]
@@ -64,3 +64,22 @@ def test_add_trace():
     tl = TraceList()
     tr = tl.add_trace("test", Color(0, 0, 0))
     assert tr.id in tl.traces
+
+
+def test_get_nearest_xhair(mocker):
+    MockFileBundle = mocker.patch("ultratrace2.model.files.bundle.FileBundle")
+    file_bundle = MockFileBundle.return_value
+    tr = Trace("test", Color(0, 0, 0))
+    near = tr.add_xhair(file_bundle, 0, 0.5, 0.5)
+    far = tr.add_xhair(file_bundle, 0, 0.9, 0.9)
+    other_frame = tr.add_xhair(file_bundle, 1, 0.5, 0.5)
+
+    assert tr.get_nearest_xhair(file_bundle, 0, 0.55, 0.5) is near
+    assert tr.get_nearest_xhair(file_bundle, 1, 0.9, 0.9) is other_frame
+    assert tr.get_nearest_xhair(file_bundle, 2, 0.5, 0.5) is None
+
+    tr.move_xhair(file_bundle, 0, far, 0.56, 0.5)
+    assert tr.get_nearest_xhair(file_bundle, 0, 0.57, 0.5) is far
+    tr.remove_xhair(file_bundle, 0, far)
+    assert tr.get_nearest_xhair(file_bundle, 0, 0.57, 0.5) is near
+    assert tr.get_xhairs_in_box(file_bundle, 0, 0.4, 0.4, 0.6, 0.6) == [near]
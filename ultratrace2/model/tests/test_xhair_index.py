@@ -0,0 +1,90 @@
+import random
+
+import pytest
+
+from ..color import Color
+from ..xhair import XHair
+from ..xhair_index import XHairIndex
+
+
+def _get_black() -> Color:
+    return Color(0, 0, 0)
+
+
+def _brute_force_nearest(xhairs, x, y):
+    return min(xhairs, key=lambda xhair: xhair.sq_dist_from((x, y)))
+
+
+def test_invalid_cell_size():
+    with pytest.raises(ValueError):
+        XHairIndex(0)
+
+
+def test_empty_index():
+    index = XHairIndex()
+    assert len(index) == 0
+    assert index.get_nearest(0.5, 0.5) is None
+    assert index.get_nearest(0.5, 0.5, max_dist=1) is None
+    assert index.get_in_box(0, 0, 1, 1) == []
+
+
+@pytest.mark.parametrize("cell_size", [1 / 64, 0.1, 1])
+def test_get_nearest_matches_brute_force(cell_size: float):
+    rng = random.Random(0)
+    xhairs = [XHair(_get_black, rng.random(), rng.random()) for _ in range(300)]
+    index = XHairIndex(cell_size)
+    for xhair in xhairs:
+        index.add(xhair)
+    for _ in range(100):
+        x, y = rng.uniform(-0.5, 1.5), rng.uniform(-0.5, 1.5)
+        nearest = index.get_nearest(x, y)
+        assert nearest is not None
+        expected = _brute_force_nearest(xhairs, x, y)
+        assert nearest.sq_dist_from((x, y)) == expected.sq_dist_from((x, y))
+
+
+def test_get_nearest_within_max_dist():
+    near = XHair(_get_black, 0.5, 0.5)
+    far = XHair(_get_black, 0.9, 0.9)
+    index = XHairIndex()
+    index.add(near)
+    index.add(far)
+    assert index.get_nearest(0.52, 0.5, max_dist=0.05) is near
+    assert index.get_nearest(0.7, 0.7, max_dist=0.05) is None
+
+
+def test_get_nearest_skips_hidden():
+    hidden = XHair(_get_black, 0.5, 0.5)
+    visible = XHair(_get_black, 0.6, 0.6)
+    hidden.hide()
+    index = XHairIndex()
+    index.add(hidden)
+    index.add(visible)
+    assert index.get_nearest(0.5, 0.5) is visible
+    assert index.get_nearest(0.5, 0.5, include_hidden=True) is hidden
+
+
+def test_get_in_box():
+    inside = XHair(_get_black, 0.2, 0.3)
+    outside = XHair(_get_black, 0.6, 0.3)
+    index = XHairIndex()
+    index.add(inside)
+    index.add(outside)
+    assert index.get_in_box(0.1, 0.1, 0.5, 0.5) == [inside]
+    # corners can be given in any order
+    assert index.get_in_box(0.5, 0.5, 0.1, 0.1) == [inside]
+    assert set(index.get_in_box(-10, -10, 10, 10)) == {inside, outside}
+
+
+def test_move_and_remove():
+    xhair = XHair(_get_black, 0.1, 0.1)
+    index = XHairIndex()
+    index.add(xhair)
+    index.move(xhair, 0.9, 0.9)
+    assert (xhair.x, xhair.y) == (0.9, 0.9)
+    assert index.get_in_box(0, 0, 0.5, 0.5) == []
+    assert index.get_in_box(0.5, 0.5, 1, 1) == [xhair]
+    index.remove(xhair)
+    assert xhair not in index
+    assert len(index) == 0
+    assert index.cells == {}
@@ -1,9 +1,10 @@
 from collections import OrderedDict
-from typing import ClassVar, Dict, Optional, Set, TYPE_CHECKING
+from typing import Any, ClassVar, Dict, List, Optional, Set, TYPE_CHECKING
 from uuid import uuid4, UUID
 
 from .color import Color, get_random_color, RED
 from .xhair import XHair
+from .xhair_index import XHairIndex
 
 if TYPE_CHECKING:
     from .files.bundle import FileBundle
@@ -18,9 +19,20 @@ class Trace:
         self.id: UUID = uuid4()
         self.is_visible: bool = True
         self.xhairs: Dict["FileBundle", Dict[int, Set[XHair]]] = {}
+        self.xhair_indices: Dict["FileBundle", Dict[int, XHairIndex]] = {}
         self.name = name
         self.color = color
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # the indices are cheap to rebuild, so don't save them with the project
+        state = self.__dict__.copy()
+        state["xhair_indices"] = {}
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        state.setdefault("xhair_indices", {})
+        self.__dict__.update(state)
+
     def get_color(self) -> Color:
         return self.color
 
@@ -45,13 +57,57 @@ class Trace:
     def hide(self) -> None:
         self.is_visible = False
 
-    def add_xhair(self, bundle: "FileBundle", frame: int, x: float, y: float) -> None:
+    def add_xhair(self, bundle: "FileBundle", frame: int, x: float, y: float) -> XHair:
         if bundle not in self.xhairs:
             self.xhairs[bundle] = {}
         if frame not in self.xhairs[bundle]:
             self.xhairs[bundle][frame] = set()
         xhair = XHair(self.get_color, x, y)
         self.xhairs[bundle][frame].add(xhair)
+        self._get_xhair_index(bundle, frame).add(xhair)
+        return xhair
+
+    def remove_xhair(self, bundle: "FileBundle", frame: int, xhair: XHair) -> None:
+        self.xhairs[bundle][frame].discard(xhair)
+        self._get_xhair_index(bundle, frame).remove(xhair)
+
+    def move_xhair(
+        self, bundle: "FileBundle", frame: int, xhair: XHair, x: float, y: float
+    ) -> None:
+        self._get_xhair_index(bundle, frame).move(xhair, x, y)
+
+    def get_nearest_xhair(
+        self,
+        bundle: "FileBundle",
+        frame: int,
+        x: float,
+        y: float,
+        max_dist: Optional[float] = None,
+    ) -> Optional[XHair]:
+        return self._get_xhair_index(bundle, frame).get_nearest(x, y, max_dist)
+
+    def get_xhairs_in_box(
+        self,
+        bundle: "FileBundle",
+        frame: int,
+        x1: float,
+        y1: float,
+        x2: float,
+        y2: float,
+    ) -> List[XHair]:
+        return self._get_xhair_index(bundle, frame).get_in_box(x1, y1, x2, y2)
+
+    def _get_xhair_index(self, bundle: "FileBundle", frame: int) -> XHairIndex:
+        if bundle not in self.xhair_indices:
+            self.xhair_indices[bundle] = {}
+        index = self.xhair_indices[bundle].get(frame)
+        if index is None:
+            # (re)build it from whatever XHairs this frame has
+            index = XHairIndex()
+            for xhair in self.xhairs.get(bundle, {}).get(frame, ()):
+                index.add(xhair)
+            self.xhair_indices[bundle][frame] = index
+        return index
 
 
 class TraceList:
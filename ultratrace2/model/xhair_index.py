@@ -0,0 +1,154 @@
+import math
+from typing import Dict, List, Optional, Set, Tuple
+
+from .xhair import XHair
+
+Cell = Tuple[int, int]
+
+
+class XHairIndex:
+    """Uniform grid over XHair coordinates, for nearest-neighbour and box queries.
+
+    The index has to be told when an XHair moves (see `move()`), since XHairs
+    don't know which indices they belong to."""
+
+    DEFAULT_CELL_SIZE = 1 / 64
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        if cell_size <= 0:
+            raise ValueError(f"Cell size must be positive, but got {cell_size}")
+        self.cell_size = cell_size
+        self.cells: Dict[Cell, Set[XHair]] = {}
+        self.positions: Dict[XHair, Cell] = {}
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __contains__(self, xhair: XHair) -> bool:
+        return xhair in self.positions
+
+    def _get_cell(self, x: float, y: float) -> Cell:
+        return (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+
+    def add(self, xhair: XHair) -> None:
+        cell = self._get_cell(xhair.x, xhair.y)
+        old_cell = self.positions.get(xhair)
+        if old_cell == cell:
+            return
+        if old_cell is not None:
+            self.remove(xhair)
+        self.positions[xhair] = cell
+        self.cells.setdefault(cell, set()).add(xhair)
+
+    def remove(self, xhair: XHair) -> None:
+        cell = self.positions.pop(xhair, None)
+        if cell is None:
+            return
+        self.cells[cell].discard(xhair)
+        if not self.cells[cell]:
+            del self.cells[cell]
+
+    def move(self, xhair: XHair, x: float, y: float) -> None:
+        xhair.move(x, y)
+        self.add(xhair)
+
+    def get_in_box(
+        self, x1: float, y1: float, x2: float, y2: float, include_hidden: bool = False
+    ) -> List[XHair]:
+        x_min, x_max = min(x1, x2), max(x1, x2)
+        y_min, y_max = min(y1, y2), max(y1, y2)
+        return [
+            xhair
+            for xhair in self._get_candidates(x_min, y_min, x_max, y_max)
+            if x_min <= xhair.x <= x_max
+            and y_min <= xhair.y <= y_max
+            and (include_hidden or not xhair.is_hidden)
+        ]
+
+    def get_nearest(
+        self,
+        x: float,
+        y: float,
+        max_dist: Optional[float] = None,
+        include_hidden: bool = False,
+    ) -> Optional[XHair]:
+        """Returns the XHair closest to (x, y), optionally only if it is within
+        `max_dist`, searching outwards one ring of cells at a time."""
+        if max_dist is not None:
+            candidates = self._get_candidates(
+                x - max_dist, y - max_dist, x + max_dist, y + max_dist
+            )
+            return self._get_closest(candidates, (x, y), max_dist ** 2, include_hidden)
+
+        if not self.positions:
+            return None
+        cx, cy = self._get_cell(x, y)
+        x_cells = [cell[0] for cell in self.cells]
+        y_cells = [cell[1] for cell in self.cells]
+        max_ring = max(
+            abs(cx - min(x_cells)),
+            abs(cx - max(x_cells)),
+            abs(cy - min(y_cells)),
+            abs(cy - max(y_cells)),
+        )
+        best: Optional[XHair] = None
+        best_sq_dist = math.inf
+        for ring in range(max_ring + 1):
+            # anything in a further ring is at least this far away
+            if best is not None and best_sq_dist <= ((ring - 1) * self.cell_size) ** 2:
+                break
+            ring_best = self._get_closest(
+                self._get_ring(cx, cy, ring), (x, y), best_sq_dist, include_hidden
+            )
+            if ring_best is not None:
+                best = ring_best
+                best_sq_dist = ring_best.sq_dist_from((x, y))
+        return best
+
+    def _get_closest(
+        self,
+        candidates: List[XHair],
+        point: Tuple[float, float],
+        max_sq_dist: float,
+        include_hidden: bool,
+    ) -> Optional[XHair]:
+        best: Optional[XHair] = None
+        for xhair in candidates:
+            if xhair.is_hidden and not include_hidden:
+                continue
+            sq_dist = xhair.sq_dist_from(point)
+            if sq_dist <= max_sq_dist:
+                best = xhair
+                max_sq_dist = sq_dist
+        return best
+
+    def _get_ring(self, cx: int, cy: int, ring: int) -> List[XHair]:
+        if ring == 0:
+            return list(self.cells.get((cx, cy), ()))
+        xhairs: List[XHair] = []
+        for dx in range(-ring, ring + 1):
+            for dy in (-ring, ring):
+                xhairs.extend(self.cells.get((cx + dx, cy + dy), ()))
+        for dy in range(-ring + 1, ring):
+            for dx in (-ring, ring):
+                xhairs.extend(self.cells.get((cx + dx, cy + dy), ()))
+        return xhairs
+
+    def _get_candidates(
+        self, x_min: float, y_min: float, x_max: float, y_max: float
+    ) -> List[XHair]:
+        cx_min, cy_min = self._get_cell(x_min, y_min)
+        cx_max, cy_max = self._get_cell(x_max, y_max)
+        if (cx_max - cx_min + 1) * (cy_max - cy_min + 1) > len(self.cells):
+            # cheaper to walk the occupied cells than every cell in the box
+            return [
+                xhair
+                for (cx, cy), xhairs in self.cells.items()
+                if cx_min <= cx <= cx_max and cy_min <= cy <= cy_max
+                for xhair in xhairs
+            ]
+        candidates: List[XHair] = []
+        for cx in range(cx_min, cx_max + 1):
+            for cy in range(cy_min, cy_max + 1):
+                candidates.extend(self.cells.get((cx, cy), ()))
+        return candidates